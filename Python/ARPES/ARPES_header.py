@@ -40,31 +40,182 @@ Methods (self.*)
 :pols: broadcasted polar angles (if available)
 
 .. note::
+    broadcasted variables (angs, ens, pols, hvs) are not stored, Methods
+    builds them on demand as views of the 1-dimensional axes.
     convention of broadcasting dimensions: *.size
         - 3-dimensional (pol*, ang*, en*)
         - 3-dimensional (hv*, ang*, en*)
         - 2-dimensional (ang*, en*)
+    loaders take crop=dict(en=.., ang=.., pol=.. / hv=..) to read only a
+    slab of the data (see Methods.crop).
     Todo
         - proper implementation of Bessy header
 """
 
 import os
+import re
+import copy
+import json
+import time
+import threading
+import multiprocessing
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                as_completed)
 import h5py
 import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
 from astropy.io import fits
 from igor import binarywave
 
+import ARPES_utils as utils
 from ARPES_methods import Methods  # Methods superclass
 
 
+class H5Array:
+    """
+    %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+           Lazy HDF5 array
+    %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+    **Array-like view on an open h5py dataset. Indexing reads only the
+    requested slab from the file (chunk by chunk through h5py) and returns
+    a numpy array; np.asarray(...) reads the whole view.**
+
+    .. note::
+        The view is read-only. Methods that manipulate the intensity in
+        place need the data in memory: self.int = np.asarray(self.int)
+    """
+
+    def __init__(self, dset, sel=(), axes=None, func=None):
+        """returns self.dset, self.sel, self.axes, self.func
+
+        **Initializing lazy view**
+
+        Args
+        ----
+        :dset:      h5py dataset
+        :sel:       selection in dataset axis order (integers drop an axis,
+                    slices crop it), missing axes are taken in full
+        :axes:      order of the remaining dataset axes in the view
+        :func:      element-wise function applied to data read (e.g. np.sqrt)
+
+        Return
+        ------
+        :self.dset:     h5py dataset
+        :self.sel:      selection (integers and ranges) in dataset order
+        :self.axes:     dataset axes of the view, in view order
+        :self.func:     element-wise function
+        """
+
+        sel = tuple(sel) + (slice(None),) * (dset.ndim - len(sel))
+        self.sel = [s if isinstance(s, (int, np.integer))
+                    else range(*s.indices(n))
+                    for s, n in zip(sel, dset.shape)]
+        free = [d for d, s in enumerate(self.sel) if isinstance(s, range)]
+        if axes is None:
+            axes = range(len(free))
+        self.axes = [free[ax] for ax in axes]
+        self.dset = dset
+        self.func = func
+
+    @property
+    def shape(self):
+        return tuple(len(self.sel[d]) for d in self.axes)
+
+    @property
+    def ndim(self):
+        return len(self.axes)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def dtype(self):
+        return self.dset.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        """returns data
+
+        **Reads the slab selected by key (integers, slices, arrays)**
+        """
+
+        # Expand key to one entry per view axis
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = [k is Ellipsis for k in key].index(True)
+            key = (key[:i] + (slice(None),) * (self.ndim - len(key) + 1) +
+                   key[i+1:])
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        # Translate into a dataset selection, the rest is done by numpy
+        sel = list(self.sel)
+        post = []
+        for d, k in zip(self.axes, key):
+            if isinstance(k, (int, np.integer)):
+                sel[d] = self.sel[d][k]
+            elif isinstance(k, slice) and self.sel[d][k].step > 0:
+                sel[d] = self.sel[d][k]
+                post.append(slice(None))
+            else:
+                post.append(k)
+
+        data = self.dset[tuple(s if isinstance(s, (int, np.integer))
+                               else slice(s.start, s.start + len(s) * s.step,
+                                          s.step)
+                               for s in sel)]
+
+        # Dataset order -> view order
+        free = [d for d, s in enumerate(sel) if isinstance(s, range)]
+        data = np.transpose(data, [free.index(d) for d in self.axes
+                                   if d in free])
+        data = data[tuple(post)]
+        if self.func is not None:
+            data = self.func(data)
+
+        return data
+
+    def slab(self, key):
+        """returns view
+
+        **Lazy view on the slab selected by key (slices only), nothing
+        is read from the file**
+        """
+
+        if not isinstance(key, tuple):
+            key = (key,)
+        view = copy.copy(self)
+        view.sel = list(self.sel)
+        for d, k in zip(self.axes, key):
+            view.sel[d] = self.sel[d][k]
+
+        return view
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[...]
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+
 class DLS(Methods):
     """
     %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
               Data loader DLS
     %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+    .. note::
+        - lazy=True keeps the file open (self.h5), self.int and self.eint
+          are H5Array views that only read the slabs which are accessed.
+        - crop=dict(en=(.., ..), ang=(.., ..), pol=(.., ..)) only reads the
+          slab within these ranges (see Methods.crop).
     """
 
-    def __init__(self, file, mat, year, sample):
+    def __init__(self, file, mat, year, sample, lazy=False, crop=None):
         # Define directories
         folder = ''.join(['/Users/denyssutter/Documents/2_physics/DATA/',
                           str(mat), '/Diamond', str(year), '/', str(sample), '/'])
@@ -76,31 +227,37 @@ class DLS(Methods):
 
         # Read meta data
         f = h5py.File(path, 'r')  # Read file with h5py reader
-        data_list = list(f['/entry1/analyser/data'])
-        ang = np.array(list(f['/entry1/analyser/angles']))
-        en = np.array(list(f['/entry1/analyser/energies']))
-        photon = np.array(list(f['/entry1/instrument/monochromator/energy']))
+        data_meta = f['/entry1/analyser/data']
+        ang = f['/entry1/analyser/angles'][()]
+        en = f['/entry1/analyser/energies'][()]
+        photon = f['/entry1/instrument/monochromator/energy'][()]
+
+        self.ang = ang
+        self.en = en
 
         # Try if polar angles available
         try:
-            pol = np.array(list(f['/entry1/analyser/sapolar']))
-            data = np.array(data_list)[:, :, :]
-
+            pol = f['/entry1/analyser/sapolar'][()]
             self.pol = pol
-            self.ens = np.broadcast_to(en, (pol.size, ang.size, en.size))
-            self.angs = np.transpose(
-                            np.broadcast_to(
-                                    ang, (pol.size, en.size, ang.size)),
-                            (0, 2, 1))
-            self.pols = np.transpose(
-                            np.broadcast_to(
-                                    pol, (ang.size, en.size, pol.size)),
-                            (2, 0, 1))
+            s_scan, s_ang, s_en = self._crop_index(**(crop or {}))
+            sel = (s_scan, s_ang, s_en)
+            self.pol = pol[s_scan]
         except KeyError:
             print('- No polar angles available \n')
-            data = np.asarray(data_list)[0, :, :]
-            self.ens = np.broadcast_to(en, (ang.size, en.size))
-            self.angs = np.transpose(np.broadcast_to(ang, (en.size, ang.size)))
+            s_scan, s_ang, s_en = self._crop_index(**(crop or {}))
+            sel = (0, s_ang, s_en)
+        ang = ang[s_ang]
+        en = en[s_en]
+
+        # Read data in one pass, or keep the file open for slab reads
+        if lazy:
+            data = H5Array(data_meta, sel)
+            self.eint = H5Array(data_meta, sel, func=np.sqrt)
+            self.h5 = f
+        else:
+            data = data_meta[sel]
+            self.eint = np.sqrt(data)
+            f.close()
 
         self.file = file
         self.mat = mat
@@ -112,7 +269,6 @@ class DLS(Methods):
         self.ang = ang
         self.en = en
         self.int = data
-        self.eint = np.sqrt(data)
         self.hv = photon
 
         print('\n ~ Initialization complete. Data has {} dimensions'.format(
@@ -126,9 +282,12 @@ class ALS(Methods):
     %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
               Data loader ALS
     %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+    .. note::
+        - crop=dict(en=(.., ..), ang=(.., ..), pol=(.., ..)) crops the
+          memory-mapped data before anything is read (see Methods.crop).
     """
 
-    def __init__(self, file, mat, year, sample):
+    def __init__(self, file, mat, year, sample, crop=None):
         # Define directories
         folder = ''.join(['/Users/denyssutter/Documents/2_physics/DATA/',
                           str(mat), '/ALS', str(year), '/', str(sample), '/'])
@@ -138,8 +297,8 @@ class ALS(Methods):
               .format(path),
               '\n', '==========================================')
 
-        # Read meta data
-        f = fits.open(path)
+        # Read meta data, the table is memory-mapped
+        f = fits.open(path, memmap=True)
         hdr = f[0].header  # load header
         meta_data = f[1].data
         mode = hdr['NM_0_0']  # scan mode
@@ -155,21 +314,26 @@ class ALS(Methods):
         binning = 4  # I think this is the correct binning
         npol = meta_data.size  # number of polar cuts
         (nen, nang) = meta_data[0][-1].shape  # number of energy, angle steps
-        data = np.zeros((npol, nang, nen))  # Placeholder
 
         # Build up data
         en = (np.arange(e_i, e_f, 1.) - Ef) / px_per_en
         ang = np.arange(a_i, a_f, 1.) * ang_per_px / binning
         pol = np.arange(0, npol, 1.)
         if mode == 'Beta':
-            for i in range(npol):
-                pol[i] = meta_data[i][1]
-                data[i, :, :] = np.transpose(meta_data[i][-1])
-                self.ens = np.broadcast_to(en, (pol.size, ang.size, en.size))
-                self.angs = np.transpose(np.broadcast_to(
-                                ang, (pol.size, en.size, ang.size)), (0, 2, 1))
-                self.pols = np.transpose(np.broadcast_to(
-                                pol, (ang.size, en.size, pol.size)), (2, 0, 1))
+            # image column as one (pol, en, ang) block, viewed as
+            # (pol, ang, en) without copy
+            pol = np.array(meta_data.field(1), dtype=float)
+            data = np.transpose(meta_data.field(-1), (0, 2, 1))
+        else:
+            data = np.zeros((npol, nang, nen))  # Placeholder
+
+        # Crop the memory-mapped view, only this slab is read
+        self.pol = pol
+        self.ang = ang
+        self.en = en
+        s_pol, s_ang, s_en = self._crop_index(**(crop or {}))
+        pol, ang, en = pol[s_pol], ang[s_ang], en[s_en]
+        data = data[s_pol, s_ang, s_en]
 
         self.file = file
         self.mat = mat
@@ -195,9 +359,16 @@ class SIS(Methods):
     %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
               Data loader SIS
     %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+    .. note::
+        - The file stores (en, ang, pol|hv), data is read in the
+          (pol|hv, ang, en) layout of Methods.
+        - lazy=True keeps the file open (self.h5), self.int and self.eint
+          are H5Array views that only read the slabs which are accessed.
+        - crop=dict(en=(.., ..), ang=(.., ..), pol=(.., ..) or hv=(.., ..))
+          only reads the slab within these ranges (see Methods.crop).
     """
 
-    def __init__(self, file, mat, year, sample):
+    def __init__(self, file, mat, year, sample, lazy=False, crop=None):
         # Define directories
         folder = ''.join(['/Users/denyssutter/Documents/2_physics/DATA/',
                           str(mat), '/SIS', str(year), '/', str(sample), '/'])
@@ -209,46 +380,52 @@ class SIS(Methods):
         # Read meta data
         f = h5py.File(path, 'r')
         data_meta = f['Electron Analyzer/Image Data']
-        data = np.array(data_meta)
-        if data.ndim == 3:
-            self.int = np.transpose(data, (2, 1, 0))
-            d1, d2, d3 = data.shape
-        elif data.ndim == 2:
-            self.int = np.transpose(data)
-            d1, d2 = data.shape
+        d1, d2 = data_meta.shape[:2]
         e_i, de = data_meta.attrs['Axis0.Scale']  # initial energy, energy step
         a_i, da = data_meta.attrs['Axis1.Scale']  # initial angle, angle step
 
         # Build up data
-        en = np.arange(e_i, e_i + (d1) * de -de/2, de)
+        en = np.arange(e_i, e_i + (d1) * de - de/2, de)
         ang = np.arange(a_i, a_i + (d2) * da, da)
         hv = np.array(f['Other Instruments/hv'])
         pol = np.array(f['Other Instruments/Tilt'])
-        # Cases of scan modes#
-        if pol.size > 1 & hv.size == 1:
+
+        # Cases of scan modes
+        if data_meta.ndim == 3 and pol.size > 1 and hv.size == 1:
             print('- Fermi surface map \n')
-            self.ens = np.broadcast_to(en, (pol.size, ang.size, en.size))
-            self.angs = np.transpose(
-                            np.broadcast_to(
-                                    ang, (pol.size, en.size, ang.size)),
-                            (0, 2, 1))
-            self.pols = np.transpose(
-                            np.broadcast_to(
-                                    pol, (ang.size, en.size, pol.size)),
-                            (2, 0, 1))
-        elif hv.size > 1 & pol.size == 1:
+        elif data_meta.ndim == 3 and hv.size > 1 and pol.size == 1:
             print('- Photon energy scan \n')
-            self.ens = np.broadcast_to(en, (hv.size, ang.size, en.size))
-            self.angs = np.transpose(
-                            np.broadcast_to(ang, (hv.size, en.size, ang.size)),
-                            (0, 2, 1))
-            self.hvs = np.transpose(
-                            np.broadcast_to(hv, (ang.size, en.size, hv.size)),
-                            (2, 0, 1))
-        elif pol.size == 1 & hv.size == 1:
+        elif data_meta.ndim == 2:
             print('- No polar angles available \n- No photon energy scan \n')
-            self.ens = np.broadcast_to(en, (ang.size, en.size))
-            self.angs = np.transpose(np.broadcast_to(ang, (en.size, ang.size)))
+        else:
+            print('- Unknown scan mode: {} polar angles, {} photon energies'
+                  .format(pol.size, hv.size), '\n')
+
+        # Slab to read, in dataset (en, ang, pol|hv) order
+        self.ang = ang
+        self.en = en
+        self.hv = hv
+        self.pol = pol
+        s_scan, s_ang, s_en = self._crop_index(**(crop or {}))
+        sel = (s_en, s_ang, s_scan)[:data_meta.ndim]
+        if data_meta.ndim == 3:
+            if pol.size > 1:
+                pol = pol[s_scan]
+            else:
+                hv = hv[s_scan]
+        ang = ang[s_ang]
+        en = en[s_en]
+
+        # Dataset axes in (pol|hv, ang, en) order
+        axes = tuple(range(data_meta.ndim))[::-1]
+        if lazy:
+            self.int = H5Array(data_meta, sel, axes=axes)
+            self.eint = H5Array(data_meta, sel, axes=axes, func=np.sqrt)
+            self.h5 = f
+        else:
+            self.int = np.transpose(data_meta[sel], axes)
+            self.eint = np.sqrt(self.int)
+            f.close()
 
         self.file = file
         self.mat = mat
@@ -259,7 +436,6 @@ class SIS(Methods):
         self.folder = folder
         self.ang = ang
         self.en = en
-        self.eint = np.sqrt(data)
         self.hv = hv
         self.pol = pol
         print('\n ~ Initialization complete. Data has {} dimensions'.format(
@@ -276,9 +452,11 @@ class Bessy(Methods):
     .. warning::
         - This data loader is quickly done and not properly implemented.
         - Only good enough for the plots I needed to make.
+        - crop=dict(en=(.., ..), ang=(.., ..), pol=(.., ..)) crops the data
+          after reading (see Methods.crop).
     """
 
-    def __init__(self, file, mat, year, sample):
+    def __init__(self, file, mat, year, sample, crop=None):
         # Define directories
         folder = ''.join(['/Users/denyssutter/Documents/2_physics/DATA/',
                           str(mat), '/Bessy', str(year), '/', str(sample), '/'])
@@ -305,22 +483,11 @@ class Bessy(Methods):
                 path = folder + filename
                 data[k, :, :] = np.transpose(np.loadtxt(path))
             print('- Fermi surface map \n')
-            self.ens = np.broadcast_to(en, (pol.size, ang.size, en.size))
-            self.angs = np.transpose(
-                            np.broadcast_to(
-                                    ang, (pol.size, en.size, ang.size)),
-                            (0, 2, 1))
-            self.pols = np.transpose(
-                            np.broadcast_to(
-                                    pol, (ang.size, en.size, pol.size)),
-                            (2, 0, 1))
         else:
             filename = ''.join(['Ca_', str(file), 'int', '.dat'])
             path = folder + filename
             data = np.transpose(np.loadtxt(path))
             print('- No polar angles available \n')
-            self.ens = np.broadcast_to(en, (ang.size, en.size))
-            self.angs = np.transpose(np.broadcast_to(ang, (en.size, ang.size)))
 
         self.filename = filename
         self.path = path
@@ -333,20 +500,173 @@ class Bessy(Methods):
         self.en = en
         self.int = data
         self.eint = np.sqrt(data)
+        if crop:
+            self.crop(**crop)
         print('\n ~ Initialization complete. Data has {} dimensions'.format(
                 len(np.shape(self.int))),
               '\n', '==========================================')
         super(Bessy, self)
 
 
+def _cass_scans(sub_folder, prefix):
+    """returns scans
+
+    **Sorted scan numbers n of all <prefix>_<n>_ROI1_.txt files of a
+    Cassiopee FSM / hv scan**
+    """
+
+    pattern = re.compile(re.escape(prefix) + r'_(\d+)_ROI1_\.txt$')
+    scans = sorted(int(m.group(1)) for m in map(pattern.match,
+                                                  os.listdir(sub_folder))
+                   if m is not None)
+    if not scans:
+        raise OSError('No {}_*_ROI1_.txt files in {}'.format(prefix,
+                                                            sub_folder))
+
+    return scans
+
+
+def _cass_read(path):
+    """returns data_txt
+
+    **Reads the tab separated data block of a Cassiopee scan file (energy
+    in the first column, one column per angle)**
+    """
+
+    data_txt = pd.read_csv(path, sep='\t', skiprows=44, header=None,
+                           engine='c', dtype=np.float64).to_numpy()
+
+    return data_txt
+
+
+def _cass_info(path_info, key):
+    """returns val
+
+    **Value of key (theta / hv) in a Cassiopee info file**
+    """
+
+    val = 0.
+    with open(path_info) as f:
+        for line in f:
+            if key in line:
+                try:
+                    val = float(line.split()[-1])
+                except (ValueError, IndexError):
+                    break
+
+    return val
+
+
+def _cass_cut_txt(path):
+    """returns en, ang, data, meta
+
+    **Parses a Cassiopee cut exported as text file**
+    """
+
+    meta = dict()
+    with open(path, 'r') as f:
+        for i, line in enumerate(f):
+            if line.startswith('Dimension 1 scale='):
+                en = line.split('=')[-1].split()
+                en = np.array(en, dtype=float)
+            elif line.startswith('Dimension 2 scale='):
+                ang = line.split('=')[-1].split()
+                ang = np.array(ang, dtype=float)
+            elif line.startswith('Excitation Energy'):
+                meta['hv'] = float(line.split('=')[-1])
+            elif 'Data' in line:
+                break
+    data = np.loadtxt(path, skiprows=i+1)[:, 1:]
+    data = np.transpose(data)
+
+    return en, ang, data, meta
+
+
+def _cass_cut_ibw(path):
+    """returns en, ang, data, meta
+
+    **Parses a Cassiopee cut saved as Igor binary wave**
+    """
+
+    wave = binarywave.load(path)['wave']
+    data = np.array([wave['wData']])[0]
+    data = np.transpose(data)
+
+    # Load meta data
+    header = wave['wave_header']
+    nDim = header['nDim']
+    steps = header['sfA']
+    starts = header['sfB']
+    en = np.linspace(starts[0], starts[0] + nDim[0] * steps[0],
+                     nDim[0])
+    ang = np.linspace(starts[1], starts[1] + nDim[1] * steps[1],
+                      nDim[1])
+
+    # Convert `note`, which is a bytestring of ASCII characters that
+    # contains some metadata, to a list of strings
+    note = wave['note']
+    note = note.decode('ASCII').split('\r')
+
+    # Now the extraction fun begins. Most lines are of the form
+    # `Some-kind-of-name=some-value`
+    meta = dict()
+    for line in note:
+        try:
+            name, val = line.split('=')
+        except ValueError:
+            continue
+        meta.update({name: val})
+
+    return en, ang, data, meta
+
+
+def _sidecar(path, parse):
+    """returns en, ang, data, meta
+
+    **Loads a cut through a binary sidecar file <path>.npz**
+
+    The sidecar holds en, ang, data and the metadata as JSON, together with
+    modification time and size of the source file. It is written on first
+    parse and used as long as the source file is unchanged, otherwise the
+    source is parsed again with parse(path), as well as if the sidecar
+    can not be read (e.g. an interrupted write).
+    """
+
+    stat = os.stat(path)
+    stamp = [stat.st_mtime_ns, stat.st_size]
+    sidecar = path + '.npz'
+
+    try:
+        with np.load(sidecar) as f:
+            head = json.loads(str(f['head']))
+            if head['stamp'] == stamp:
+                return f['en'], f['ang'], f['data'], head['meta']
+    except Exception:  # any unreadable sidecar is a cache miss
+        pass
+
+    en, ang, data, meta = parse(path)
+    head = json.dumps({'stamp': stamp, 'meta': meta})
+    try:
+        utils.write_atomic(sidecar, lambda f: np.savez(
+                f, en=en, ang=ang, data=data, head=head))
+    except OSError:
+        print('- Could not write cache file: {}'.format(sidecar), '\n')
+
+    return en, ang, data, meta
+
+
 class CASS(Methods):
     """
     %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
             Data loader Cassiopee
     %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+    .. note::
+        - crop=dict(en=(.., ..), ang=(.., ..), pol=(.., ..) or hv=(.., ..))
+          (see Methods.crop). In mode 'FSM' / 'hv' only the scans within
+          pol / hv are read, cuts are cropped after reading.
     """
 
-    def __init__(self, file, mat, year, mode):
+    def __init__(self, file, mat, year, mode, n_jobs=None, crop=None):
         # Define directories
         folder = ''.join(['/Users/denyssutter/Documents/2_physics/DATA/',
                           str(mat), '/CASS', str(year), '/'])
@@ -355,155 +675,68 @@ class CASS(Methods):
         if mode == 'cut_txt':
             filename = ''.join([str(file), '.txt'])
             path = folder + filename
-
-            # Build up data
-            with open(path, 'r') as f:
-                for i, line in enumerate(f.readlines()):
-                    if line.startswith('Dimension 1 scale='):
-                        en = line.split('=')[-1].split()
-                        en = np.array(en, dtype=float)
-                    elif line.startswith('Dimension 2 scale='):
-                        ang = line.split('=')[-1].split()
-                        ang = np.array(ang, dtype=float)
-                    elif line.startswith('Excitation Energy'):
-                        hv = float(line.split('=')[-1])
-                    elif 'Data' in line:
-                        break
-            data = np.loadtxt(path, skiprows=i+1)[:, 1:]
-            data = np.transpose(data)
-            self.ens = np.broadcast_to(en, (ang.size, en.size))
-            self.angs = np.transpose(np.broadcast_to(ang, (en.size, ang.size)))
+            en, ang, data, meta = _sidecar(path, _cass_cut_txt)
+            hv = meta['hv']
 
         # Igro ibw file
         elif mode == 'cut_ibw':
             filename = ''.join([str(file), '.ibw'])
             path = folder + filename
-            wave = binarywave.load(path)['wave']
-            data = np.array([wave['wData']])[0]
-            data = np.transpose(data)
-
-            # Load meta data
-            header = wave['wave_header']
-            nDim = header['nDim']
-            steps = header['sfA']
-            starts = header['sfB']
-            en = np.linspace(starts[0], starts[0] + nDim[0] * steps[0],
-                             nDim[0])
-            ang = np.linspace(starts[1], starts[1] + nDim[1] * steps[1],
-                              nDim[1])
-
-            # Convert `note`, which is a bytestring of ASCII characters that
-            # contains some metadata, to a list of strings
-            note = wave['note']
-            note = note.decode('ASCII').split('\r')
-
-            # Now the extraction fun begins. Most lines are of the form
-            # `Some-kind-of-name=some-value`
-            metadata = dict()
-            for line in note:
-                try:
-                    name, val = line.split('=')
-                except ValueError:
-                    continue
-                metadata.update({name: val})
-            hv = metadata['Excitation Energy']
-            self.ens = np.broadcast_to(en, (ang.size, en.size))
-            self.angs = np.transpose(np.broadcast_to(ang, (en.size, ang.size)))
-
-        # Fermi Surface mode
-        if mode == 'FSM':
-            sub_folder = ''.join([folder, str(file), '/'])
-            n_scans = (len([name for name in os.listdir(sub_folder)
-                            if os.path.isfile(
-                                    os.path.join(sub_folder, name))])) / 2
-            n_scans = np.int(n_scans)
-            pol = np.zeros(n_scans)
-            for scan in range(n_scans):
-                filename = ''.join(['FS_', str(scan+1), '_ROI1_.txt'])
-                info = ''.join(['FS_', str(scan+1), '_i.txt'])
-                path_info = sub_folder + info
-                path = sub_folder + filename
-                print('\n ~ Initializing Cassiopee data file: \n {}'
-                      .format(path),
-                      '\n', '==========================================')
+            en, ang, data, meta = _sidecar(path, _cass_cut_ibw)
+            hv = meta['Excitation Energy']
 
-                # Build pol
-                with open(path_info) as f:
-                    for line in f.readlines():
-                        if 'theta' in line:
-                            theta = line.strip('theta (deg):')
-                            pol[scan] = np.float32(theta.split())
-                data_txt = np.genfromtxt(path, skip_header=44, delimiter='\t')
-                if scan == 0:
-                    en = data_txt[:, 0]
-
-                    # Build ang
-                    with open(path) as f:
-                        for line in f.readlines():
-                            if 'Dimension 2 scale' in line:
-                                ang_raw = line.strip('Dimension 2 scale=')
-                                ang_raw = ang_raw.split()
-                                ang = np.array(ang_raw, dtype=np.float32)
-                    data = np.zeros((n_scans, len(ang), len(en)))
-                data[scan] = np.transpose(data_txt[:, 1:])
-            self.pol = pol
-            self.ens = np.broadcast_to(en, (pol.size, ang.size, en.size))
-            self.angs = np.transpose(
-                            np.broadcast_to(
-                                    ang, (pol.size, en.size, ang.size)),
-                            (0, 2, 1))
-            self.pols = np.transpose(
-                            np.broadcast_to(
-                                    pol, (ang.size, en.size, pol.size)),
-                            (2, 0, 1))
-
-        # hv scan mode
-        elif mode == 'hv':
+        # Fermi Surface mode / hv scan mode
+        if mode in ('FSM', 'hv'):
+            prefix, key = ('FS', 'theta') if mode == 'FSM' else ('hv', 'hv')
             sub_folder = ''.join([folder, str(file), '/'])
-            n_scans = (len([name for name in os.listdir(sub_folder)
-                            if os.path.isfile(
-                                    os.path.join(sub_folder, name))])) / 2
-            n_scans = np.int(n_scans)
-            hv = np.zeros(n_scans)
-            for scan in range(n_scans):
-                filename = ''.join(['hv_', str(scan + 1), '_ROI1_.txt'])
-                info = ''.join(['hv_', str(scan + 1), '_i.txt'])
-                path_info = sub_folder + info
-                path = sub_folder + filename
-                print('\n ~ Initializing Cassiopee data file: \n {}'
-                      .format(path),
-                      '\n', '==========================================')
-
-                # Build up hv
-                with open(path_info) as f:
-                    for line in f.readlines():
-                        if 'hv' in line:
-                            hv_raw = line.strip(('hv (eV):'))
-                            try:
-                                hv[scan] = np.float32(hv_raw.split())
-                            except ValueError:
-                                break
-                data_txt = np.genfromtxt(path, skip_header=44, delimiter='\t')
-                if scan == 0:
-                    en = data_txt[:, 0]
-
-                    # Build angle
-                    with open(path) as f:
-                        for line in f.readlines():
-                            if 'Dimension 2 scale' in line:
-                                ang_raw = line.strip('Dimension 2 scale=')
-                                ang_raw = ang_raw.split()
-                                ang = np.array(ang_raw, dtype=np.float32)
-                    data = np.zeros((n_scans, len(ang), len(en)))
-                data[scan] = np.transpose(data_txt[:, 1:])
-            self.hv = hv
-            self.ens = np.broadcast_to(en, (hv.size, ang.size, en.size))
-            self.angs = np.transpose(
-                            np.broadcast_to(ang, (hv.size, en.size, ang.size)),
-                            (0, 2, 1))
-            self.hvs = np.transpose(
-                            np.broadcast_to(hv, (ang.size, en.size, hv.size)),
-                            (2, 0, 1))
+            scans = _cass_scans(sub_folder, prefix)
+            print('\n ~ Initializing Cassiopee data files: \n {}'
+                  .format(sub_folder + prefix + '_*_ROI1_.txt'),
+                  '\n', '==========================================')
+
+            # Header and energies from the first scan
+            path = ''.join([sub_folder, prefix, '_', str(scans[0]),
+                            '_ROI1_.txt'])
+            with open(path) as f:
+                for line in f:
+                    if 'Dimension 2 scale' in line:
+                        ang_raw = line.strip('Dimension 2 scale=')
+                        ang_raw = ang_raw.split()
+                        ang = np.array(ang_raw, dtype=np.float32)
+                        break
+            data_txt = _cass_read(path)
+            en = data_txt[:, 0]
+
+            # Scan values first, only the scans within crop are read
+            scan_val = np.array([_cass_info(''.join([
+                    sub_folder, prefix, '_', str(s), '_i.txt']), key)
+                for s in scans])
+            self.ang = ang
+            self.en = en
+            setattr(self, 'pol' if mode == 'FSM' else 'hv', scan_val)
+            s_scan, s_ang, s_en = self._crop_index(**(crop or {}))
+            scans, scan_val = scans[s_scan], scan_val[s_scan]
+            ang, en = ang[s_ang], en[s_en]
+
+            # Read the scans in parallel into one array
+            data = np.zeros((len(scans), len(ang), len(en)))
+
+            def read(i):
+                name = ''.join([sub_folder, prefix, '_', str(scans[i])])
+                data[i] = np.transpose(
+                        _cass_read(name + '_ROI1_.txt')[s_en, 1:])[s_ang]
+
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                list(executor.map(read, range(len(scans))))
+
+            filename = ''.join([prefix, '_', str(scans[-1]), '_ROI1_.txt'])
+            path = sub_folder + filename
+            if mode == 'FSM':
+                pol = scan_val
+                self.pol = pol
+            else:
+                hv = scan_val
+                self.hv = hv
 
         self.file = file
         self.mat = mat
@@ -515,8 +748,129 @@ class CASS(Methods):
         self.ang = ang
         self.int = data
         self.eint = np.sqrt(data)
+        if crop and mode not in ('FSM', 'hv'):
+            self.crop(**crop)
         print('\n ~ Initialization complete. Data has {} dimensions'.format(
                 len(np.shape(self.int))),
               '\n', '==========================================')
 
         super(CASS, self)
+
+
+"""
+%%%%%%%%%%%%%%%%%%%%%%%%%%%
+      Batch processing
+%%%%%%%%%%%%%%%%%%%%%%%%%%%
+"""
+
+_plt_lock = threading.Lock()  # pyplot is not thread safe
+
+
+def _batch_init():
+    """returns None
+
+    **Initializer of batch worker processes: figures are only written**
+    """
+
+    plt.switch_backend('agg')
+
+
+def _batch_task(spec, keep):
+    """returns D, t
+
+    **Single worker task of batch: load, normalize, process, plot, save**
+    """
+
+    t = time.time()
+    loader = spec['loader']
+    if isinstance(loader, str):
+        loader = globals()[loader]
+    D = loader(*spec.get('args', ()), **spec.get('kwargs', {}))
+
+    if spec.get('gold') is not None:
+        D.norm(spec['gold'])
+
+    # processing steps: 'name' or ('name', {kwargs})
+    for step in spec.get('steps', ()):
+        name, kwargs = (step, {}) if isinstance(step, str) else step
+        getattr(D, name)(**kwargs)
+
+    if spec.get('plot') is not None:
+        name, kwargs = ((spec['plot'], {}) if isinstance(spec['plot'], str)
+                        else spec['plot'])
+        with _plt_lock:
+            getattr(D, name)(**kwargs)
+            if spec.get('save') is not None:
+                plt.savefig(spec['save'], dpi=spec.get('dpi', 300),
+                            bbox_inches='tight')
+                plt.close(plt.gcf())
+
+    if not keep:
+        D = None
+
+    return D, time.time() - t
+
+
+def batch(specs, n_jobs=None, pool='process', keep=True):
+    """yields i, spec, D
+
+    **Loads and processes a list of data files on a worker pool, results
+    are streamed back as soon as they are finished**
+
+    Every spec is a dict with the keys
+
+    :loader:    loader class or its name, e.g. 'DLS'
+    :args:      arguments of the loader, e.g. (file, mat, year, sample)
+    :kwargs:    keyword arguments of the loader (optional)
+    :gold:      gold file for D.norm (optional)
+    :steps:     methods applied in order, 'name' or ('name', {kwargs}),
+                e.g. ('flatten', 'bkg') (optional)
+    :plot:      plot method, 'name' or ('name', {kwargs}) (optional)
+    :save:      file name the figure of plot is saved to (optional)
+    :dpi:       resolution of saved figure (optional, default 300)
+
+    Args
+    ----
+    :specs:     list of specs
+    :n_jobs:    number of workers (default: number of cores)
+    :pool:      'process' or 'thread'
+    :keep:      'True': processed data objects are sent back,
+                'False': only figures are written (less transfer)
+
+    Return
+    ------
+    :i:         index of spec in specs
+    :spec:      spec
+    :D:         processed data object (None if not keep), or the raised
+                exception if processing failed
+
+    .. note::
+        With pool='process' the workers import this module, scripts calling
+        batch need a  if __name__ == '__main__':  guard on spawn platforms.
+    """
+
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    if pool == 'thread':
+        executor = ThreadPoolExecutor(max_workers=n_jobs)
+    elif pool == 'process':
+        executor = ProcessPoolExecutor(max_workers=n_jobs,
+                                       initializer=_batch_init)
+    else:
+        raise ValueError("pool must be 'thread' or 'process'")
+
+    with executor:
+        futures = {executor.submit(_batch_task, spec, keep): i
+                   for i, spec in enumerate(specs)}
+        for f in as_completed(futures):
+            i = futures[f]
+            try:
+                D, t = f.result()
+                print('\n ~ Batch {}/{} done in {:.1f}s: {}'.format(
+                        i + 1, len(futures), t, specs[i].get('args')),
+                      '\n', '==========================================')
+            except Exception as e:
+                D = e
+                print('- Batch {}/{} failed: {}'.format(
+                        i + 1, len(futures), e), '\n')
+            yield i, specs[i], D
@@ -17,12 +17,12 @@ Created on Fri Jul 20 22:44:11 2018
             - Generalize MDC and EDC to use of units in k-space (not angles)
 """
 
-import os
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit
 import matplotlib.cm as cm
 from scipy.ndimage import gaussian_filter
+from scipy.signal import fftconvolve
 
 import ARPES_utils as utils
 
@@ -67,29 +67,76 @@ class Methods:
     from different beamlines and are called from utils.py.**
     """
 
-    def gold(self, Ef_ini, T_ini=6):
+    # Broadcast coordinates are views of the 1-dimensional axes, built on
+    # demand with the current shape of self.int: (pol|hv, ang, en) / (ang, en)
+    @property
+    def ens(self):
+        """returns broadcasted energies"""
+        return np.broadcast_to(self.en, np.shape(self.int))
+
+    @property
+    def angs(self):
+        """returns broadcasted detector angles"""
+        return np.broadcast_to(self.ang[:, None], np.shape(self.int))
+
+    @property
+    def pols(self):
+        """returns broadcasted polar angles (3-dimensional maps only)"""
+        return self._scan_axis('pol')
+
+    @property
+    def hvs(self):
+        """returns broadcasted photon energies (3-dimensional scans only)"""
+        return self._scan_axis('hv')
+
+    def _scan_axis(self, name):
+        """returns broadcasted scan axis name along the first dimension"""
+        shape = np.shape(self.int)
+        axis = np.ravel(self.__dict__.get(name, ()))
+        if len(shape) != 3 or axis.size != shape[0]:
+            raise AttributeError('{} not available for data of shape {}'
+                                 .format(name + 's', shape))
+        return np.broadcast_to(axis[:, None, None], shape)
+
+    def gold(self, Ef_ini, T_ini=6, n_jobs=1, pool='thread'):
         """Generates gold file
 
         **Fits and generates gold file for normalization.**
 
+        All channels are fitted with utils.gold_fit, warm-started from the
+        channel ch. The fits agree with fits of every channel from the
+        initial guess within their errors.
+
         Args
         ----
-        :Ef_ini: initial guess of Fermi level
+        :Ef_ini:    initial guess of Fermi level
+        :T_ini:     temperature (K)
+        :n_jobs:    number of workers (default: 1, sequential)
+        :pool:      'thread' or 'process' (needs a __main__ guard on
+                    spawn platforms)
 
         Return
         ------
-        Saves data files into the current sample folder
-
-        :Ef_file.dat:       array with fitted Fermi energies
-        :norm_file.dat:     total intensity per channel for normalization
+        Saves calibration into the gold store of the sample folder
+        (utils.gold_save), containing
+
+        :Ef_fit:            array with fitted Fermi energies
+        :norm:              total intensity per channel for normalization
+
+        :self.T:            fitted temperature per channel
+        :self.Res:          resolution per channel
+        :self.Ef:           fitted Fermi energy per channel
+        :self.gold_err:     standard errors of FDsl parameters per channel
+        :self.gold_chi2:    reduced chi-square per channel
+        :self.gold_success: 'True' where the fit converged
         """
 
         # Change these parameters to tune fitting
         # anchor points for poly fit of Fermi energies
 #        bnd = 110*0
         bnd = 1
-        # Takes initial fit parameters for Fermi function until this value.
-        # From there on, the initial parameters are the ones from last fit.
+        # Seed channel, fitted from the initial parameters.
+        # All other channels start from the fit of their neighbour.
         ch = 50
 
         kB = 8.6173303e-5  # Boltzmann constant
@@ -106,50 +153,49 @@ class Methods:
         # initial guess
         p_ini_FDsl = [T_ini * kB, Ef_ini, np.max(self.int[ch, :]), 20, 0]
 
-        # Placeholders
-        T_fit = np.zeros(len(self.ang))
-        Res = np.zeros(len(self.ang))
-        Ef = np.zeros(len(self.ang))
-        norm = np.zeros(len(self.ang))
-
-        # Fit loop
-        for i in range(len(self.ang)):
-            try:
-                p_FDsl, c_FDsl = curve_fit(utils.FDsl, self.en[inden:],
-                                           self.int[i, inden:], p_ini_FDsl)
-            except RuntimeError:
-                print("Error - convergence not reached")
+        # Fit all channels
+        p_FDsl, p_err, chi2, success = utils.gold_fit(
+                self.en[inden:], self.int[:, inden:], p_ini_FDsl, ch=ch,
+                n_jobs=n_jobs, pool=pool)
+        if not np.all(success):
+            print("Error - convergence not reached for channels",
+                  np.flatnonzero(~success))
 
-            # Plots data at this particular channel
-            if i == ch:
-                ax1.plot(self.en[inden:], utils.FDsl(self.en[inden:],
-                         *p_FDsl), 'r-')
+        # Plots data at this particular channel
+        ax1.plot(self.en[inden:], utils.FDsl(self.en[inden:],
+                 *p_FDsl[ch]), 'r-')
 
-            T_fit[i] = p_FDsl[0] / kB
-            Res[i] = np.sqrt(T_fit[i] ** 2 - T_ini ** 2) * 4 * kB
-            Ef[i] = p_FDsl[1]  # Fit parameter
+        T_fit = p_FDsl[:, 0] / kB
+        Res = np.sqrt(T_fit ** 2 - T_ini ** 2) * 4 * kB
+        Ef = p_FDsl[:, 1]  # Fit parameter
 
         self.T = T_fit
+        self.Res = Res
+        self.Ef = Ef
+        self.gold_err = p_err
+        self.gold_chi2 = chi2
+        self.gold_success = success
 
         # Fit Fermi level fits with a polynomial
         p_ini_poly2 = [Ef[ch], 0, 0, 0]
         p_poly2, c_poly2 = curve_fit(utils.poly_2, self.ang[bnd:-bnd],
-                                     Ef[bnd:-bnd], p_ini_poly2)
+                                     Ef[bnd:-bnd], p_ini_poly2,
+                                     jac=utils.poly_2_jac)
         Ef_fit = utils.poly_2(self.ang, *p_poly2)
 
         # boundaries if strong curvature in Fermi level
+        norm = np.zeros(len(self.ang))
         mx = np.max(self.en) - np.max(Ef_fit)
         mn = np.min(Ef_fit) - np.min(self.en)
+        en_ax = utils.Axis(self.en)
+        mx_idx = en_ax.index(Ef_fit + mx)
+        mn_idx = en_ax.index(Ef_fit - mn)
         for i in range(len(self.ang)):
-            mx_val, mx_idx = utils.find(self.en, Ef_fit[i] + mx)
-            mn_val, mn_idx = utils.find(self.en, Ef_fit[i] - mn)
-            norm[i] = np.sum(self.int[i, mn_idx:mx_idx])  # normalization
+            norm[i] = np.sum(self.int[i, mn_idx[i]:mx_idx[i]])  # normalization
 
         # Save data
-        os.chdir(self.folder)
-        np.savetxt(''.join(['Ef_', str(self.file), '.dat']), Ef_fit)
-        np.savetxt(''.join(['norm_', str(self.file), '.dat']), norm)
-        os.chdir('/Users/denyssutter/Documents/3_library/Python')
+        utils.gold_save(self.folder, self.file, Ef_fit, norm, Ef_ini=Ef_ini,
+                        T_ini=T_ini, bnd=bnd, ch=ch)
 
         # Plot data
         ax2 = fig.add_subplot(312)
@@ -189,48 +235,31 @@ class Methods:
 
         Return
         ------
-        :self.en_norm:      shifted energy
+        :self.en_norm:      shifted energy (read-only broadcast view)
         :self.int_norm:     normalized intensities
         :self.eint_norm:    corresponding errors
         :self.gold:         gold file used
         """
 
-        # Test if there is a gold file
+        # Test if there is a gold calibration
         try:
-            os.chdir(self.folder)
-            Ef = np.loadtxt(''.join(['Ef_', str(gold), '.dat']))
-            norm = np.loadtxt(''.join(['norm_', str(gold), '.dat']))
-            os.chdir('/Users/denyssutter/Documents/3_library/Python')
-
-            # Placeholders
-            en_norm = np.ones(self.ens.shape)
-            int_norm = np.ones(self.int.shape)
-            eint_norm = np.ones(self.eint.shape)
-
-            # Take dimensionality of data file into consideration
-            if np.size(self.int.shape) == 2:
-                for i in range(self.angs.shape[0]):
-                    en_norm[i, :] = self.en - Ef[i]
-                    int_norm[i, :] = np.divide(self.int[i, :], norm[i])
-                    eint_norm[i, :] = np.divide(self.eint[i, :], norm[i])
-            elif np.size(self.int.shape) == 3:
-                for i in range(self.angs.shape[1]):
-                    en_norm[:, i, :] = self.en - Ef[i]
-                    int_norm[:, i, :] = np.divide(self.int[:, i, :], norm[i])
-                    eint_norm[:, i, :] = np.divide(self.eint[:, i, :], norm[i])
+            Ef, norm = utils.gold_load(self.folder, gold)
 
         except OSError:
-            os.chdir('/Users/denyssutter/Documents/3_library/Python')
-            print('- No gold files: {}'.format(self.gold), '\n')
+            print('- No gold files: {}'.format(gold), '\n')
+            return
+        if norm is None:
+            print('- No normalization file: {}'.format(gold), '\n')
+            return
 
+        # Angles are the second to last axis for 2- and 3-dimensional data
         self.gold = gold
-        self.en_norm = en_norm
-        self.int_norm = int_norm
-        self.eint_norm = eint_norm
+        self.en_norm = np.broadcast_to(self.en - Ef[:, None], self.int.shape)
+        self.int_norm = np.divide(self.int, norm[:, None])
+        self.eint_norm = np.divide(self.eint, norm[:, None])
 
         # generate shifted data
-        if np.size(self.int.shape) == 2:
-            self.norm_shift()
+        self.norm_shift()
         print('\n ~ Data normalized',
               '\n', '==========================================')
 
@@ -245,33 +274,21 @@ class Methods:
 
         Return
         ------
-        :self.en_norm:  shifted energy
+        :self.en_norm:  shifted energy (read-only broadcast view)
         :self.gold:     gold file used
         """
 
-        # Test if there is a gold file in the folder
+        # Test if there is a gold calibration in the folder
         try:
-            os.chdir(self.folder)
-            Ef = np.loadtxt(''.join(['Ef_', str(gold), '.dat']))
-            os.chdir('/Users/denyssutter/Documents/3_library/Python')
-
-            # Placeholder
-            en_shift = np.ones(self.ens.shape)
-
-            # Take dimensionality of data file into consideration
-            if np.size(self.int.shape) == 2:
-                for i in range(self.angs.shape[0]):
-                    en_shift[i, :] = self.en - Ef[i]
-            elif np.size(self.int.shape) == 3:
-                for i in range(self.angs.shape[1]):
-                    en_shift[:, i, :] = self.en - Ef[i]
+            Ef, norm = utils.gold_load(self.folder, gold)
 
         except OSError:
-            os.chdir('/Users/denyssutter/Documents/3_library/Python')
-            print('- No gold files: {}'.format(self.gold), '\n')
+            print('- No gold files: {}'.format(gold), '\n')
+            return
 
+        # Angles are the second to last axis for 2- and 3-dimensional data
         self.gold = gold
-        self.en_norm = en_shift
+        self.en_norm = np.broadcast_to(self.en - Ef[:, None], self.int.shape)
         self.int_norm = self.int
         print('\n ~ Energies shifted',
               '\n', '==========================================')
@@ -283,66 +300,73 @@ class Methods:
         **Takes normalized data and shifts all intensities to same index,
         in this way the Fermi level, e.g., has the same index for all angles**
 
+        Works on 2-dimensional (ang, en) and 3-dimensional (pol, ang, en)
+        data, the shift is done for all angles at once.
+
         Args
         ----
 
         Return
         ------
-        :self.ang_shift:    shifted energies
-        :self.en_shift:     angles reduced to correct dimensions
+        :self.ang_shift:    angles reduced to correct dimensions
+        :self.en_shift:     shifted energies
         :self.int_shift:    shifted intensities
         :self.eint_shift:   errors
         """
 
-        # determine boundaries for new variables
-        bnd_top = np.min(np.max(self.en_norm, axis=1))
-        bnd_bot = np.max(np.min(self.en_norm, axis=1))
-
-        # placeholders
-        top_idxs = np.zeros(self.ang.shape)
-        bot_idxs = np.zeros(self.ang.shape)
+        # energies of every angle, (ang, en)
+        en_norm = self.en_norm.reshape((-1,) + self.en_norm.shape[-2:])[0]
 
-        # index-vectors
-        for i in range(self.ang.size):
-            top_val, top_idx = utils.find(self.en_norm[i, :], bnd_top)
-            bot_val, bot_idx = utils.find(self.en_norm[i, :], bnd_bot)
-            top_idxs[i] = top_idx
-            bot_idxs[i] = bot_idx
+        # determine boundaries for new variables
+        bnd_top = np.min(np.max(en_norm, axis=1))
+        bnd_bot = np.max(np.min(en_norm, axis=1))
 
-        # convert into integers
-        top_idxs = top_idxs.astype(int)
-        bot_idxs = bot_idxs.astype(int)
+        # index-vectors (entries closest to the boundaries)
+        en_ax = utils.Axis(en_norm)
+        top_idxs = en_ax.index(bnd_top)
+        bot_idxs = en_ax.index(bnd_bot)
 
         # determine energy dimension of new variable
         dim_en = int(np.min(top_idxs - bot_idxs))
 
-        # placeholders
-        ang_shift = np.zeros((self.ang.size, dim_en))
-        en_shift = np.zeros((self.ang.size, dim_en))
-        int_shift = np.zeros((self.ang.size, dim_en))
-        eint_shift = np.zeros((self.ang.size, dim_en))
+        # indices of the common energy window for every angle, (ang, dim_en)
+        idx = bot_idxs[:, None] + np.arange(dim_en)
+        en_shift = np.take_along_axis(en_norm, idx, axis=1)
+
+        # same window for every polarization / slice of 3-dimensional data
+        idx = np.broadcast_to(idx, self.int.shape[:-1] + (dim_en,))
 
         # build up variables
-        for i in range(self.ang.size):
-            ang_shift[i, :] = self.angs[i, bot_idxs[i]:bot_idxs[i]+dim_en]
-            en_shift[i, :] = self.en_norm[i, bot_idxs[i]:bot_idxs[i]+dim_en]
-            int_shift[i, :] = self.int_norm[i, bot_idxs[i]:bot_idxs[i]+dim_en]
-            eint_shift[i, :] = self.eint_norm[i,
-                                              bot_idxs[i]:bot_idxs[i]+dim_en]
-
-        self.ang_shift = ang_shift
-        self.en_shift = en_shift
-        self.int_shift = int_shift
-        self.eint_shift = eint_shift
+        self.ang_shift = np.broadcast_to(self.ang[:, None], idx.shape)
+        self.en_shift = np.broadcast_to(en_shift, idx.shape)
+        self.int_shift = np.take_along_axis(np.asarray(self.int_norm), idx,
+                                            axis=-1)
+        self.eint_shift = np.take_along_axis(np.asarray(self.eint_norm), idx,
+                                             axis=-1)
 
         print('\n ~ Spectrum shifted',
               '\n', '==========================================')
 
+    def _inplace(self, name):
+        """returns attribute name as a writable float array (converted once
+        if necessary) for in-place operations, None if not available"""
+        try:
+            data = getattr(self, name)
+        except AttributeError:
+            return None
+        if not (isinstance(data, np.ndarray) and data.flags.writeable and
+                np.issubdtype(data.dtype, np.floating)):
+            data = np.array(data, dtype=float)
+            setattr(self, name, data)
+        return data
+
     def flatten(self):
         """returns self.int, self.eint, self.int_norm, self.eint_norm
 
         **For every angle, the signal is divided by its total intensity**
 
+        Works in place on 2D (ang, en) and 3D (pol, ang, en) data.
+
         Args
         ----
 
@@ -354,26 +378,14 @@ class Methods:
         :self.eint_rnom:    corresponding error
         """
 
-        for i in range(self.ang.size):
-                self.int[i, :] = np.divide(
-                                            self.int[i, :],
-                                            np.sum(self.int[i, :]))
-                self.eint[i, :] = np.divide(
-                                            self.eint[i, :],
-                                            np.sum(self.eint[i, :]))
-
-        # Tests if it can flatten self.int_norm
-        try:
-            for i in range(self.ang.size):
-                self.int_norm[i, :] = np.divide(
-                                            self.int_norm[i, :],
-                                            np.sum(self.int_norm[i, :]))
-                self.eint_norm[i, :] = np.divide(
-                                            self.eint_norm[i, :],
-                                            np.sum(self.eint_norm[i, :]))
-        except AttributeError:
-            pass
+        for name in ('int', 'eint', 'int_norm', 'eint_norm'):
+            data = self._inplace(name)
+            if data is not None:
+                np.divide(data, np.sum(data, axis=-1, keepdims=True),
+                          out=data)
 
+        self.smooth_cache = {}  # intensity changed in place
+        self.FS_cache = {}
         print('\n ~ Spectra flattened',
               '\n', '==========================================')
 
@@ -383,6 +395,9 @@ class Methods:
         **For every angle, the signal in the other angular channel is
         divided by its sum. Data gets flattened in this fashion.**
 
+        Works in place on a single map (pol, ang) or a stack of maps
+        (e, pol, ang).
+
         Args
         ----
         :ang:      'True': iterates through self.ang, 'False': self.pol
@@ -392,14 +407,9 @@ class Methods:
         :self.map:  Flattened Fermi surface map
         """
 
-        if ang:
-            for i in range(self.ang.size):
-                self.map[:, i] = np.divide(self.map[:, i], np.sum(
-                        self.map[:, i]))
-        else:
-            for i in range(self.pol.size):
-                self.map[i, :] = np.divide(self.map[i, :], np.sum(
-                        self.map[i, :]))
+        data = self._inplace('map')
+        axis = -2 if ang else -1
+        np.divide(data, np.sum(data, axis=axis, keepdims=True), out=data)
 
         print('\n ~ Fermi surface flattened',
               '\n', '==========================================')
@@ -432,6 +442,9 @@ class Methods:
 
         **For every energy, the minimum signal is subtracted for all angles**
 
+        Works in place on 2D (ang, en) and 3D (pol, ang, en) data, the
+        background then has the shape (pol, en).
+
         Args
         ----
         :norm:      'True': self.int_norm is manipulated, 'False': self.int
@@ -452,49 +465,120 @@ class Methods:
         :self.ebkg_shift:   error
         """
 
-        bkg = np.zeros(self.int.shape[1])
-        ebkg = np.zeros(self.int.shape[1])
+        for sfx in ('', '_norm', '_shift'):
+            data = self._inplace('int' + sfx)
+            edata = self._inplace('eint' + sfx)
+            if data is None or edata is None:
+                continue
+
+            # minimum over angles for every energy
+            bkg = np.min(data, axis=-2, keepdims=True)
+            ebkg = np.min(edata, axis=-2, keepdims=True)
+            data -= bkg
+            edata -= ebkg
+            setattr(self, 'bkg' + sfx, bkg[..., 0, :])
+            setattr(self, 'ebkg' + sfx, ebkg[..., 0, :])
+
+        self.smooth_cache = {}  # intensity changed in place
+        self.FS_cache = {}
+        print('\n ~ Background subtracted',
+              '\n', '==========================================')
 
-        try:
-            bkg_norm = np.zeros(self.int_norm.shape[1])
-            ebkg_norm = np.zeros(self.int_norm.shape[1])
-            bkg_shift = np.zeros(self.int_shift.shape[1])
-            ebkg_shift = np.zeros(self.int_shift.shape[1])
-            for i in range(self.en.size):
-                bkg_norm[i] = np.min(self.int_norm[:, i])
-                ebkg_norm[i] = np.min(self.eint_norm[:, i])
-                self.int_norm[:, i] = (self.int_norm[:, i] - bkg_norm[i])
-                self.eint_norm[:, i] = (self.eint_norm[:, i] - ebkg_norm[i])
-            for i in range(self.en_shift.shape[1]):
-                bkg_shift[i] = np.min(self.int_shift[:, i])
-                ebkg_shift[i] = np.min(self.eint_shift[:, i])
-                self.int_shift[:, i] = (self.int_shift[:, i] - bkg_shift[i])
-                self.eint_shift[:, i] = (self.eint_shift[:, i] - ebkg_shift[i])
-            self.bkg_norm = bkg_norm
-            self.ebkg_norm = ebkg_norm
-            self.bkg_shift = bkg_shift
-            self.ebkg_shift = ebkg_shift
-        except AttributeError:
-            pass
+    def crop(self, en=None, ang=None, pol=None, hv=None):
+        """returns self.en, self.ang, self.pol, self.hv, self.int, self.eint,
+        self.*_norm, self.*_shift cropped
 
-        for i in range(self.en.size):
-            bkg[i] = np.min(self.int[:, i])
-            ebkg[i] = np.min(self.eint[:, i])
-            self.int[:, i] = (self.int[:, i] - bkg[i])
-            self.eint[:, i] = (self.eint[:, i] - ebkg[i])
-            self.bkg = bkg
-            self.ebkg = ebkg
-        self
-        print('\n ~ Background subtracted',
+        **Crops the data to physical ranges. All variables are cropped
+        consistently by basic slicing: they are views of the current data,
+        nothing is copied (lazy H5Array data stays lazy).**
+
+        Args
+        ----
+        :en:        energy range (e_a, e_b) on self.en
+        :ang:       detector angle range (a_a, a_b)
+        :pol:       polar angle range (3-dimensional maps)
+        :hv:        photon energy range (3-dimensional hv scans)
+
+        Return
+        ------
+        New data variables (self.angs, self.pols, self.ens follow):
+            - self.en, self.ang, self.pol / self.hv (if available)
+            - self.int, self.eint
+            - self.en_norm, self.int_norm, self.eint_norm (if available)
+            - self.*_shift (if available), energies cropped on en_shift
+        """
+
+        s_scan, s_ang, s_en = self._crop_index(en, ang, pol, hv)
+        s_shift = slice(None)
+        if en is not None and hasattr(self, 'en_shift'):
+            en_shift = np.reshape(self.en_shift,
+                                  (-1, np.shape(self.en_shift)[-1]))[0]
+            s_shift = utils.index_range(en_shift, en)
+        self._slice(s_scan, s_ang, s_en, s_shift)
+
+        print('\n ~ Spectra cropped',
               '\n', '==========================================')
 
+    def _crop_index(self, en=None, ang=None, pol=None, hv=None):
+        """returns s_scan, s_ang, s_en
+
+        **Index ranges (slices) of physical ranges on the 1-dimensional
+        axes, also used by the loaders to read only the needed slab**
+        """
+
+        s_scan = slice(None)
+        if pol is not None:
+            s_scan = utils.index_range(self.pol, pol)
+        elif hv is not None:
+            s_scan = utils.index_range(self.hv, hv)
+
+        return (s_scan, utils.index_range(self.ang, ang),
+                utils.index_range(self.en, en))
+
+    def _slice(self, s_scan, s_ang, s_en, s_shift=slice(None)):
+        """returns all variables cropped by index
+
+        **Basic slicing of the axes and of all data variables, views only.
+        s_shift crops the energies of the *_shift variables.**
+        """
+
+        d = self.__dict__
+        three = np.ndim(self.int) == 3
+        if three:  # scan axis of 3-dimensional data
+            n_scan = np.shape(self.int)[0]
+            for name in ('pol', 'hv'):
+                if np.ndim(d.get(name)) == 1 and np.size(d[name]) == n_scan:
+                    d[name] = d[name][s_scan]
+        self.ang = self.ang[s_ang]
+        self.en = self.en[s_en]
+
+        idx = (s_scan, s_ang) if three else (s_ang,)
+        for names, s in ((('int', 'eint', 'en_norm', 'int_norm', 'eint_norm'),
+                          s_en),
+                         (('ang_shift', 'en_shift', 'int_shift',
+                           'eint_shift'), s_shift)):
+            for name in names:
+                data = d.get(name)
+                if data is None:
+                    continue
+                if hasattr(data, 'slab'):  # lazy H5Array stays lazy
+                    d[name] = data.slab(idx + (s,))
+                else:
+                    d[name] = data[idx + (s,)]
+
+        self.smooth_cache = {}  # intensity replaced by a view
+        self.FS_cache = {}
+
     def restrict(self, bot=0, top=1, left=0, right=1):
-        """returns self.ang, self.angs, self.pol, self.pols, self.en, self.ens,
-        self.en_norm, self.int, self.int_norm, self.eint, self.eint_norm
+        """returns self.ang, self.pol, self.en, self.en_norm, self.int,
+        self.int_norm, self.eint, self.eint_norm
 
         **If files are too large or if it is convenient to do so,
         cropt the data files to a smaller size.**
 
+        Fractional bounds, see crop for physical ranges. The variables are
+        views of the original data.
+
         Args
         ----
         :bot:       set bottom crop boundary from 0..1
@@ -504,13 +588,10 @@ class Methods:
 
         Return
         ------
-        New data variables:
+        New data variables (self.angs, self.pols, self.ens follow):
             - self.ang
-            - self.angs
             - self.pol (if available)
-            - self.pols (if available)
             - self.en
-            - self.ens
             - self.en_norm (if available)
             - self.int
             - self.int_norm (if available)
@@ -518,7 +599,7 @@ class Methods:
             - self.eint_norm (if available)
         """
 
-        # For 2-dimensional spectra
+        # For 2-dimensional spectra: bot / top crop energies
         if self.int.ndim == 2:
             d1, d2 = self.int.shape
 
@@ -529,24 +610,10 @@ class Methods:
             val, _right = utils.find(range(d1), right * d1)
 
             # Restrict spectra
-            self.en = self.en[_bot:_top]
-            self.ens = self.ens[_left:_right, _bot:_top]
-            self.ang = self.ang[_left:_right]
-            self.angs = self.angs[_left:_right, _bot:_top]
-            self.int = self.int[_left:_right, _bot:_top]
-            self.eint = self.eint[_left:_right, _bot:_top]
-            try:
-                self.en_norm = self.en_norm[_left:_right, _bot:_top]
-                self.int_norm = self.int_norm[_left:_right, _bot:_top]
-                self.eint_norm = self.eint_norm[_left:_right, _bot:_top]
-                self.ang_shift = self.ang_shift[_left:_right, _bot:_top]
-                self.en_shift = self.en_shift[_left:_right, _bot:_top]
-                self.int_shift = self.int_shift[_left:_right, _bot:_top]
-                self.eint_shift = self.eint_shift[_left:_right, _bot:_top]
-            except AttributeError:
-                pass
+            self._slice(slice(None), slice(_left, _right), slice(_bot, _top),
+                        slice(_bot, _top))
 
-        # For 3-dimensional data
+        # For 3-dimensional data: bot / top crop polar angles
         elif self.int.ndim == 3:
             d1, d2 = self.int.shape[1], self.int.shape[0]
 
@@ -557,45 +624,63 @@ class Methods:
             val, _right = utils.find(range(d1), right * d1)
 
             # Restrict spectra
-            self.pol = self.pol[_bot:_top]
-            self.pols = self.pols[_bot:_top, _left:_right, :]
-            self.ens = self.ens[_bot:_top, _left:_right, :]
-            self.ang = self.ang[_left:_right]
-            self.angs = self.angs[_bot:_top, _left:_right, :]
-            self.int = self.int[_bot:_top, _left:_right, :]
-            self.int = self.int[_bot:_top, _left:_right, :]
-            try:
-                self.en_norm = self.en_norm[_bot:_top, _left:_right, :]
-                self.int_norm = self.int_norm[_bot:_top, _left:_right, :]
-                self.eint_norm = self.eint_norm[_bot:_top, _left:_right, :]
-            except AttributeError:
-                pass
+            self._slice(slice(_bot, _top), slice(_left, _right), slice(None))
 
         print('\n ~ Spectra restricted',
               '\n', '==========================================')
 
-    def smooth(self, it=30, sig=1):
+    def smooth(self, it=30, sig=1, fft=None):
         """returns self.int_smooth
 
         **smoothends intensity**
 
+        it passes of a Gaussian filter with width sig are equivalent to a
+        single pass with width sig * sqrt(it), which is applied here. Results
+        are cached per (it, sig, fft) as long as self.int is not replaced.
+
         Args
         ----
         :it:                iterations
         :sig:               gaussian filter strength
+        :fft:               'True': FFT convolution, 'False': direct
+                            filter, None: FFT for kernels wider than 64 px
 
         Return
         ------
         :self.int_smooth:   smoothened intensity
         """
 
-        intensity = self.int
-
-        for i in range(it):
-            intensity = gaussian_filter(intensity, sigma=sig)
-#            intensity = savgol_filter(intensity, 21, 6)
-
-        self.int_smooth = intensity
+        # Drop cached results if the intensity has been replaced
+        if getattr(self, 'smooth_int', None) is not self.int:
+            self.smooth_cache = {}
+            self.smooth_int = self.int
+        sig_eff = np.broadcast_to(sig, (np.ndim(self.int),)) * np.sqrt(it)
+        rad = (4 * sig_eff + .5).astype(int)  # gaussian_filter radius
+        if fft is None:
+            fft = bool(np.max(rad) > 64)
+        key = (it, tuple(np.ravel(sig)), fft)
+
+        if key not in self.smooth_cache:
+            intensity = np.asarray(self.int, dtype=float)
+
+            if fft:
+                # pad as gaussian_filter (mode='reflect'), then convolve
+                intensity = np.pad(intensity, [(r, r) for r in rad],
+                                   mode='symmetric')
+                kernel = np.ones([1] * intensity.ndim)
+                for ax, (s, r) in enumerate(zip(sig_eff, rad)):
+                    if s == 0:
+                        continue
+                    g = np.exp(-.5 * (np.arange(-r, r + 1) / s) ** 2)
+                    shape = [1] * intensity.ndim
+                    shape[ax] = -1
+                    kernel = kernel * np.reshape(g / np.sum(g), shape)
+                intensity = fftconvolve(intensity, kernel, mode='valid')
+            else:
+                intensity = gaussian_filter(intensity, sigma=sig_eff)
+            self.smooth_cache[key] = intensity
+
+        self.int_smooth = self.smooth_cache[key]
 
         print('\n ~ Spectra smoothened',
               '\n', '==========================================')
@@ -614,18 +699,23 @@ class Methods:
 
         Return
         ------
-        :self.C_2D:     Curvature map 2D
+        :self.C_2D:     Curvature map 2D (all slices for 3D data)
         """
 
         self.smooth(it=it, sig=sig)
 
         C_2D = utils.curvature_inequiv(self.ang, self.en,
                                        self.int_smooth,
-                                       Cx=Cx, Cy=Cy)
+                                       Cx=Cx, Cy=Cy,
+                                       axes=(-2, -1))
 
 #        C_2D[C_2D < 0] = 0
         self.C_2D = C_2D
 
+        # Only 2-dimensional spectra are plotted
+        if self.int.ndim != 2:
+            return
+
         # create figure
         fig = plt.figure('curvature_2D', figsize=(6, 6), clear=True)
         ax1 = fig.add_subplot(121)
@@ -666,18 +756,22 @@ class Methods:
 
         Return
         ------
-        :self.C_MDC:    Curvature map 2D
+        :self.C_MDC:    Curvature map 2D (all slices for 3D data)
         """
 
         self.smooth(it=it, sig=sig)
 
         C_MDC = utils.curvature_MDC(self.ang, self.en,
                                     self.int_smooth,
-                                    C0=C0)
+                                    C0=C0, axes=(-2, -1))
 
 #        C_MDC[C_MDC < 0] = 0
         self.C_MDC = C_MDC
 
+        # Only 2-dimensional spectra are plotted
+        if self.int.ndim != 2:
+            return
+
         # create figure
         fig = plt.figure('curvature_2D', figsize=(6, 6), clear=True)
         ax1 = fig.add_subplot(121)
@@ -718,18 +812,22 @@ class Methods:
 
         Return
         ------
-        :self.C_EDC:    Curvature map 2D
+        :self.C_EDC:    Curvature map 2D (all slices for 3D data)
         """
 
         self.smooth(it=it, sig=sig)
 
         C_EDC = utils.curvature_EDC(self.ang, self.en,
                                     self.int_smooth,
-                                    C0=C0)
+                                    C0=C0, axes=(-2, -1))
 
 #        C_MDC[C_MDC < 0] = 0
         self.C_EDC = C_EDC
 
+        # Only 2-dimensional spectra are plotted
+        if self.int.ndim != 2:
+            return
+
         # create figure
         fig = plt.figure('curvature_2D', figsize=(6, 6), clear=True)
         ax1 = fig.add_subplot(121)
@@ -864,11 +962,14 @@ class Methods:
               '\n', '==========================================')
 
     def ang2kFS(self, angdg, Ekin, lat_unit=False, a=5.33, b=5.33, c=11,
-                V0=0, thdg=0, tidg=0, phidg=0):
-        """returns self.kx, self.ky, self.kx_V0, self.ky_V0
+                V0=0, thdg=0, tidg=0, phidg=0, Ekin_en=None):
+        """returns self.kx, self.ky, self.kx_V0, self.ky_V0, self.kxs,
+        self.kys
 
         **Converts detector angles into k-space for a FS map**
 
+        All polar angles are converted at once with utils.ang2kFS.
+
         Args
         ----
         :angdg:     detector angles in degrees
@@ -879,6 +980,8 @@ class Methods:
         :thdg:      manipulator angle theta in degrees
         :tidg:      manipulator angle tilt in degrees
         :phidg:     manipulator angle phi in degrees
+        :Ekin_en:   kinetic energy of every energy in self.en (optional),
+                    e.g. Ekin + self.en for energies relative to Ef
 
         Return
         ------
@@ -886,31 +989,26 @@ class Methods:
         :self.ky:        reciprocal space vector in y
         :self.kx_V0:     reciprocal space vector in x (with inner potential)
         :self.ky_V0:     reciprocal space vector in y (with inner potential)
+        :self.kxs:       kx(pol, ang, en), energy dependent if Ekin_en given
+        :self.kys:       ky(pol, ang, en), energy dependent if Ekin_en given
         """
 
-        # Placeholders
-        kx = np.ones((self.pol.size, self.ang.size))
-        ky = np.ones((self.pol.size, self.ang.size))
-        kx_V0 = np.ones((self.pol.size, self.ang.size))
-        ky_V0 = np.ones((self.pol.size, self.ang.size))
-
-        # Loop over tilt angles and build up kx, ky
-        for i in range(self.pol.size):
-            self.ang2k(angdg, Ekin, lat_unit, a, b, c, V0, thdg,
-                       self.pol[i]-tidg, phidg)
-            kx[i, :] = self.k[0, :]
-            ky[i, :] = self.k[1, :]
-            kx_V0[i, :] = self.k_V0[0, :]
-            ky_V0[i, :] = self.k_V0[1, :]
-
-        self.kxs = np.transpose(np.broadcast_to(kx, (self.en.size,
-                                                     self.pol.size,
-                                                     self.ang.size)),
-                                (1, 2, 0))
-        self.kys = np.transpose(np.broadcast_to(ky, (self.en.size,
-                                                     self.pol.size,
-                                                     self.ang.size)),
-                                (1, 2, 0))
+        kx, ky, kx_V0, ky_V0 = utils.ang2kFS(
+                angdg, Ekin, lat_unit, a, b, c, V0, thdg, self.pol - tidg,
+                phidg)
+
+        # contiguous (pol, ang, en) grids
+        if Ekin_en is None:
+            shape = (self.pol.size, self.ang.size, self.en.size)
+            self.kxs = np.ascontiguousarray(np.broadcast_to(kx[..., None],
+                                                            shape))
+            self.kys = np.ascontiguousarray(np.broadcast_to(ky[..., None],
+                                                            shape))
+        else:
+            self.kxs, self.kys = utils.ang2kFS(
+                    angdg, Ekin_en, lat_unit, a, b, c, V0, thdg,
+                    self.pol - tidg, phidg)[:2]
+
         self.kx = kx
         self.ky = ky
         self.kx_V0 = kx_V0
@@ -919,6 +1017,63 @@ class Methods:
         print('\n ~ Angles converted into k-space for Fermi surface',
               '\n', '==========================================')
 
+    def FS_regrid(self, maps=None, n_kx=300, n_ky=300, kx_grid=None,
+                  ky_grid=None):
+        """returns self.kx_grid, self.ky_grid, self.map_grid
+
+        **Resamples constant energy maps from the (pol, ang) grid of
+        ang2kFS onto a regular (ky, kx) grid**
+
+        The sparse interpolation matrix (utils.regrid_matrix) is computed
+        once per geometry and cached, any number of maps is then resampled
+        with a single sparse matrix product. Points outside the data are NaN.
+
+        Args
+        ----
+        :maps:      maps (..., pol, ang), default: self.map
+        :n_kx:      number of kx points (if kx_grid not given)
+        :n_ky:      number of ky points (if ky_grid not given)
+        :kx_grid:   regular kx axis (optional)
+        :ky_grid:   regular ky axis (optional)
+
+        Return
+        ------
+        :self.kx_grid:  regular kx axis
+        :self.ky_grid:  regular ky axis
+        :self.map_grid: resampled maps (..., ky, kx)
+        """
+
+        if maps is None:
+            maps = self.map
+        if kx_grid is None:
+            kx_grid = np.linspace(np.min(self.kx), np.max(self.kx), n_kx)
+        if ky_grid is None:
+            ky_grid = np.linspace(np.min(self.ky), np.max(self.ky), n_ky)
+        kx_grid = np.asarray(kx_grid, dtype=float)
+        ky_grid = np.asarray(ky_grid, dtype=float)
+
+        # interpolation matrix, cached as long as the geometry is unchanged
+        cache = getattr(self, 'regrid_cache', None)
+        if (cache is None or cache[0] is not self.kx or
+                cache[1] is not self.ky or
+                not np.array_equal(cache[2], kx_grid) or
+                not np.array_equal(cache[3], ky_grid)):
+            M, mask = utils.regrid_matrix(self.kx, self.ky, kx_grid, ky_grid)
+            self.regrid_cache = (self.kx, self.ky, kx_grid, ky_grid, M, mask)
+        M, mask = self.regrid_cache[4:]
+
+        # all maps as columns of one matrix
+        maps = np.asarray(maps, dtype=float)
+        stack = maps.reshape((-1, self.kx.size)).T
+        map_grid = (M @ stack).T.reshape(maps.shape[:-2] + mask.shape)
+        map_grid[..., ~mask] = np.nan
+
+        self.kx_grid = kx_grid
+        self.ky_grid = ky_grid
+        self.map_grid = map_grid
+        print('\n ~ Maps resampled on regular k-grid',
+              '\n', '==========================================')
+
     def FS(self, e=0, ew=0.05):
         """returns self.map
 
@@ -935,21 +1090,59 @@ class Methods:
         :self.map: Fermi surface map
         """
 
-        FSmap = np.zeros((self.pol.size, self.ang.size))
-        try:
-            for i in range(self.ang.size):
-                e_val, e_idx = utils.find(self.en_norm[0, i, :], e)
-                ew_val, ew_idx = utils.find(self.en_norm[0, i, :], e-ew)
-                FSmap[:, i] = np.sum(self.int_norm[:, i, ew_idx:e_idx], axis=1)
-        except AttributeError:
-            e_val, e_idx = utils.find(self.en, e)
-            ew_val, ew_idx = utils.find(self.en, e-ew)
-            FSmap = np.sum(self.int[:, :, ew_idx:e_idx], axis=2)
-
-        self.map = FSmap
+        self.map = self.FS_stack(e, ew)[0]
         print('\n ~ Constant energy map extracted',
               '\n', '==========================================')
 
+    def FS_stack(self, e=0, ew=0.05):
+        """returns maps
+
+        **Constant energy maps for any number of energies e, integrated to
+        e-ew. A cumulative sum along the energy axis is computed once (and
+        cached), every map is then the difference of two of its slices**
+
+        Args
+        ----------
+        :e:     energies at which to cut the data (scalar or array)
+        :ew:    energy windows from e downwards (scalar or array)
+
+        Return
+        ------
+        :maps:  Fermi surface maps (e, pol, ang)
+        """
+
+        e, ew = np.broadcast_arrays(np.atleast_1d(e), ew)
+        try:
+            intensity = self.int_norm
+            en = self.en_norm[0]  # (ang, en)
+            key = 'norm'
+        except AttributeError:
+            intensity = self.int
+            en = self.en[None, :]
+            key = 'int'
+
+        # prefix sum along energies, C[..., k] is the sum of the first k
+        if not hasattr(self, 'FS_cache'):
+            self.FS_cache = {}
+        if key not in self.FS_cache or self.FS_cache[key][0] is not intensity:
+            data = np.asarray(intensity, dtype=float)
+            C = np.zeros(data.shape[:-1] + (data.shape[-1] + 1,))
+            np.cumsum(data, axis=-1, out=C[..., 1:])
+            self.FS_cache[key] = (intensity, C)
+        C = self.FS_cache[key][1]
+
+        # indices of e and e-ew for every map and angle, (e, ang)
+        en_ax = utils.Axis(en)
+        e_idx = en_ax.index(e[:, None])
+        ew_idx = en_ax.index((e - ew)[:, None])
+        e_idx = np.maximum(e_idx, ew_idx)  # empty windows give zero
+
+        # gather C[pol, ang, idx] for every map
+        ang_idx = np.arange(C.shape[1])
+        maps = (C[:, ang_idx, e_idx] - C[:, ang_idx, ew_idx])  # (pol, e, ang)
+
+        return np.moveaxis(maps, 0, 1)
+
     def mdc(self, mdc_=0, mdcw_=.01):
         """returns self.mdc and ax
 
@@ -977,17 +1170,16 @@ class Methods:
 
         # build MDC
         try:
+            mdc_val, (mdc_idx, mdcw_idx) = utils.find(self.en_norm[0, :],
+                                                      [mdc_, mdc_ - mdcw_])
             for i in range(self.ang.size):
-                mdc_val, mdc_idx = utils.find(self.en_norm[0, :], mdc_)
-                mdc_val, mdcw_idx = utils.find(self.en_norm[0, :],
-                                               mdc_ - mdcw_)
                 mdc[i] = np.sum(self.int_norm[i, mdcw_idx:mdc_idx], axis=0)
 
                 if mdcw_idx == mdc_idx:
                     mdc[i] = self.int_norm[i, mdcw_idx]
         except AttributeError:
-            mdc_val, mdc_idx = utils.find(self.en, mdc_)
-            mdc_val, mdcw_idx = utils.find(self.en, mdc_ - mdcw_)
+            mdc_val, (mdc_idx, mdcw_idx) = utils.find(self.en,
+                                                      [mdc_, mdc_ - mdcw_])
             mdc = np.sum(self.int[:, mdcw_idx:mdc_idx], axis=1)
 
             if mdcw_idx == mdc_idx:
@@ -1038,8 +1230,8 @@ class Methods:
         edc = np.zeros(self.en.size)
 
         # build EDC
-        edc_val, edc_idx = utils.find(self.ang, edc_)
-        edc_val, edcw_idx = utils.find(self.ang, edc_ - edcw_)
+        edc_val, (edc_idx, edcw_idx) = utils.find(self.ang,
+                                                  [edc_, edc_ - edcw_])
         edc = np.sum(self.int[edcw_idx:edc_idx, :], axis=0)
 
         if edcw_idx == edc_idx:
@@ -1124,7 +1316,7 @@ class Methods:
         print('\n ~ Plot ARPES spectrum',
               '\n', '==========================================')
 
-    def plt_FS(self, v_max=1):
+    def plt_FS(self, v_max=1, regrid=False):
         """returns ax of FS plot
 
         **Plots Fermi surface**
@@ -1132,6 +1324,8 @@ class Methods:
         Args
         ----
         :v_max:    contrast of plot: 0..1
+        :regrid:   'True': plots the map resampled on a regular k-grid
+                   (FS_regrid) instead of the (pol, ang) grid
 
         Return
         ------
@@ -1150,8 +1344,15 @@ class Methods:
 
             # Plots in kx and ky if available
             try:
-                c0 = ax.contourf(self.kx, self.ky, self.map, 150,
-                                 **kwargs_spec, vmax=v_max*np.max(self.map))
+                if regrid:
+                    self.FS_regrid()
+                    c0 = ax.contourf(self.kx_grid, self.ky_grid,
+                                     self.map_grid, 150, **kwargs_spec,
+                                     vmax=v_max*np.max(self.map))
+                else:
+                    c0 = ax.contourf(self.kx, self.ky, self.map, 150,
+                                     **kwargs_spec,
+                                     vmax=v_max*np.max(self.map))
 
                 # Plot in appropriate units
                 if self.lat_unit:
@@ -1214,12 +1415,15 @@ class Methods:
         fig = plt.figure(('FS_all' + str(self.file)), figsize=(8, 8),
                          clear=True)
 
+        # all maps at once
+        maps = self.FS_stack(e=en_range, ew=.1)
+
         # number of maps
-        n_maps = np.ceil(np.sqrt(len(en_range)))
+        n_maps = int(np.ceil(np.sqrt(len(en_range))))
         n = 0
         for en in en_range:
+            self.map = maps[n]
             n += 1
-            self.FS(e=en, ew=.1)
             ax = fig.add_subplot(n_maps, n_maps, n)
             ax.tick_params(**kwargs_ticks)
 
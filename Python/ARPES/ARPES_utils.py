@@ -26,7 +26,16 @@ import matplotlib.cm as cm
 import time
 from joblib import Parallel, delayed
 import multiprocessing
+import os
+import json
+import tempfile
+import hashlib
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from scipy import signal
+from scipy.optimize import curve_fit
+from scipy import sparse
+from scipy.spatial import Delaunay
 import pandas as pd
 
 
@@ -37,8 +46,8 @@ def find(array, val):
 
     Args
     ----
-    :array:     entry value in array
-    :_val:      index of entry
+    :array:     1D array or Axis
+    :val:       value, or array of values searched at once
 
     Return
     ------
@@ -46,45 +55,660 @@ def find(array, val):
     :_val:          index of entry
     """
 
-    array = np.asarray(array)
-    _val = (np.abs(array - val)).argmin()
+    if isinstance(array, Axis):
+        _val = array.index(val)
+        array = array.array
+    elif np.ndim(val) == 0 or np.ndim(array) != 1:  # as argmin over array
+        array = np.asarray(array)
+        _val = (np.abs(array - val)).argmin()
+    else:
+        array = Axis(array)
+        _val = array.index(val)
+        array = array.array
 
     return array[_val], _val
 
 
-def Shirley(EDC):
-    """returns b
+class Axis:
+    """
+    %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+              Sorted axis index
+    %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+    **Nearest-index lookup along the last axis of an array (e.g. one energy
+    axis per angle). Monotonic axes are searched by bisection in O(log n),
+    any other array falls back to argmin. Ties resolve to the first index,
+    same as argmin.**
+    """
+    def __init__(self, array):
+        """returns self.array, self.sorted
+
+        **Initializing axis**
+
+        Args
+        ----
+        :array:     axis values, (n) or (..., n)
+
+        Return
+        ------
+        :self.array:    axis values
+        :self.sorted:   'True' if all rows are monotonic in the same direction
+        """
+
+        self.array = np.asarray(array)
+        self.sorted = False
+        self._desc = False
+        if self.array.ndim >= 1 and self.array.shape[-1] > 1:
+            d = np.diff(self.array, axis=-1)
+            if np.all(d >= 0):
+                self.sorted = True
+            elif np.all(d <= 0):
+                self.sorted = True
+                self._desc = True
+
+    def index(self, val):
+        """returns _val
+
+        **Index of the entry closest to val along the last axis, vectorized
+        over val. For (..., n) arrays val broadcasts against (...)**
+
+        Args
+        ----
+        :val:       value or array of values
+
+        Return
+        ------
+        :_val:      index (shape of val, broadcast against (...))
+        """
+
+        a = self.array
+        if not self.sorted:
+            if a.ndim == 1 and np.ndim(val) == 0:
+                return (np.abs(a - val)).argmin()
+            if a.ndim == 1:
+                _val = [(np.abs(a - v)).argmin() for v in np.ravel(val)]
+                return np.reshape(_val, np.shape(val))
+            return (np.abs(a - np.asarray(val)[..., None])).argmin(axis=-1)
+
+        if self._desc:
+            a = a[..., ::-1]
+        n = a.shape[-1]
+        if a.ndim == 1 and isinstance(val, (int, float, np.generic)):
+            if val != val:  # argmin of nan
+                return 0
+            i = min(max(int(a.searchsorted(val)), 1), n - 1)
+            lo = val - a[i - 1]
+            hi = a[i] - val
+            if self._desc:
+                j = i - 1 if lo < hi else i
+                if j < n - 1 and a[j + 1] == a[j]:
+                    j = int(a.searchsorted(a[j], 'right')) - 1
+                return n - 1 - j
+            j = i - 1 if lo <= hi else i
+            if j > 0 and a[j - 1] == a[j]:
+                j = int(a.searchsorted(a[j], 'left'))
+            return j
+
+        val = np.asarray(val)
+        if a.ndim > 1:
+            shape = np.broadcast_shapes(val.shape, a.shape[:-1])
+            a = np.broadcast_to(a, shape + (n,))
+            val = np.broadcast_to(val, shape)
+        i = np.clip(_search(a, val, 'left'), 1, n - 1)
+        lo = val - _take(a, i - 1)
+        hi = _take(a, i) - val
+        if self._desc:  # ties go to the higher index in reversed order
+            j = np.where(lo < hi, i - 1, i)
+            _val = n - _search(a, _take(a, j), 'right')
+        else:
+            j = np.where(lo <= hi, i - 1, i)
+            _val = _search(a, _take(a, j), 'left')
+        _val = np.where(np.isnan(val), 0, _val)  # argmin of nan
+
+        return _val
+
+
+def index_range(array, rng=None):
+    """returns slice
+
+    **Index range of the entries of a monotonic axis within rng**
+
+    Args
+    ----
+    :array:     axis or Axis
+    :rng:       (a, b) physical range, None: full axis
+
+    Return
+    ------
+    :slice:     slice from the entry closest to min(a, b) to the entry
+                closest to max(a, b) (included)
+    """
+
+    if rng is None:
+        return slice(None)
+    if not isinstance(array, Axis):
+        array = Axis(array)
+    _val = array.index(np.asarray(rng, dtype=float))
+
+    return slice(int(np.min(_val)), int(np.max(_val)) + 1)
+
+
+def _search(a, val, side):
+    """returns searchsorted(a, val, side) along the last axis of a,
+    a and val broadcast to a.shape[:-1] == val.shape if a is not 1D"""
+    if a.ndim == 1:
+        return a.searchsorted(val, side)
+
+    # bisection on all rows at once
+    n = a.shape[-1]
+    lo = np.zeros(val.shape, dtype=int)
+    hi = np.full(val.shape, n)
+    for _ in range(n.bit_length()):
+        mid = (lo + hi) // 2
+        a_mid = _take(a, np.minimum(mid, n - 1))
+        go = (a_mid < val) if side == 'left' else (a_mid <= val)
+        run = lo < hi
+        lo = np.where(run & go, mid + 1, lo)
+        hi = np.where(run & ~go, mid, hi)
+
+    return lo
+
+
+def _take(a, idx):
+    """returns a[..., idx] row by row (a[idx] if a is 1D)"""
+    if a.ndim == 1:
+        return a[idx]
+    return np.take_along_axis(a, idx[..., None], -1)[..., 0]
+
+
+def Shirley(EDC, axis=-1, tol=1e-6, it_max=10):
+    """returns shirley
 
     **Generates a Shirley background from given edc**
 
+    Works on a single EDC or on all EDCs of a 2D cut / 3D map at once,
+    the tail sums are computed as cumulative sums. Iterations stop after
+    it_max or as soon as the background of every EDC changes by less than
+    tol * max(EDC).
+
     Args
     ----
-    :array:     entry value in array
-    :_val:      index of entry
+    :EDC:       energy distribution curve(s)
+    :axis:      energy axis of EDC
+    :tol:       relative tolerance for convergence
+    :it_max:    maximum number of iterations
 
     Return
     ------
-    :array[_val]:   entry value in array
-    :_val:          index of entry
+    :shirley:   Shirley background, same shape as EDC
     """
 
-    n = len(EDC)
-    A = 1e-5
-    shirley = np.ones((n))
-    shirley[-1] = EDC[-1]
-    shirley[-2] = EDC[-1]
-    it = 10  # iterations
+    EDC = np.moveaxis(np.asarray(EDC, dtype=float), axis, -1)
+    A = np.full(EDC.shape[:-1] + (1,), 1e-5)
+    shirley = np.ones(EDC.shape)
+    shirley[..., -2:] = EDC[..., -1:]
+    tol = tol * np.max(np.abs(EDC), axis=-1, keepdims=True)
+    active = np.ones(A.shape, dtype=bool)  # EDCs not converged yet
 
     # start algorithm
-    for k in range(it):
-        for i in range(n - 2):
-            SUM = 0.
-            for j in np.arange(i + 1, n):
-                SUM += (EDC[j] - shirley[j])
-            shirley[i] = shirley[-1] + A * SUM
-        A = A * (1. + (EDC[0] - shirley[0]) / EDC[0])
+    for k in range(it_max):
+
+        # sum over the tail j > i of (EDC[j] - shirley[j])
+        tail = np.cumsum((EDC - shirley)[..., ::-1], axis=-1)[..., ::-1]
+        new = shirley[..., -1:] + A * tail[..., 1:-1]
+
+        change = np.max(np.abs(new - shirley[..., :-2]), axis=-1,
+                        keepdims=True)
+        shirley[..., :-2] = np.where(active, new, shirley[..., :-2])
+        A = np.where(active,
+                     A * (1. + (EDC[..., :1] - shirley[..., :1]) /
+                          EDC[..., :1]),
+                     A)
+        active &= ~(change < tol)
+        if not np.any(active):
+            break
+
+    return np.moveaxis(shirley, -1, axis)
+
+
+def _fit_chain(f, x, Y, p_ini, jac=None, sigma=None, bounds=None,
+               dbounds=None):
+    """returns p_fit, p_err, chi2, success
+
+    **Single worker task of fit_chain: fits f to a chain of rows,
+    every fit is started from the result of the previous row**
+    """
+
+    n, m = Y.shape[0], len(p_ini)
+    X = np.broadcast_to(x, Y.shape)
+    p_fit = np.zeros((n, m))
+    p_err = np.full((n, m), np.inf)
+    chi2 = np.zeros(n)
+    success = np.zeros(n, dtype=bool)
+    if bounds is None:
+        bounds = (-np.inf, np.inf)
+    lb, ub = np.broadcast_arrays(np.asarray(bounds[0], dtype=float),
+                                 np.asarray(bounds[1], dtype=float),
+                                 np.zeros(m))[:2]
+    kwargs = {} if jac is None else {'jac': jac}
+
+    p_ini = np.asarray(p_ini, dtype=float)
+    p_0 = p_ini
+    for i in range(n):
+        s = None if sigma is None else sigma[i]
+        c = None
+        for p_start in (p_0, p_ini):  # retry from p_ini if warm start fails
+            lb_i, ub_i = lb, ub
+            if dbounds is not None:  # bounds around the starting point
+                lb_i = np.maximum(lb, p_start - dbounds)
+                ub_i = np.minimum(ub, p_start + dbounds)
+            try:
+                p, c = curve_fit(f, X[i], Y[i], np.clip(p_start, lb_i, ub_i),
+                                 sigma=s, bounds=(lb_i, ub_i), **kwargs)
+                success[i] = True
+                break
+            except (RuntimeError, ValueError):
+                p, c = p_0, None
+        p_fit[i] = p
+        if c is not None and np.all(np.isfinite(np.diag(c))):
+            p_err[i] = np.sqrt(np.abs(np.diag(c)))
+        res = Y[i] - f(X[i], *p)
+        if s is not None:
+            res = res / s
+        chi2[i] = np.sum(res ** 2) / max(1, Y.shape[1] - m)
+        if success[i]:
+            p_0 = p
+
+    return p_fit, p_err, chi2, success
+
+
+def fit_chain(f, x, Y, p_ini, ch=None, jac=None, sigma=None, bounds=None,
+              dbounds=None, n_jobs=1, n_chunks=None, pool='thread',
+              fit_seed=True):
+    """returns p_fit, p_err, chi2, success
+
+    **Fits f to every row of Y, warm-starting each row from its
+    neighbour, optionally in parallel**
+
+    The seed row ch is fitted from p_ini first (fit_seed='False': p_ini are
+    taken as the fit of the seed row). By default one chain runs away from
+    ch on each side, every row warm-started from its neighbour. With
+    n_chunks and n_jobs > 1 the rows are split into n_chunks contiguous
+    chains running on n_jobs workers. The first chain of each side starts
+    at the seed, the first rows of the other chains are fitted as one
+    coarse chain from the seed without the dbounds window, as they are far
+    apart. n_chunks is ignored for n_jobs=1 (sequential fit); for n_jobs > 1
+    the results depend on n_chunks but not on the number of workers.
+
+    Args
+    ----
+    :f:         model f(x, *p)
+    :x:         x-axis, (k) or one per row (row, k)
+    :Y:         data (row, k)
+    :p_ini:     initial parameters of the seed row
+    :ch:        seed row (default: center row)
+    :jac:       analytic Jacobian jac(x, *p) of f (optional)
+    :sigma:     errors on Y (optional)
+    :bounds:    (lower, upper) bounds of the parameters (optional)
+    :dbounds:   half width of a window around the starting point every
+                parameter is bound to (optional, np.inf: free)
+    :n_jobs:    number of workers (default: 1, None: number of cores)
+    :n_chunks:  number of chains if n_jobs > 1 (default: one per side of
+                ch)
+    :pool:      'thread' or 'process' (needs a __main__ guard on spawn
+                platforms)
+    :fit_seed:  'False': seed row is not fitted, p_err is inf
+
+    Return
+    ------
+    :p_fit:     fitted parameters (row, p)
+    :p_err:     standard errors of p_fit (inf if not available)
+    :chi2:      reduced chi-square of every row
+    :success:   'True' where the fit converged
+    """
+
+    x = np.asarray(x, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    X = np.broadcast_to(x, Y.shape)
+    S = None if sigma is None else np.broadcast_to(sigma, Y.shape)
+    n = Y.shape[0]
+    if ch is None:
+        ch = n // 2
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+
+    # seed row
+    p_fit = np.zeros((n, len(p_ini)))
+    p_err = np.zeros((n, len(p_ini)))
+    chi2 = np.zeros(n)
+    success = np.zeros(n, dtype=bool)
+    if fit_seed:
+        (p_fit[[ch]], p_err[[ch]], chi2[[ch]],
+         success[[ch]]) = _fit_chain(f, X[[ch]], Y[[ch]], p_ini, jac,
+                                     None if S is None else S[[ch]], bounds)
+    else:
+        p_fit[ch], p_err[ch], success[ch] = p_ini, np.inf, True
+    p_seed = p_fit[ch] if success[ch] else np.asarray(p_ini, dtype=float)
+
+    # chains running away from the seed row on both sides
+    left = np.arange(ch - 1, -1, -1)
+    right = np.arange(ch + 1, n)
+    if n_chunks is None or n_jobs == 1:
+        n_l = n_r = 1
+    else:
+        n_l = int(np.round(n_chunks * left.size / max(1, n - 1)))
+        n_r = n_chunks - n_l
+    chains = []
+    heads = []
+    for side, n_side in ((left, n_l), (right, n_r)):
+        if side.size:
+            side = np.array_split(side, max(1, min(n_side, side.size)))
+            chains.append((side[0], p_seed))
+            heads.append(side[1:])
+
+    # first rows of the other chains: one coarse chain from the seed
+    for side in heads:
+        if not side:
+            continue
+        idx = [c[0] for c in side]
+        res = _fit_chain(f, X[idx], Y[idx], p_seed, jac,
+                         None if S is None else S[idx], bounds)
+        for i, c in enumerate(side):
+            p_fit[c[0]], p_err[c[0]] = res[0][i], res[1][i]
+            chi2[c[0]], success[c[0]] = res[2][i], res[3][i]
+            if c.size > 1:
+                chains.append((c[1:], res[0][i]))
+
+    # every chain is continued from its starting point
+    tasks = [(f, X[c], Y[c], p_0, jac, None if S is None else S[c], bounds,
+              dbounds) for c, p_0 in chains]
+    if n_jobs == 1 or len(tasks) < 2:
+        results = [_fit_chain(*t) for t in tasks]
+    else:
+        if pool == 'thread':
+            executor = ThreadPoolExecutor(max_workers=n_jobs)
+        elif pool == 'process':
+            executor = ProcessPoolExecutor(max_workers=n_jobs)
+        else:
+            raise ValueError("pool must be 'thread' or 'process'")
+        with executor:
+            futures = [executor.submit(_fit_chain, *t) for t in tasks]
+            results = [fut.result() for fut in futures]
+    for (c, p_0), res in zip(chains, results):
+        p_fit[c], p_err[c], chi2[c], success[c] = res
+
+    return p_fit, p_err, chi2, success
+
+
+def gold_fit(en, EDCs, p_ini, ch=None, n_jobs=1, n_chunks=None,
+             pool='thread'):
+    """returns p_fit, p_err, chi2, success
+
+    **Fits a Fermi Dirac function on a sloped background (FDsl) to every
+    channel of a gold spectrum, warm-started from the neighbouring channel
+    (fit_chain)**
+
+    Args
+    ----
+    :en:        energy axis
+    :EDCs:      intensities (channel, en)
+    :p_ini:     initial parameters of FDsl
+    :ch:        seed channel (default: center channel)
+    :n_jobs:    number of workers (default: 1, None: number of cores)
+    :n_chunks:  number of chains if n_jobs > 1 (default: one per side of
+                ch)
+    :pool:      'thread' or 'process'
+
+    Return
+    ------
+    :p_fit:     fitted parameters (channel, 5)
+    :p_err:     standard errors of p_fit (inf if not available)
+    :chi2:      reduced chi-square of every channel
+    :success:   'True' where the fit converged
+    """
+
+    return fit_chain(FDsl, en, EDCs, p_ini, ch=ch, jac=FDsl_jac,
+                     n_jobs=n_jobs, n_chunks=n_chunks, pool=pool)
+
+
+def mdc_fit(k, MDCs, p_ini, ch=0, eMDCs=None, bounds=None, dbounds=None,
+            n_jobs=1, n_chunks=None, pool='thread', fit_seed=True):
+    """returns loc, eloc, width, ewidth, p_fit, p_err
+
+    **Fits n Lorentzians on a quadratic background (lor_n) to every MDC of
+    a cut, using the analytic Jacobian lor_n_jac**
+
+    The number of Lorentzians n follows from len(p_ini) = 3 * n + 3. The
+    MDC ch is fitted from p_ini, all others are warm-started from their
+    neighbour running away from ch (fit_chain).
+
+    Args
+    ----
+    :k:         momentum, (k) or one per MDC (MDC, k)
+    :MDCs:      intensities (MDC, k), e.g. int_norm.T of a cut
+    :p_ini:     initial parameters of lor_n
+    :ch:        seed MDC (default: first)
+    :eMDCs:     errors on MDCs (optional)
+    :bounds:    (lower, upper) bounds of the parameters (optional)
+    :dbounds:   half width of a window around the warm start every
+                parameter is bound to (optional, np.inf: free)
+    :n_jobs:    number of workers (default: 1, None: number of cores)
+    :n_chunks:  number of chains if n_jobs > 1 (default: one per side of
+                ch)
+    :pool:      'thread' or 'process'
+    :fit_seed:  'False': p_ini are taken as the fit of MDC ch
+
+    Return
+    ------
+    :loc:       positions (MDC) for n=1, (MDC, n) otherwise
+    :eloc:      errors on loc
+    :width:     HWHM, same shape as loc
+    :ewidth:    errors on width
+    :p_fit:     all fitted parameters (MDC, 3 * n + 3)
+    :p_err:     standard errors of p_fit
+    """
+
+    n = (len(p_ini) - 3) // 3
+    p_fit, p_err, chi2, success = fit_chain(
+            _lor_n_p, k, MDCs, p_ini, ch=ch, jac=_lor_n_p_jac, sigma=eMDCs,
+            bounds=bounds, dbounds=dbounds, n_jobs=n_jobs, n_chunks=n_chunks,
+            pool=pool, fit_seed=fit_seed)
+    if not np.all(success):
+        print("Error - convergence not reached for MDCs",
+              np.flatnonzero(~success))
+
+    loc, eloc = p_fit[:, :n], p_err[:, :n]
+    width, ewidth = p_fit[:, n:2*n], p_err[:, n:2*n]
+    if n == 1:
+        loc, eloc = loc[:, 0], eloc[:, 0]
+        width, ewidth = width[:, 0], ewidth[:, 0]
 
-    return shirley
+    return loc, eloc, width, ewidth, p_fit, p_err
+
+
+def write_atomic(path, write, mode='wb'):
+    """returns None
+
+    **Writes a file through a unique temporary file in the same folder,
+    which then replaces path: readers never see partial files and
+    concurrent writers do not mix their output**
+
+    Args
+    ----
+    :path:      file name
+    :write:     write(f) writes the content into the open file f
+    :mode:      file mode, 'wb' or 'w'
+    """
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                               suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def gold_key(gold, **params):
+    """returns key
+
+    **Content address of a gold calibration: digest of the gold file id and
+    the parameters of the fit**
+
+    Args
+    ----
+    :gold:      gold file id
+    :params:    fit parameters, e.g. Ef_ini, T_ini
+
+    Return
+    ------
+    :key:       hex digest
+    """
+
+    ident = json.dumps([str(gold), sorted((k, repr(v)) for k, v in
+                                          params.items())])
+    key = hashlib.sha1(ident.encode()).hexdigest()
+
+    return key
+
+
+def gold_save(folder, gold, Ef, norm, **params):
+    """returns key
+
+    **Writes a gold calibration into the binary store of the sample folder**
+
+    The calibration is saved as folder/gold_cache/<key>.npy with
+    key = gold_key(gold, **params), the index folder/gold_cache/index.json
+    points from the gold file id to the latest key.
+
+    Args
+    ----
+    :folder:    sample folder
+    :gold:      gold file id
+    :Ef:        Fermi energy per channel
+    :norm:      normalization per channel
+    :params:    fit parameters
+
+    Return
+    ------
+    :key:       content address of the calibration
+    """
+
+    store = os.path.join(folder, 'gold_cache')
+    os.makedirs(store, exist_ok=True)
+    key = gold_key(gold, **params)
+
+    # write to temporary files first, readers never see partial files
+    calib = np.stack((np.asarray(Ef, dtype=float),
+                      np.asarray(norm, dtype=float)))
+    write_atomic(os.path.join(store, key + '.npy'),
+                 lambda f: np.save(f, calib))
+
+    index_path = os.path.join(store, 'index.json')
+    try:
+        index = dict(_gold_index(index_path, _stamp(index_path)))
+    except OSError:
+        index = {}
+    index[str(gold)] = key
+    write_atomic(index_path, lambda f: json.dump(index, f, indent=1), 'w')
+
+    return key
+
+
+def gold_load(folder, gold, **params):
+    """returns Ef, norm
+
+    **Reads a gold calibration, repeated calls are served from memory**
+
+    With params the calibration is looked up by its content address,
+    otherwise the latest calibration of the gold file is used. Sample folders
+    without store fall back to the text files Ef_<gold>.dat and (optional)
+    norm_<gold>.dat. Raises OSError if no calibration is found.
+
+    Args
+    ----
+    :folder:    sample folder
+    :gold:      gold file id
+    :params:    fit parameters (optional)
+
+    Return
+    ------
+    :Ef:        Fermi energy per channel (read-only)
+    :norm:      normalization per channel (read-only), None if there is
+                only a legacy Ef_<gold>.dat file
+    """
+
+    store = os.path.join(folder, 'gold_cache')
+    if params:
+        key = gold_key(gold, **params)
+    else:
+        index_path = os.path.join(store, 'index.json')
+        try:
+            key = dict(_gold_index(index_path,
+                                   _stamp(index_path))).get(str(gold))
+        except OSError:
+            key = None
+
+    if key is not None:
+        paths = (os.path.join(store, key + '.npy'),)
+    else:
+        paths = (os.path.join(folder, 'Ef_' + str(gold) + '.dat'),
+                 os.path.join(folder, 'norm_' + str(gold) + '.dat'))
+        if not os.path.exists(paths[1]):
+            paths = paths[:1]
+    Ef, norm = _gold_read(paths, _stamp(*paths))
+
+    return Ef, norm
+
+
+def _stamp(*paths):
+    """returns stamp
+
+    **(mtime, size) of every file in paths, key of the gold caches: a
+    rewritten file invalidates the entry. Raises OSError if a file is
+    missing**
+    """
+
+    stamp = tuple((st.st_mtime_ns, st.st_size) for st in map(os.stat, paths))
+
+    return stamp
+
+
+@lru_cache(maxsize=8)
+def _gold_index(path, stamp):
+    """returns index
+
+    **Cached index of the gold store, stamp (_stamp) invalidates the entry**
+    """
+
+    with open(path) as f:
+        index = tuple(json.load(f).items())
+
+    return index
+
+
+@lru_cache(maxsize=64)
+def _gold_read(paths, stamp):
+    """returns Ef, norm
+
+    **Cached gold calibration, memory-mapped from the store (paths: npy
+    file) or parsed from the legacy text files (paths: Ef file, optional
+    norm file). stamp (_stamp) of paths invalidates the entry**
+    """
+
+    if paths[0].endswith('.npy'):
+        Ef, norm = np.load(paths[0], mmap_mode='r')
+    else:
+        Ef = np.loadtxt(paths[0])
+        Ef.setflags(write=False)
+        norm = None
+        if len(paths) > 1:
+            norm = np.loadtxt(paths[1])
+            norm.setflags(write=False)
+
+    return Ef, norm
 
 
 """
@@ -388,6 +1012,174 @@ def paramCSRO_fit():
     return param
 
 
+def SRO_H(x, y, param=paramSRO(), a=np.pi):
+    """returns H
+
+    **Stack of 3 band tight binding Hamiltonians of Sr2RuO4**
+
+    Args
+    ----
+    :x:         kx array (any shape)
+    :y:         ky array (same shape as x)
+    :param:     TB parameters
+    :a:         TB lattice constant in units pi/a
+
+    Return
+    ------
+    :H:         Hamiltonians, shape x.shape + (3, 3)
+    """
+
+    # Load TB parameters
+    t1 = param['t1']  # Nearest neighbour for out-of-plane orbitals large
+    t2 = param['t2']  # Nearest neighbour for out-of-plane orbitals small
+    t3 = param['t3']  # Nearest neighbour for dxy orbitals
+    t4 = param['t4']  # Next nearest neighbour for dxy orbitals
+    t5 = param['t5']  # Next next nearest neighbour for dxy orbitals
+    t6 = param['t6']  # Off diagonal matrix element
+    mu = param['mu']  # Chemical potential
+    so = param['so']  # spin orbit coupling
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+
+    # Hopping terms
+    fyz = - 2 * t2 * np.cos(x * a) - 2 * t1 * np.cos(y * a)
+    fxz = - 2 * t1 * np.cos(x * a) - 2 * t2 * np.cos(y * a)
+    fxy = - 2 * t3 * (np.cos(x * a) + np.cos(y * a)) - \
+        4 * t4 * (np.cos(x * a) * np.cos(y * a)) - \
+        2 * t5 * (np.cos(2 * x * a) + np.cos(2 * y * a))
+    off = - 4 * t6 * (np.sin(x * a) * np.sin(y * a))
+
+    # Tight binding Hamiltonian on all k-points
+    H = np.zeros(fyz.shape + (3, 3), dtype=complex)
+    H[..., 0, 0] = fyz - mu
+    H[..., 0, 1] = off + complex(0, so)
+    H[..., 0, 2] = -so
+    H[..., 1, 0] = off - complex(0, so)
+    H[..., 1, 1] = fxz - mu
+    H[..., 1, 2] = complex(0, so)
+    H[..., 2, 0] = -so
+    H[..., 2, 1] = -complex(0, so)
+    H[..., 2, 2] = fxy - mu
+
+    return H
+
+
+def CSRO_H(x, y, param=paramCSRO_fit(), a=np.pi):
+    """returns H
+
+    **Stack of 6 band bilayer tight binding Hamiltonians of Ca1.8Sr0.2RuO4**
+
+    Args
+    ----
+    :x:         kx array (any shape)
+    :y:         ky array (same shape as x)
+    :param:     TB parameters
+    :a:         TB lattice constant in units pi/a
+
+    Return
+    ------
+    :H:         Hamiltonians, shape x.shape + (6, 6)
+    """
+
+    # Load TB parameters
+    t1 = param['t1']  # Nearest neighbour for out-of-plane orbitals large
+    t2 = param['t2']  # Nearest neighbour for out-of-plane orbitals small
+    t3 = param['t3']  # Nearest neighbour for dxy orbitals
+    t4 = param['t4']  # Next nearest neighbour for dxy orbitals
+    t5 = param['t5']  # Next next nearest neighbour for dxy orbitals
+    t6 = param['t6']  # Off diagonal matrix element
+    mu = param['mu']  # Chemical potential
+    so = param['so']  # spin orbit coupling
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+
+    # Hopping terms
+    fx = -2 * np.cos((x + y) / 2 * a)
+    fy = -2 * np.cos((x - y) / 2 * a)
+    f4 = -2 * t4 * (np.cos(x * a) + np.cos(y * a))
+    f5 = -2 * t5 * (np.cos((x + y) * a) + np.cos((x - y) * a))
+    f6 = -2 * t6 * (np.cos(x * a) - np.cos(y * a))
+
+    # TB submatrix A (intra-layer)
+    A = np.zeros(fx.shape + (3, 3), dtype=complex)
+    A[..., 0, 0] = -mu
+    A[..., 0, 1] = complex(0, so) + f6
+    A[..., 0, 2] = -so
+    A[..., 1, 0] = -complex(0, so) + f6
+    A[..., 1, 1] = -mu
+    A[..., 1, 2] = complex(0, so)
+    A[..., 2, 0] = -so
+    A[..., 2, 1] = -complex(0, so)
+    A[..., 2, 2] = -mu + f4 + f5
+
+    # TB submatrix B (inter-layer), diagonal
+    B = np.zeros(fx.shape + (3, 3), dtype=complex)
+    B[..., 0, 0] = t2 * fx + t1 * fy
+    B[..., 1, 1] = t1 * fx + t2 * fy
+    B[..., 2, 2] = t3 * (fx + fy)
+
+    # Tight binding Hamiltonian [[A, B], [B, A]] on all k-points
+    H = np.zeros(fx.shape + (6, 6), dtype=complex)
+    H[..., :3, :3] = A
+    H[..., :3, 3:] = B
+    H[..., 3:, :3] = B
+    H[..., 3:, 3:] = A
+
+    return H
+
+
+def CSRO_dH(x, y, a=np.pi):
+    """returns dH
+
+    **Derivatives of CSRO_H with respect to the TB parameters**
+
+    The Hamiltonian is linear in t1..t6, mu and so, hence dH/dp is CSRO_H
+    evaluated with p = 1 and all other parameters set to zero.
+
+    Args
+    ----
+    :x:         kx array (any shape)
+    :y:         ky array (same shape as x)
+    :a:         TB lattice constant in units pi/a
+
+    Return
+    ------
+    :dH:        derivatives, shape (8,) + x.shape + (6, 6), order t1..so
+    """
+
+    keys = ['t1', 't2', 't3', 't4', 't5', 't6', 'mu', 'so']
+
+    dH = np.array([CSRO_H(x, y, dict([(k, float(k == key)) for k in keys]), a)
+                   for key in keys])
+
+    return dH
+
+
+def eig_H(H, vec=False):
+    """returns val (, vec)
+
+    **Diagonalizes a stack of Hermitian Hamiltonians in one call**
+
+    Args
+    ----
+    :H:         Hamiltonians, shape (..., n, n)
+    :vec:       'True': also returns eigenvectors
+
+    Return
+    ------
+    :val:       eigenvalues in ascending order, shape (..., n)
+    :vec:       eigenvectors as columns, shape (..., n, n) (vec=True)
+    """
+
+    if vec:
+        val, vec = la.eigh(H)
+        return val, vec
+    else:
+        return la.eigvalsh(H)
+
+
 class TB:
     """
     %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
@@ -419,7 +1211,8 @@ class TB:
         self.a = a
         self.coord = dict([('x', x), ('y', y), ('X', X), ('Y', Y)])
 
-    def SRO(self, param=paramSRO(), e0=0, vert=False, proj=False):
+    def SRO(self, param=paramSRO(), e0=0, vert=False, proj=False,
+            batch=True):
         """returns self.bndstr, self.kx, self.ky, self.FS
 
         **Calculates band structure from 3 band tight binding model**
@@ -430,6 +1223,8 @@ class TB:
         :e0:        chemical potential shift
         :vert:      'True': plots useful numeration of vertices for figures
         :proj:      'True': projects onto orbitals
+        :batch:     'True': diagonalizes the whole k-mesh in one call,
+                    'False': diagonalizes k-point by k-point
 
         Return
         ------
@@ -439,16 +1234,6 @@ class TB:
         :self.FS:       FS coordinates (vert=True and proj=True)
         """
 
-        # Load TB parameters
-        t1 = param['t1']  # Nearest neighbour for out-of-plane orbitals large
-        t2 = param['t2']  # Nearest neighbour for out-of-plane orbitals small
-        t3 = param['t3']  # Nearest neighbour for dxy orbitals
-        t4 = param['t4']  # Next nearest neighbour for dxy orbitals
-        t5 = param['t5']  # Next next nearest neighbour for dxy orbitals
-        t6 = param['t6']  # Off diagonal matrix element
-        mu = param['mu']  # Chemical potential
-        so = param['so']  # spin orbit coupling
-
         coord = self.coord
         a = self.a
         x = coord['x']
@@ -456,35 +1241,31 @@ class TB:
         X = coord['X']
         Y = coord['Y']
 
-        # Hopping terms
-        fyz = - 2 * t2 * np.cos(X * a) - 2 * t1 * np.cos(Y * a)
-        fxz = - 2 * t1 * np.cos(X * a) - 2 * t2 * np.cos(Y * a)
-        fxy = - 2 * t3 * (np.cos(X * a) + np.cos(Y * a)) - \
-            4 * t4 * (np.cos(X * a) * np.cos(Y * a)) - \
-            2 * t5 * (np.cos(2 * X * a) + np.cos(2 * Y * a))
-        off = - 4 * t6 * (np.sin(X * a) * np.sin(Y * a))
-
-        # Placeholders energy eigenvalues
-        yz = np.ones((len(x), len(y)))
-        xz = np.ones((len(x), len(y)))
-        xy = np.ones((len(x), len(y)))
+        # Tight binding Hamiltonian on k-mesh, shape (len(y), len(x), 3, 3)
+        Hk = SRO_H(X, Y, param, a)
 
-        # Tight binding Hamiltonian
-        def H(i, j):
-            H = np.array([[fyz[i, j] - mu, off[i, j] + complex(0, so), -so],
-                          [off[i, j] - complex(0, so), fxz[i, j] - mu,
-                           complex(0, so)],
-                          [-so, -complex(0, so), fxy[i, j] - mu]])
-            return H
+        def H(i, j):
+            return Hk[i, j]
 
         # Diagonalization of symmetric Hermitian matrix on k-mesh
-        for i in range(len(x)):
-            for j in range(len(y)):
-                val = la.eigvalsh(H(i, j))
-                val = np.real(val)
-                yz[i, j] = val[0]
-                xz[i, j] = val[1]
-                xy[i, j] = val[2]
+        if batch:
+            val = eig_H(Hk)
+            yz = val[:, :, 0]
+            xz = val[:, :, 1]
+            xy = val[:, :, 2]
+        else:
+            # Placeholders energy eigenvalues
+            yz = np.ones((len(x), len(y)))
+            xz = np.ones((len(x), len(y)))
+            xy = np.ones((len(x), len(y)))
+
+            for i in range(len(x)):
+                for j in range(len(y)):
+                    val = la.eigvalsh(H(i, j))
+                    val = np.real(val)
+                    yz[i, j] = val[0]
+                    xz[i, j] = val[1]
+                    xy[i, j] = val[2]
 
         # Band structure
         bndstr = (yz, xz, xy)
@@ -522,6 +1303,10 @@ class TB:
                 ky = np.linspace(np.min(y), np.max(y), 1000)
                 FS = np.zeros((len(kx), len(ky)))
 
+                # nearest-index lookup on k-mesh and FS axes
+                x_ax, y_ax = Axis(x), Axis(y)
+                kx_ax, ky_ax = Axis(kx), Axis(ky)
+
             for n_bnd in range(len(bndstr)):
                 p = C[n_bnd].collections[0].get_paths()
                 p = np.asarray(p)
@@ -549,12 +1334,17 @@ class TB:
 
                 if proj:  # Do projection for all vertices
                     for j in range(len(V_x)):  # Loop over all vertices
+
+                        # grid points of all k-points of this contour
+                        x_idx = x_ax.index(V_x[j])
+                        y_idx = y_ax.index(V_y[j])
+                        kx_idx = kx_ax.index(V_x[j])
+                        ky_idx = ky_ax.index(V_y[j])
                         for i in range(len(V_x[j])):  # Loop over k-points
 
-                            #  Find values and diagonalize
-                            x_val, x_idx = find(x, V_x[j][i])
-                            y_val, y_idx = find(y, V_y[j][i])
-                            val_proj, vec_proj = la.eigh(H(x_idx, y_idx))
+                            # Diagonalize
+                            val_proj, vec_proj = la.eigh(
+                                    H(x_idx[i], y_idx[i]))
                             val_proj = np.real(val_proj)
 
                             # orbital weights
@@ -578,9 +1368,7 @@ class TB:
                             w = np.tanh(10 * (wz - wxy))
 
                             # Build Fermi surface
-                            kx_val, kx_idx = find(kx, V_x[j][i])
-                            ky_val, ky_idx = find(ky, V_y[j][i])
-                            FS[kx_idx, ky_idx] = w
+                            FS[kx_idx[i], ky_idx[i]] = w
 
             # Blur for visual effect
             FS = gaussian_filter(FS, sigma=10, mode='constant')
@@ -727,6 +1515,10 @@ class TB:
                 ky = np.linspace(np.min(y), np.max(y), 1000)
                 FS = np.zeros((len(kx), len(ky)))
 
+                # nearest-index lookup on k-mesh and FS axes
+                x_ax, y_ax = Axis(x), Axis(y)
+                kx_ax, ky_ax = Axis(kx), Axis(ky)
+
             for n_bnd in range(len(bndstr)):
                 p = C[n_bnd].collections[0].get_paths()
                 p = np.asarray(p)
@@ -754,12 +1546,17 @@ class TB:
 
                 if proj:  # Do projection for all vertices
                     for j in range(len(V_x)):  # Loop over all vertices
+
+                        # grid points of all k-points of this contour
+                        x_idx = x_ax.index(V_x[j])
+                        y_idx = y_ax.index(V_y[j])
+                        kx_idx = kx_ax.index(V_x[j])
+                        ky_idx = ky_ax.index(V_y[j])
                         for i in range(len(V_x[j])):  # Loop over k-points
 
-                            #  Find values and diagonalize
-                            x_val, x_idx = find(x, V_x[j][i])
-                            y_val, y_idx = find(y, V_y[j][i])
-                            val_proj, vec_proj = la.eigh(H(x_idx, y_idx))
+                            # Diagonalize
+                            val_proj, vec_proj = la.eigh(
+                                    H(x_idx[i], y_idx[i]))
                             val_proj = np.real(val_proj)
                             if any(x == n for x in [0, 1, 3]):
                                 # orbital weights
@@ -783,9 +1580,7 @@ class TB:
                                 w = np.tanh(10 * (wz - wxy))
 
                                 # Build Fermi surface
-                                kx_val, kx_idx = find(kx, V_x[j][i])
-                                ky_val, ky_idx = find(ky, V_y[j][i])
-                                FS[kx_idx, ky_idx] = w
+                                FS[kx_idx[i], ky_idx[i]] = w
 
             # Blur for visual effect
             FS = gaussian_filter(FS, sigma=10, mode='constant')
@@ -797,7 +1592,8 @@ class TB:
         self.bndstr = dict([('yz', yz), ('xz', xz), ('xy', xy),
                             ('yz_q', yz_q), ('xz_q', xz_q), ('xy_q', xy_q)])
 
-    def CSRO(self, param=paramCSRO_fit(), e0=0, vert=False, proj=True):
+    def CSRO(self, param=paramCSRO_fit(), e0=0, vert=False, proj=True,
+             batch=True):
         """returns self.bndstr, self.kx, self.ky, self.FS
 
         **Calculates band structure from 6 band tight binding model**
@@ -808,6 +1604,8 @@ class TB:
         :e0:        chemical potential shift
         :vert:      'True': plots useful numeration of vertices for figures
         :proj:      'True': projects onto orbitals
+        :batch:     'True': diagonalizes the whole k-mesh in one call,
+                    'False': diagonalizes k-point by k-point
 
         Return
         ------
@@ -817,16 +1615,6 @@ class TB:
         :self.FS:       FS coordinates (vert=True and proj=True)
         """
 
-        # Load TB parameters
-        t1 = param['t1']  # Nearest neighbour for out-of-plane orbitals large
-        t2 = param['t2']  # Nearest neighbour for out-of-plane orbitals small
-        t3 = param['t3']  # Nearest neighbour for dxy orbitals
-        t4 = param['t4']  # Next nearest neighbour for dxy orbitals
-        t5 = param['t5']  # Next next nearest neighbour for dxy orbitals
-        t6 = param['t6']  # Off diagonal matrix element
-        mu = param['mu']  # Chemical potential
-        so = param['so']  # spin orbit coupling
-
         coord = self.coord
         a = self.a
         x = coord['x']
@@ -834,53 +1622,39 @@ class TB:
         X = coord['X']
         Y = coord['Y']
 
-        # Hopping terms
-        fx = -2 * np.cos((X + Y) / 2 * a)
-        fy = -2 * np.cos((X - Y) / 2 * a)
-        f4 = -2 * t4 * (np.cos(X * a) + np.cos(Y * a))
-        f5 = -2 * t5 * (np.cos((X + Y) * a) + np.cos((X - Y) * a))
-        f6 = -2 * t6 * (np.cos(X * a) - np.cos(Y * a))
-
-        # Placeholders energy eigenvalues
-        Ayz = np.ones((len(x), len(y)))
-        Axz = np.ones((len(x), len(y)))
-        Axy = np.ones((len(x), len(y)))
-        Byz = np.ones((len(x), len(y)))
-        Bxz = np.ones((len(x), len(y)))
-        Bxy = np.ones((len(x), len(y)))
-
-        # TB submatrix
-        def A(i, j):
-            A = np.array([[-mu, complex(0, so) + f6[i, j], -so],
-                          [-complex(0, so) + f6[i, j], -mu, complex(0, so)],
-                          [-so, -complex(0, so), -mu + f4[i, j] + f5[i, j]]])
-            return A
-
-        # TB submatrix
-        def B(i, j):
-            B = np.array([[t2 * fx[i, j] + t1 * fy[i, j], 0, 0],
-                          [0, t1 * fx[i, j] + t2 * fy[i, j], 0],
-                          [0, 0, t3 * (fx[i, j] + fy[i, j])]])
-            return B
+        # Tight binding Hamiltonian on k-mesh, shape (len(y), len(x), 6, 6)
+        Hk = CSRO_H(X, Y, param, a)
 
-        # Tight binding Hamiltonian
         def H(i, j):
-            C1 = np.concatenate((A(i, j), B(i, j)), 1)
-            C2 = np.concatenate((B(i, j), A(i, j)), 1)
-            H = np.concatenate((C1, C2), 0)
-            return H
+            return Hk[i, j]
 
         # Diagonalization of symmetric Hermitian matrix on k-mesh
-        for i in range(len(x)):
-            for j in range(len(y)):
-                val = la.eigvalsh(H(i, j))
-                val = np.real(val)
-                Ayz[i, j] = val[0]
-                Axz[i, j] = val[1]
-                Axy[i, j] = val[2]
-                Byz[i, j] = val[3]
-                Bxz[i, j] = val[4]
-                Bxy[i, j] = val[5]
+        if batch:
+            val = eig_H(Hk)
+            Ayz = val[:, :, 0]
+            Axz = val[:, :, 1]
+            Axy = val[:, :, 2]
+            Byz = val[:, :, 3]
+            Bxz = val[:, :, 4]
+            Bxy = val[:, :, 5]
+        else:
+            # Placeholders energy eigenvalues
+            Ayz = np.ones((len(x), len(y)))
+            Axz = np.ones((len(x), len(y)))
+            Axy = np.ones((len(x), len(y)))
+            Byz = np.ones((len(x), len(y)))
+            Bxz = np.ones((len(x), len(y)))
+            Bxy = np.ones((len(x), len(y)))
+
+            for i in range(len(x)):
+                for j in range(len(y)):
+                    val = eig_H(H(i, j))
+                    Ayz[i, j] = val[0]
+                    Axz[i, j] = val[1]
+                    Axy[i, j] = val[2]
+                    Byz[i, j] = val[3]
+                    Bxz[i, j] = val[4]
+                    Bxy[i, j] = val[5]
 
         # Band structure
         bndstr = (Ayz, Axz, Axy, Byz, Bxz, Bxy)
@@ -935,6 +1709,10 @@ class TB:
                 ky = np.linspace(np.min(y), np.max(y), 1000)
                 FS = np.zeros((len(kx), len(ky)))
 
+                # nearest-index lookup on k-mesh and FS axes
+                x_ax, y_ax = Axis(x), Axis(y)
+                kx_ax, ky_ax = Axis(kx), Axis(ky)
+
             for n_bnd in range(len(bndstr)):
                 p = C[n_bnd].collections[0].get_paths()
                 p = np.asarray(p)
@@ -961,12 +1739,17 @@ class TB:
 
                 if proj:  # Do projection for all vertices
                     for j in range(len(V_x)):  # Loop over all vertices
+
+                        # grid points of all k-points of this contour
+                        x_idx = x_ax.index(V_x[j])
+                        y_idx = y_ax.index(V_y[j])
+                        kx_idx = kx_ax.index(V_x[j])
+                        ky_idx = ky_ax.index(V_y[j])
                         for i in range(len(V_x[j])):  # Loop over k-points
 
-                            # Find values and diagonalize
-                            x_val, x_idx = find(x, V_x[j][i])
-                            y_val, y_idx = find(y, V_y[j][i])
-                            val_proj, vec_proj = la.eigh(H(x_idx, y_idx))
+                            # Diagonalize
+                            val_proj, vec_proj = la.eigh(
+                                    H(x_idx[i], y_idx[i]))
                             val_proj = np.real(val_proj)
 
                             # orbital weights
@@ -1005,9 +1788,7 @@ class TB:
                             w = np.tanh(10*(wz - wxy))
 
                             # Build Fermi surface
-                            kx_val, kx_idx = find(kx, V_x[j][i])
-                            ky_val, ky_idx = find(ky, V_y[j][i])
-                            FS[kx_idx, ky_idx] = w + 0
+                            FS[kx_idx[i], ky_idx[i]] = w + 0
 
             # Blur for visual effect
             FS = gaussian_filter(FS, sigma=10, mode='constant')
@@ -1075,64 +1856,14 @@ def CSRO_eval(x, y, param=paramCSRO_fit()):
     :bndstr:    eigenenergies band structure
     """
 
-    a = np.pi
-
-    # Load TB parameters
-    t1 = param['t1']  # Nearest neighbour for out-of-plane orbitals large
-    t2 = param['t2']  # Nearest neighbour for out-of-plane orbitals small
-    t3 = param['t3']  # Nearest neighbour for dxy orbitals
-    t4 = param['t4']  # Next nearest neighbour for dxy orbitals
-    t5 = param['t5']  # Next next nearest neighbour for dxy orbitals
-    t6 = param['t6']  # Off diagonal matrix element
-    mu = param['mu']  # Chemical potential
-    so = param['so']  # spin orbit coupling
-
-    # Hopping terms
-    fx = -2 * np.cos((x + y) / 2 * a)
-    fy = -2 * np.cos((x - y) / 2 * a)
-    f4 = -2 * t4 * (np.cos(x * a) + np.cos(y * a))
-    f5 = -2 * t5 * (np.cos((x + y) * a) + np.cos((x - y) * a))
-    f6 = -2 * t6 * (np.cos(x * a) - np.cos(y * a))
-
-    # Placeholders energy eigenvalues
-    Ayz = np.ones(len(x))
-    Axz = np.ones(len(x))
-    Axy = np.ones(len(x))
-    Byz = np.ones(len(x))
-    Bxz = np.ones(len(x))
-    Bxy = np.ones(len(x))
-
-    # TB submatrix
-    def A(i):
-        A = np.array([[-mu, complex(0, so) + f6[i], -so],
-                      [-complex(0, so) + f6[i], -mu, complex(0, so)],
-                      [-so, -complex(0, so), -mu + f4[i] + f5[i]]])
-        return A
-
-    # TB submatrix
-    def B(i):
-        B = np.array([[t2 * fx[i] + t1 * fy[i], 0, 0],
-                      [0, t1 * fx[i] + t2 * fy[i], 0],
-                      [0, 0, t3 * (fx[i] + fy[i])]])
-        return B
-
-    # Tight binding Hamiltonian
-    def H(i):
-        C1 = np.concatenate((A(i), B(i)), 1)
-        C2 = np.concatenate((B(i), A(i)), 1)
-        H = np.concatenate((C1, C2), 0)
-        return H
-
-    # Diagonalization of symmetric Hermitian matrix on k-mesh
-    for i in range(len(x)):
-        val, vec = la.eigh(H(i))
-        val = np.real(val)
-        Ayz[i] = val[0]
-        Axz[i] = val[1]
-        Axy[i] = val[2]
-        Byz[i] = val[3]
-        Bxz[i] = val[4]
-        Bxy[i] = val[5]
+    # Diagonalization of symmetric Hermitian matrices on all k-points at once
+    val = eig_H(CSRO_H(x, y, param, a=np.pi))
+    Ayz = val[..., 0]
+    Axz = val[..., 1]
+    Axy = val[..., 2]
+    Byz = val[..., 3]
+    Bxz = val[..., 4]
+    Bxy = val[..., 5]
 
     bndstr = (Ayz, Axz, Axy, Byz, Bxz, Bxy)
 
@@ -1155,46 +1886,11 @@ def SRO_eval(x, y, param=paramCSRO_fit()):
     :bndstr:    eigenenergies band structure
     """
 
-    a = np.pi
-
-    # Load TB parameters
-    t1 = param['t1']  # Nearest neighbour for out-of-plane orbitals large
-    t2 = param['t2']  # Nearest neighbour for out-of-plane orbitals small
-    t3 = param['t3']  # Nearest neighbour for dxy orbitals
-    t4 = param['t4']  # Next nearest neighbour for dxy orbitals
-    t5 = param['t5']  # Next next nearest neighbour for dxy orbitals
-    t6 = param['t6']  # Off diagonal matrix element
-    mu = param['mu']  # Chemical potential
-    so = param['so']  # spin orbit coupling
-
-    # Hopping terms
-    fyz = - 2 * t2 * np.cos(x * a) - 2 * t1 * np.cos(y * a)
-    fxz = - 2 * t1 * np.cos(x * a) - 2 * t2 * np.cos(y * a)
-    fxy = - 2 * t3 * (np.cos(x * a) + np.cos(y * a)) - \
-        4 * t4 * (np.cos(x * a) * np.cos(y * a)) - \
-        2 * t5 * (np.cos(2 * x * a) + np.cos(2 * y * a))
-    off = - 4 * t6 * (np.sin(x * a) * np.sin(y * a))
-
-    # Placeholders energy eigenvalues
-    yz = np.ones(len(x))
-    xz = np.ones(len(x))
-    xy = np.ones(len(x))
-
-    # Tight binding Hamiltonian
-    def H(i):
-        H = np.array([[fyz[i] - mu, off[i] + complex(0, so), -so],
-                      [off[i] - complex(0, so), fxz[i] - mu,
-                       complex(0, so)],
-                      [-so, -complex(0, so), fxy[i] - mu]])
-        return H
-
-    # Diagonalization of symmetric Hermitian matrix on k-mesh
-    for i in range(len(x)):
-        val, vec = la.eigh(H(i))
-        val = np.real(val)
-        yz[i] = val[0]
-        xz[i] = val[1]
-        xy[i] = val[2]
+    # Diagonalization of symmetric Hermitian matrices on all k-points at once
+    val = eig_H(SRO_H(x, y, param, a=np.pi))
+    yz = val[..., 0]
+    xz = val[..., 1]
+    xy = val[..., 2]
 
     bndstr = (yz, xz, xy)
 
@@ -1219,127 +1915,35 @@ def CSRO_eval_proj(x, y, param=paramCSRO20_opt()):
     :bndstr:    eigenenergies band structure
     """
 
-    a = np.pi
+    # Diagonalization of symmetric Hermitian matrices on all k-points at once
+    val, vec = eig_H(CSRO_H(x, y, param, a=np.pi), vec=True)
+    Ayz = val[:, 0]
+    Axz = val[:, 1]
+    Axy = val[:, 2]
+    Byz = val[:, 3]
+    Bxz = val[:, 4]
+    Bxy = val[:, 5]
 
-    # Load TB parameters
-    t1 = param['t1']  # Nearest neighbour for out-of-plane orbitals large
-    t2 = param['t2']  # Nearest neighbour for out-of-plane orbitals small
-    t3 = param['t3']  # Nearest neighbour for dxy orbitals
-    t4 = param['t4']  # Next nearest neighbour for dxy orbitals
-    t5 = param['t5']  # Next next nearest neighbour for dxy orbitals
-    t6 = param['t6']  # Off diagonal matrix element
-    mu = param['mu']  # Chemical potential
-    so = param['so']  # spin orbit coupling
+    # orbital weights of every band n at every k-point i: |vec[i, orb, n]|^2
+    w_orb = np.abs(vec) ** 2
 
-    # Hopping terms
-    fx = -2 * np.cos((x + y) / 2 * a)
-    fy = -2 * np.cos((x - y) / 2 * a)
-    f4 = -2 * t4 * (np.cos(x * a) + np.cos(y * a))
-    f5 = -2 * t5 * (np.cos((x + y) * a) + np.cos((x - y) * a))
-    f6 = -2 * t6 * (np.cos(x * a) - np.cos(y * a))
+    # Total out-of-plane weight (Ayz, Axz, Byz, Bxz)
+    wz = np.sum(w_orb[:, [0, 1, 3, 4], :], axis=1)
+
+    # Total in-plane weight (Axy, Bxy)
+    wxy = np.sum(w_orb[:, [2, 5], :], axis=1)
 
-    # Placeholders energy eigenvalues
-    Ayz = np.ones(len(x))
-    Axz = np.ones(len(x))
-    Axy = np.ones(len(x))
-    Byz = np.ones(len(x))
-    Bxz = np.ones(len(x))
-    Bxy = np.ones(len(x))
-    wAyz = np.ones((len(x), 6))
-    wAxz = np.ones((len(x), 6))
-    wAxy = np.ones((len(x), 6))
-    wByz = np.ones((len(x), 6))
-    wBxz = np.ones((len(x), 6))
-    wBxy = np.ones((len(x), 6))
-
-    # Projectors
-    PAyz = np.array([[1, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0],
-                     [0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0],
-                     [0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0]])
-    PAxz = np.array([[0, 0, 0, 0, 0, 0], [0, 1, 0, 0, 0, 0],
-                     [0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0],
-                     [0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0]])
-    PAxy = np.array([[0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0],
-                     [0, 0, 1, 0, 0, 0], [0, 0, 0, 0, 0, 0],
-                     [0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0]])
-    PByz = np.array([[0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0],
-                     [0, 0, 0, 0, 0, 0], [0, 0, 0, 1, 0, 0],
-                     [0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0]])
-    PBxz = np.array([[0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0],
-                     [0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0],
-                     [0, 0, 0, 0, 1, 0], [0, 0, 0, 0, 0, 0]])
-    PBxy = np.array([[0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0],
-                     [0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0],
-                     [0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 1]])
-
-    # TB submatrix
-    def A(i):
-        A = np.array([[-mu, complex(0, so) + f6[i], -so],
-                      [-complex(0, so) + f6[i], -mu, complex(0, so)],
-                      [-so, -complex(0, so), -mu + f4[i] + f5[i]]])
-        return A
-
-    # TB submatrix
-    def B(i):
-        B = np.array([[t2 * fx[i] + t1 * fy[i], 0, 0],
-                      [0, t1 * fx[i] + t2 * fy[i], 0],
-                      [0, 0, t3 * (fx[i] + fy[i])]])
-        return B
-
-    # Tight binding Hamiltonian
-    def H(i):
-        C1 = np.concatenate((A(i), B(i)), 1)
-        C2 = np.concatenate((B(i), A(i)), 1)
-        H = np.concatenate((C1, C2), 0)
-        return H
+    # Weight for divergence colorscale
+    w = np.tanh(10 * (wz - wxy))
 
     # Placeholders energy, spectra
     en_tb = np.linspace(-.65, .3, 500)
     int_tb = np.zeros((len(en_tb), len(x)))
 
-    # Diagonalization of symmetric Hermitian matrix on k-mesh
-    for i in range(len(x)):
-        val, vec = la.eigh(H(i))
-        val = np.real(val)
-        Ayz[i] = val[0]
-        Axz[i] = val[1]
-        Axy[i] = val[2]
-        Byz[i] = val[3]
-        Bxz[i] = val[4]
-        Bxy[i] = val[5]
-        en_vals = (Ayz[i], Axz[i], Axy[i], Byz[i], Bxz[i], Bxy[i])
-
-        # Project on orbitals
-        n = 0
-        for en_val in en_vals:
-
-            # orbital weights
-            wAyz[i, n] = np.real(np.sum(np.conj(vec[:, n]) *
-                                        (PAyz * vec[:, n])))
-            wAxz[i, n] = np.real(np.sum(np.conj(vec[:, n]) *
-                                        (PAxz * vec[:, n])))
-            wAxy[i, n] = np.real(np.sum(np.conj(vec[:, n]) *
-                                        (PAxy * vec[:, n])))
-            wByz[i, n] = np.real(np.sum(np.conj(vec[:, n]) *
-                                        (PByz * vec[:, n])))
-            wBxz[i, n] = np.real(np.sum(np.conj(vec[:, n]) *
-                                        (PBxz * vec[:, n])))
-            wBxy[i, n] = np.real(np.sum(np.conj(vec[:, n]) *
-                                        (PBxy * vec[:, n])))
-
-            # Total out-of-plane weight
-            wz = wAyz[i, n] + wAxz[i, n] + wByz[i, n] + wBxz[i, n]
-
-            # Total in-plane weight
-            wxy = wAxy[i, n] + wBxy[i, n]
-
-            # Weight for divergence colorscale
-            w = np.tanh(10 * (wz - wxy))
-
-            # Build band structure
-            en_tb_val, en_tb_idx = find(en_tb, en_val)
-            int_tb[en_tb_idx, i] = w
-            n += 1
+    # Build band structure
+    en_tb_idx = Axis(en_tb).index(val)
+    k_idx = np.broadcast_to(np.arange(len(x))[:, None], en_tb_idx.shape)
+    int_tb[en_tb_idx.ravel(), k_idx.ravel()] = w.ravel()
 
     bndstr = (Ayz, Axz, Axy, Byz, Bxz, Bxy)
 
@@ -1373,69 +1977,67 @@ def cost(Kx, Ky, En, t1, t2, t3, t4, t5, t6, mu, so):
     :J:     cost
     """
 
-    # prepare parallelization
-    num_cores = multiprocessing.cpu_count()
-    inputs = range(len(Kx))
-
-    def J_eval(k):
-        J = 0
-        # extract k's
-        kx = Kx[k]
-        ky = Ky[k]
-        en = En[k]
-        a = np.pi
-
-        # hopping terms
-        fx = -2 * np.cos((kx + ky) / 2 * a)
-        fy = -2 * np.cos((kx - ky) / 2 * a)
-        f4 = -2 * t4 * (np.cos(kx * a) + np.cos(ky * a))
-        f5 = -2 * t5 * (np.cos((kx + ky) * a) + np.cos((kx - ky) * a))
-        f6 = -2 * t6 * (np.cos(kx * a) - np.cos(ky * a))
-
-        # TB submatrix
-        def A(i):
-            A = np.array([[-mu, complex(0, so) + f6[i], -so],
-                          [-complex(0, so) + f6[i], -mu, complex(0, so)],
-                          [-so, -complex(0, so), -mu + f4[i] + f5[i]]])
-            return A
-
-        # TB submatrix
-        def B(i):
-            B = np.array([[t2 * fx[i] + t1 * fy[i], 0, 0],
-                          [0, t1 * fx[i] + t2 * fy[i], 0],
-                          [0, 0, t3 * (fx[i] + fy[i])]])
-            return B
+    param = dict([('t1', t1), ('t2', t2), ('t3', t3), ('t4', t4),
+                  ('t5', t5), ('t6', t6), ('mu', mu), ('so', so)])
 
-        # Tight binding Hamiltonian
-        def H(i):
-            C1 = np.concatenate((A(i), B(i)), 1)
-            C2 = np.concatenate((B(i), A(i)), 1)
-            H = np.concatenate((C1, C2), 0)
-            return H
+    # all sheets in one stack
+    kx = np.concatenate(Kx)
+    ky = np.concatenate(Ky)
+    en = np.concatenate(En)
+
+    # calculate eigenvalues and cost J
+    val = eig_H(CSRO_H(kx, ky, param, a=np.pi))
+    J = np.sum(np.min(np.abs(en[:, None] - val), axis=1))
 
-        # calculate eigenvalues and cost J
-        for j in range(len(kx)):
-            val = la.eigvalsh(H(j))
-            val = np.real(val)
+    return J
 
-            j = min(abs(en[j] - val))
 
-            # regularization
-#            if any(x == k for x in np.arange(0, 16, 1)):
-#                j *= 2.4  # 1: no reg.
-#            if any(x == k for x in np.arange(7, 14, 1)):
-#                j *= 1.1  # 1: no reg.
-            J += j
+def cost_grad(Kx, Ky, En, P):
+    """returns J, DJ
 
-        return J
+    **Calculates the cost of the model and its analytic gradient**
 
-    # parallel computation
-    J = np.sum(
-            np.array(
-                    Parallel(n_jobs=num_cores)
-                    (delayed(J_eval)(i) for i in inputs)))
+    The gradient follows from the Hellmann-Feynman theorem,
+    dE_n/dp = <n|dH/dp|n>, so one diagonalization per k-point gives the
+    derivatives with respect to all parameters.
 
-    return J
+    Args
+    ----
+    :Kx:    kx of all sheets
+    :Ky:    ky of all sheets
+    :En:    band energy
+    :P:     P[0]..P[7] correspond to t1..so
+
+    Return
+    ------
+    :J:     cost
+    :DJ:    gradient of cost w.r.t. parameters
+    """
+
+    # all sheets in one stack
+    kx = np.concatenate(Kx)
+    ky = np.concatenate(Ky)
+    en = np.concatenate(En)
+    idx = np.arange(kx.size)
+
+    param = dict([('t1', P[0]), ('t2', P[1]), ('t3', P[2]), ('t4', P[3]),
+                  ('t5', P[4]), ('t6', P[5]), ('mu', P[6]), ('so', P[7])])
+
+    # eigenvalues and eigenvectors of all k-points
+    val, vec = eig_H(CSRO_H(kx, ky, param, a=np.pi), vec=True)
+
+    # band closest to the data at every k-point
+    dist = en[:, None] - val
+    n = np.argmin(np.abs(dist), axis=1)
+    dist = dist[idx, n]
+    J = np.sum(np.abs(dist))
+
+    # Hellmann-Feynman: dE/dp = <n|dH/dp|n>
+    v = vec[idx, :, n]
+    dE = np.real(np.einsum('ki,pkij,kj->pk', np.conj(v), CSRO_dH(kx, ky), v))
+    DJ = - np.sum(np.sign(dist) * dE, axis=1)
+
+    return J, DJ
 
 
 def d_cost(Kx, Ky, En, P, d):
@@ -1514,7 +2116,148 @@ def cost_deriv(Kx, Ky, En, P):
     return DJ
 
 
-def optimize_TB(Kx, Ky, En, it_max, P):
+def _cost_task(kx, ky, en, P, analytic):
+    """returns J, DJ, t
+
+    **Single worker task of TB_cost: cost (and gradient) of one k-chunk**
+    """
+
+    t = time.time()
+    if analytic:
+        J, DJ = cost_grad((kx,), (ky,), (en,), P)
+    else:
+        J = cost((kx,), (ky,), (en,), *P)
+        DJ = None
+
+    return J, DJ, time.time() - t
+
+
+class TB_cost:
+    """
+    %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+             TB cost evaluator
+    %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+    **Evaluates cost and gradient for optimize_TB on one persistent
+    worker pool. The k-points of all sheets are split into chunks and every
+    evaluation is scheduled as (k-chunk x parameter perturbation) tasks.**
+    """
+    def __init__(self, Kx, Ky, En, n_jobs=None, n_chunks=None,
+                 analytic=True, eps=1e-9, pool='thread'):
+        """returns self.chunks, self.pool, self.t_wall, self.util
+
+        **Initializing cost evaluator**
+
+        Args
+        ----
+        :Kx:        kx of all sheets
+        :Ky:        ky of all sheets
+        :En:        band energy
+        :n_jobs:    number of workers (default: number of cores)
+        :n_chunks:  number of k-chunks (default: n_jobs)
+        :analytic:  'True': Hellmann-Feynman gradient,
+                    'False': central differences with step eps
+        :eps:       step of central differences
+        :pool:      'thread' or 'process'
+
+        Return
+        ------
+        :self.chunks:   list of (kx, ky, en) chunks
+        :self.pool:     worker pool
+        :self.t_wall:   wall time of every evaluation
+        :self.util:     pool utilisation of every evaluation: 0..1
+        """
+
+        if n_jobs is None:
+            n_jobs = multiprocessing.cpu_count()
+        if n_chunks is None:
+            n_chunks = n_jobs
+
+        # split all sheets into k-chunks
+        kx = np.concatenate(Kx)
+        ky = np.concatenate(Ky)
+        en = np.concatenate(En)
+        n_chunks = max(1, min(n_chunks, kx.size))
+        self.chunks = list(zip(np.array_split(kx, n_chunks),
+                               np.array_split(ky, n_chunks),
+                               np.array_split(en, n_chunks)))
+
+        if pool == 'thread':
+            self.pool = ThreadPoolExecutor(max_workers=n_jobs)
+        elif pool == 'process':
+            self.pool = ProcessPoolExecutor(max_workers=n_jobs)
+        else:
+            raise ValueError("pool must be 'thread' or 'process'")
+
+        self.n_jobs = n_jobs
+        self.analytic = analytic
+        self.eps = eps
+        self.t_wall = []
+        self.util = []
+
+    def __call__(self, P):
+        """returns J, DJ
+
+        **Evaluates cost and gradient at parameters P**
+
+        Args
+        ----
+        :P:     P[0]..P[7] correspond to t1..so
+
+        Return
+        ------
+        :J:     cost
+        :DJ:    gradient of cost w.r.t. parameters
+        """
+
+        start_time = time.time()
+        P = np.asarray(P, dtype=float)
+
+        if self.analytic:
+            futures = [self.pool.submit(_cost_task, kx, ky, en, P, True)
+                       for kx, ky, en in self.chunks]
+            results = [f.result() for f in futures]
+            J = np.sum([r[0] for r in results])
+            DJ = np.sum([r[1] for r in results], axis=0)
+        else:
+            # perturbations: P, then P +/- eps for every parameter
+            P_q = [P]
+            for d in range(P.size):
+                P_p = np.copy(P)
+                P_n = np.copy(P)
+                P_p[d] += self.eps
+                P_n[d] -= self.eps
+                P_q += [P_p, P_n]
+            futures = [[self.pool.submit(_cost_task, kx, ky, en, p, False)
+                        for p in P_q] for kx, ky, en in self.chunks]
+            results = [[f.result() for f in chunk] for chunk in futures]
+            J_q = np.sum([[r[0] for r in chunk] for chunk in results], axis=0)
+            J = J_q[0]
+            DJ = (J_q[1::2] - J_q[2::2]) / (2 * self.eps)
+            results = [r for chunk in results for r in chunk]
+
+        # wall time and fraction of the pool kept busy
+        t_wall = time.time() - start_time
+        t_busy = np.sum([r[2] for r in results])
+        self.t_wall.append(t_wall)
+        self.util.append(min(1., t_busy / (t_wall * self.n_jobs)))
+
+        return J, DJ
+
+    def close(self):
+        """Shuts down the worker pool"""
+
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def optimize_TB(Kx, Ky, En, it_max, P, analytic=True, n_jobs=None,
+                pool='thread'):
     """returns it, J, param
 
     **Optimizes the model and returns the cost and parameters**
@@ -1526,6 +2269,10 @@ def optimize_TB(Kx, Ky, En, it_max, P):
     :En:        band energy
     :it_max:    maximum of iterations
     :P:         TB initial parameters
+    :analytic:  'True': Hellmann-Feynman gradient (cost_grad),
+                'False': finite differences
+    :n_jobs:    number of workers of the pool (default: number of cores)
+    :pool:      'thread' or 'process' worker pool (see TB_cost)
 
     Return
     ------
@@ -1546,12 +2293,18 @@ def optimize_TB(Kx, Ky, En, it_max, P):
     # start optimizing
     start_time = time.time()
 
+    # one worker pool for all iterations
+    evaluator = TB_cost(Kx, Ky, En, n_jobs=n_jobs, analytic=analytic,
+                        pool=pool)
+
     try:
         while True:
             for i in range(it_max):
-                J = np.append(J, cost(Kx, Ky, En, *P))  # cost
+                J_i, DJ = evaluator(P)  # cost, gradient
+                if DJ[-1] > 0:
+                    DJ[-1] = 0
+                J = np.append(J, J_i)
                 it = np.append(it, i)
-                DJ = cost_deriv(Kx, Ky, En, P)  # gradient
                 lr = alpha * np.sqrt((1 - beta2) / (1 - beta1))  # rate
 
                 # update parameters
@@ -1568,6 +2321,9 @@ def optimize_TB(Kx, Ky, En, it_max, P):
                 if np.mod(i, 100) == 0:
                     print('iteration nr. ' + str(i))
                     print("--- %s seconds ---" % (time.time() - start_time))
+                    print("--- %s seconds per iteration, pool utilisation "
+                          "%s ---" % (evaluator.t_wall[-1],
+                                      evaluator.util[-1]))
                     print("SO = " + str(P[-1]))
                     print("J = " + str(J[-1]))
                 if np.mod(i, 1000) == 0:
@@ -1577,6 +2333,9 @@ def optimize_TB(Kx, Ky, En, it_max, P):
 
     except (KeyboardInterrupt, ValueError):
         pass
+    finally:
+        evaluator.close()
+
     # build up dictionary
     param = dict([('t1', P[0]), ('t2', P[1]), ('t3', P[2]), ('t4', P[3]),
                   ('t5', P[4]), ('t6', P[5]), ('mu', P[6]), ('so', P[7])])
@@ -1661,6 +2420,156 @@ def ang2k(angdg, Ekin, lat_unit=False, a=5.33, b=5.33, c=11,
           '\n', '==========================================')
 
 
+def rot_mat(thdg=0, tidg=0, phidg=0):
+    """returns R
+
+    **Rotation matrices Phi * Ti * Th of the manipulator for any number of
+    angles at once**
+
+    Args
+    ----
+    :thdg:      manipulator angle theta in degrees (scalar or array)
+    :tidg:      manipulator angle tilt in degrees (scalar or array)
+    :phidg:     manipulator angle phi in degrees (scalar or array)
+
+    Return
+    ------
+    :R:         rotation matrices, shape (..., 3, 3)
+    """
+
+    th, ti, phi = np.broadcast_arrays(np.deg2rad(thdg), np.deg2rad(tidg),
+                                      np.deg2rad(phidg))
+    zero = np.zeros(th.shape)
+    one = np.ones(th.shape)
+
+    Ti = np.stack([
+            np.stack([one, zero, zero], axis=-1),
+            np.stack([zero, np.cos(ti), np.sin(ti)], axis=-1),
+            np.stack([zero, -np.sin(ti), np.cos(ti)], axis=-1)
+            ], axis=-2)
+    Phi = np.stack([
+            np.stack([np.cos(phi), -np.sin(phi), zero], axis=-1),
+            np.stack([np.sin(phi), np.cos(phi), zero], axis=-1),
+            np.stack([zero, zero, one], axis=-1)
+            ], axis=-2)
+    Th = np.stack([
+            np.stack([np.cos(th), zero, -np.sin(th)], axis=-1),
+            np.stack([zero, one, zero], axis=-1),
+            np.stack([np.sin(th), zero, np.cos(th)], axis=-1)
+            ], axis=-2)
+    R = np.einsum('...ij,...jk,...kl->...il', Phi, Ti, Th)
+
+    return R
+
+
+def ang2kFS(angdg, Ekin, lat_unit=False, a=5.33, b=5.33, c=11,
+            V0=0, thdg=0, tidg=0, phidg=0):
+    """returns kx, ky, kx_V0, ky_V0
+
+    **Converts detector angles into k-space for all manipulator angles
+    (and kinetic energies) at once**
+
+    Same conversion as ang2k. The rotation matrices of all manipulator
+    angles are built at once and applied with a single einsum.
+
+    Args
+    ----
+    :angdg:     detector angles in degrees, (ang)
+    :Ekin:      photon kinetic energy, scalar or (en)
+    :lat_unit:  lattice units used (Boolean)
+    :a, b, c:   lattice parameters
+    :V0:        inner potential
+    :thdg:      manipulator angle theta in degrees, scalar or (pol)
+    :tidg:      manipulator angle tilt in degrees, scalar or (pol)
+    :phidg:     manipulator angle phi in degrees, scalar or (pol)
+
+    Return
+    ------
+    :kx:        reciprocal space vector in x, (pol, ang) or (pol, ang, en)
+    :ky:        reciprocal space vector in y
+    :kx_V0:     reciprocal space vector in x (with inner potential)
+    :ky_V0:     reciprocal space vector in y (with inner potential)
+    """
+
+    hbar = 6.58212e-16  # eV * s
+    me = 5.68563e-32  # eV * s^2 / Angstrom^2
+    ang = np.pi * np.asarray(angdg, dtype=float) / 180
+    Ekin = np.asarray(Ekin, dtype=float)
+
+    # rotation matrices (pol, 3, 3)
+    R = rot_mat(thdg, tidg, phidg).reshape(-1, 3, 3)
+
+    # Norm of k-vector, (1) or (en)
+    k_norm = np.ravel(np.sqrt(2 * me * Ekin) / hbar)
+    k_norm_V0 = np.ravel(np.sqrt(2 * me * (Ekin + V0)) / hbar)
+
+    # Build k-vectors, (3, ang, en)
+    sin = np.sin(ang)[:, None]
+    cos = np.cos(ang)[:, None]
+    zero = np.zeros((ang.size, k_norm.size))
+    kv = np.stack([k_norm * sin, zero, k_norm * cos])
+    kv_V0 = np.stack([k_norm * sin, zero,
+                      np.sqrt(k_norm_V0**2 - (k_norm * sin**2))])
+
+    # only the in-plane components are needed, (2, pol, ang, en)
+    k = np.einsum('pij,jae->ipae', R[:, :2], kv)
+    k_V0 = np.einsum('pij,jae->ipae', R[:, :2], kv_V0)
+
+    if lat_unit:  # lattice units
+        k *= np.array([a / np.pi, b / np.pi])[:, None, None, None]
+        k_V0 *= np.array([a / np.pi, b / np.pi])[:, None, None, None]
+
+    if Ekin.ndim == 0:
+        k = k[..., 0]
+        k_V0 = k_V0[..., 0]
+
+    return k[0], k[1], k_V0[0], k_V0[1]
+
+
+def regrid_matrix(kx, ky, kx_grid, ky_grid):
+    """returns M, mask
+
+    **Sparse linear interpolation matrix from a curvilinear (pol, ang) grid
+    onto a regular (ky, kx) grid**
+
+    The source points are triangulated once, every target point gets the
+    barycentric weights of its triangle (3 entries per row). Applying M to
+    any number of maps is one sparse matrix product.
+
+    Args
+    ----
+    :kx:        source kx, (pol, ang)
+    :ky:        source ky, (pol, ang)
+    :kx_grid:   regular kx axis, (nx)
+    :ky_grid:   regular ky axis, (ny)
+
+    Return
+    ------
+    :M:         CSR matrix, (ny * nx, pol * ang)
+    :mask:      'True' where the target point lies inside the data, (ny, nx)
+    """
+
+    src = np.column_stack((np.ravel(kx), np.ravel(ky)))
+    KX, KY = np.meshgrid(kx_grid, ky_grid)
+    dst = np.column_stack((KX.ravel(), KY.ravel()))
+
+    tri = Delaunay(src)
+    simplex = tri.find_simplex(dst)
+    inside = simplex >= 0
+
+    # barycentric coordinates of the targets inside the triangulation
+    T = tri.transform[simplex[inside]]
+    b = np.einsum('nij,nj->ni', T[:, :2], dst[inside] - T[:, 2])
+    w = np.column_stack((b, 1 - np.sum(b, axis=1)))
+
+    rows = np.repeat(np.flatnonzero(inside), 3)
+    cols = tri.simplices[simplex[inside]].ravel()
+    M = sparse.csr_matrix((w.ravel(), (rows, cols)),
+                          shape=(dst.shape[0], src.shape[0]))
+
+    return M, inside.reshape(KX.shape)
+
+
 def det_angle(k_i, angdg, thdg, tidg, phidg):
     """returns k
 
@@ -1707,60 +2616,91 @@ def det_angle(k_i, angdg, thdg, tidg, phidg):
     return k
 
 
-def partial_deriv_2D(x, y, f):
+def partial_deriv(x, f, axis=0):
+    """returns fx
+
+    **First derivative of n-dimensional data along one axis**
+
+    Forward differences on the (possibly non-uniform) axis x, the last point
+    takes the backward difference.
+
+    Args
+    ----
+    :x:     axis values along axis
+    :f:     data (n-dim)
+    :axis:  axis of f corresponding to x
+
+    Return
+    ------
+    :fx:    derivative, same shape as f
+    """
+
+    f = np.asarray(f, dtype=float)
+    axis = axis % f.ndim
+
+    # spacing broadcasted along axis
+    shape = [1] * f.ndim
+    shape[axis] = -1
+    dx = np.reshape(np.diff(x), shape)
+
+    fx = np.empty_like(f)
+    d = np.diff(f, axis=axis) / dx
+    fx[(slice(None),) * axis + (slice(0, -1),)] = d
+    fx[(slice(None),) * axis + (slice(-1, None),)] = \
+        d[(slice(None),) * axis + (slice(-1, None),)]
+
+    return fx
+
+
+def partial_deriv_2D(x, y, f, derivs=('fx', 'fxx', 'fxy', 'fy', 'fyy', 'fyx'),
+                     axes=(0, 1)):
     """returns F
 
     **Derivatives of 2-dimensional data**
 
+    Only the derivatives listed in derivs are computed. f may have more
+    than two dimensions (e.g. a 3D map), axes selects the dimensions
+    belonging to x and y.
+
     Args
     ----
-    :x:     x-axis
-    :y:     y-axis
-    :f:     data (2-dim)
+    :x:         x-axis
+    :y:         y-axis
+    :f:         data (2-dim or more)
+    :derivs:    derivatives to compute: 'fx', 'fxx', 'fxy', 'fy', 'fyy', 'fyx'
+    :axes:      axes of f corresponding to x and y
 
     Return
     ------
     :F:     Dictionary of derivatives
     """
 
-    # Placeholders
-    fx = np.empty_like(f)
-    fxx = np.empty_like(f)
-    fxy = np.empty_like(f)
-    fy = np.empty_like(f)
-    fyy = np.empty_like(f)
-    fyx = np.empty_like(f)
-
-    # calculate derivatives
-    for i in range(len(y)):
-        fx[0:-1, i] = np.diff(f[:, i]) / np.diff(x)
-        fx[-1, i] = (f[-1, i] - f[-2, i]) / (x[-1] - x[-2])
-    for i in range(len(y)):
-        fxx[0:-1, i] = np.diff(fx[:, i]) / np.diff(x)
-        fxx[-1, i] = (fx[-1, i] - fx[-2, i]) / (x[-1] - x[-2])
-    for i in range(len(x)):
-        fy[i, 0:-1] = np.diff(f[i, :]) / np.diff(y)
-        fy[i, -1] = (f[i, -1] - f[i, -2]) / (y[-1] - y[-2])
-    for i in range(len(x)):
-        fyy[i, 0:-1] = np.diff(fy[i, :]) / np.diff(y)
-        fyy[i, -1] = (fy[i, -1] - fy[i, -2]) / (y[-1] - y[-2])
-    for i in range(len(y)):
-        fyx[0:-1, i] = np.diff(fy[:, i]) / np.diff(x)
-        fyx[-1, i] = (fy[-1, i] - fy[-2, i]) / (x[-1] - x[-2])
-    for i in range(len(x)):
-        fxy[i, 0:-1] = np.diff(fx[i, :]) / np.diff(y)
-        fxy[i, -1] = (fx[i, -1] - fx[i, -2]) / (y[-1] - y[-2])
-    for i in range(len(y)):
-        fyx[:, i] = np.gradient(fy[:, i])
+    ax_x, ax_y = axes
+    F = {}
+
+    # first derivatives, only if needed
+    if any(d in derivs for d in ('fx', 'fxx', 'fxy')):
+        F['fx'] = partial_deriv(x, f, axis=ax_x)
+    if any(d in derivs for d in ('fy', 'fyy', 'fyx')):
+        F['fy'] = partial_deriv(y, f, axis=ax_y)
+
+    # second derivatives
+    if 'fxx' in derivs:
+        F['fxx'] = partial_deriv(x, F['fx'], axis=ax_x)
+    if 'fxy' in derivs:
+        F['fxy'] = partial_deriv(y, F['fx'], axis=ax_y)
+    if 'fyy' in derivs:
+        F['fyy'] = partial_deriv(y, F['fy'], axis=ax_y)
+    if 'fyx' in derivs:
+        F['fyx'] = partial_deriv(x, F['fy'], axis=ax_x)
 
     # build up dictionary
-    F = {'fx': fx, 'fxx': fxx, 'fxy': fxy,
-         'fy': fy, 'fyy': fyy, 'fyx': fyx}
+    F = dict([(d, F[d]) for d in derivs])
 
     return F
 
 
-def curvature_MDC(x, y, f, C0):
+def curvature_MDC(x, y, f, C0, axes=(0, 1)):
     """returns C
 
     **Curvature 1dim**
@@ -1770,6 +2710,7 @@ def curvature_MDC(x, y, f, C0):
     :x:     x-axis
     :f:     data (1-dim)
     :C0:    curvature parameter
+    :axes:  axes of f corresponding to x and y
 
     Return
     ------
@@ -1777,7 +2718,7 @@ def curvature_MDC(x, y, f, C0):
     """
 
     # derivatives
-    F = partial_deriv_2D(x, y, f)
+    F = partial_deriv_2D(x, y, f, derivs=('fx', 'fxx'), axes=axes)
 
     # unpack partial derivatives
     fx = F['fx']
@@ -1788,7 +2729,7 @@ def curvature_MDC(x, y, f, C0):
     return C
 
 
-def curvature_EDC(x, y, f, C0):
+def curvature_EDC(x, y, f, C0, axes=(0, 1)):
     """returns C
 
     **Curvature 1dim**
@@ -1798,6 +2739,7 @@ def curvature_EDC(x, y, f, C0):
     :x:     x-axis
     :f:     data (1-dim)
     :C0:    curvature parameter
+    :axes:  axes of f corresponding to x and y
 
     Return
     ------
@@ -1805,7 +2747,7 @@ def curvature_EDC(x, y, f, C0):
     """
 
     # derivatives
-    F = partial_deriv_2D(x, y, f)
+    F = partial_deriv_2D(x, y, f, derivs=('fy', 'fyy'), axes=axes)
 
     # unpack partial derivatives
     fy = F['fy']
@@ -1816,7 +2758,7 @@ def curvature_EDC(x, y, f, C0):
     return C
 
 
-def curvature_equiv(x, y, f, C0):
+def curvature_equiv(x, y, f, C0, axes=(0, 1)):
     """returns C
 
     **Curvature with two equivalent axes**
@@ -1827,6 +2769,7 @@ def curvature_equiv(x, y, f, C0):
     :y:     y-axis
     :f:     data (2-dim)
     :C0:    curvature parameter
+    :axes:  axes of f corresponding to x and y
 
     Return
     ------
@@ -1834,7 +2777,8 @@ def curvature_equiv(x, y, f, C0):
     """
 
     # derivatives
-    F = partial_deriv_2D(x, y, f)
+    F = partial_deriv_2D(x, y, f, derivs=('fx', 'fxx', 'fxy', 'fy', 'fyy'),
+                         axes=axes)
 
     # unpack partial derivaatives
     fx = F['fx']
@@ -1842,7 +2786,6 @@ def curvature_equiv(x, y, f, C0):
     fxy = F['fxy']
     fy = F['fy']
     fyy = F['fyy']
-#    fyx = F['fyx']  # not needed
 
     # nominator terms
     nom_1 = (C0 + fx ** 2) * fyy
@@ -1857,7 +2800,7 @@ def curvature_equiv(x, y, f, C0):
     return C
 
 
-def curvature_inequiv(x, y, f, Cx, Cy):
+def curvature_inequiv(x, y, f, Cx, Cy, axes=(0, 1)):
     """returns C
 
     **Curvature with two inequivalent axes**
@@ -1869,6 +2812,7 @@ def curvature_inequiv(x, y, f, Cx, Cy):
     :f:     data (2-dim)
     :Cx:    curvature parameter for x-direction
     :Cy:    curvature parameter for y-direction
+    :axes:  axes of f corresponding to x and y
 
     Return
     ------
@@ -1876,7 +2820,8 @@ def curvature_inequiv(x, y, f, Cx, Cy):
     """
 
     # derivatives
-    F = partial_deriv_2D(x, y, f)
+    F = partial_deriv_2D(x, y, f, derivs=('fx', 'fxx', 'fxy', 'fy', 'fyy'),
+                         axes=axes)
 
     # unpack partial derivaatives
     fx = F['fx']
@@ -1884,7 +2829,6 @@ def curvature_inequiv(x, y, f, Cx, Cy):
     fxy = F['fxy']
     fy = F['fy']
     fyy = F['fyy']
-#    fyx = F['fyx']  # not needed
 
     # nominator terms
     nom_1 = (1 + Cx * fx ** 2) * Cy * fyy
@@ -1950,12 +2894,87 @@ def FDsl(x, *p):
 
     Return
     ------
-    :FDsl:  Fermi Dirac function on a sloped background
+    :FDsl:  Fermi Dirac function on a sloped background
+    """
+
+    FDsl = p[3] + (p[2] + p[4] * x) * (np.exp((x - p[1]) / p[0]) + 1) ** -1
+
+    return FDsl
+
+
+def FDsl_jac(x, *p):
+    """returns jac
+
+    **Analytic Jacobian of FDsl with respect to its parameters**
+
+    Args
+    ----
+    :x:     energy axis
+    :p:     parameters of FDsl
+
+    Return
+    ------
+    :jac:   d FDsl / d p, shape (x.size, 5)
+    """
+
+    x = np.ravel(np.asarray(x, dtype=float))
+    u = (x - p[1]) / p[0]
+    F = special.expit(-u)
+    dF = F * special.expit(u)  # -dF/du
+    jac = np.empty((x.size, 5))
+    jac[:, 0] = (p[2] + p[4] * x) * dF * u / p[0]
+    jac[:, 1] = (p[2] + p[4] * x) * dF / p[0]
+    jac[:, 2] = F
+    jac[:, 3] = 1
+    jac[:, 4] = x * F
+
+    return jac
+
+
+def FD(x, *p):
+    """returns FD
+
+    **Fermi Dirac function, e.g. as a cutoff of a composed Model**
+
+    Args
+    ----
+    :x:     energy axis
+    :p0:    kB * T
+    :p1:    EF
+
+    Return
+    ------
+    :FD:    Fermi Dirac function
+    """
+
+    FD = special.expit(-(np.asarray(x, dtype=float) - p[1]) / p[0])
+
+    return FD
+
+
+def FD_jac(x, *p):
+    """returns jac
+
+    **Analytic Jacobian of FD with respect to its parameters**
+
+    Args
+    ----
+    :x:     energy axis
+    :p:     parameters of FD
+
+    Return
+    ------
+    :jac:   d FD / d p, shape (x.size, 2)
     """
 
-    FDsl = p[3] + (p[2] + p[4] * x) * (np.exp((x - p[1]) / p[0]) + 1) ** -1
+    x = np.ravel(np.asarray(x, dtype=float))
+    u = (x - p[1]) / p[0]
+    dF = special.expit(-u) * special.expit(u)
+    jac = np.empty((x.size, 2))
+    jac[:, 0] = dF * u / p[0]
+    jac[:, 1] = dF / p[0]
 
-    return FDsl
+    return jac
 
 
 def FDconvGauss(x, *p):
@@ -1963,13 +2982,18 @@ def FDconvGauss(x, *p):
 
     **Fermi Dirac function convoluted with a Gaussian**
 
+    The broadened Fermi edge is evaluated directly at x: its shape only
+    depends on (kB * T, width) and is cached (_FDG_edge). Passing 1D arrays
+    (channel) as parameters evaluates many channels at once, x is then
+    (en) or (channel, en).
+
     Args
     ----
     :x:     energy axis
-    :p0:    T
+    :p0:    kB * T
     :p1:    EF
     :p2:    Amplitude subfunctions
-    :p3:    Width
+    :p3:    Width (FWHM)
     :p4:    Constant background
     :p5:    Amplitude overall
     :p6:    Slope
@@ -1979,26 +3003,78 @@ def FDconvGauss(x, *p):
     :FDG:   Fermi Dirac function convoluted with a Gaussian
     """
 
-    xx = np.linspace(-0.2, 0.2, 1000)
+    x = np.asarray(x, dtype=float)
+    kT, EF, A, width, const, A0, slope = np.broadcast_arrays(
+            *[np.asarray(p_i, dtype=float) for p_i in p[:7]])
+    sig = np.abs(width) / (2 * np.sqrt(2 * np.log(2)))
+
+    # edge on the grid (-L, L) interpolated at x, FD outside (-W, W)
+    if kT.ndim == 0:
+        X = x - EF
+        W, L, S = _FDG_edge(abs(float(kT)), float(sig))
+        W, L, S = W[0, 0], L[0, 0], S[0]
+        edge = np.interp(X, np.linspace(-L, L, S.size), S)
+    else:
+        W, L, S = _FDG_edge_n(np.abs(kT), sig)
+        kT, EF, A, const, A0, slope = (a[:, None] for a in
+                                       (kT, EF, A, const, A0, slope))
+        X = x - EF
+        n = S.shape[-1]
+        g = (X + L) / (2 * L) * (n - 1)
+        i0 = np.clip(np.floor(g).astype(int), 0, n - 2)
+        t = np.clip(g - i0, 0, 1)
+        edge = (np.take_along_axis(S, i0, -1) * (1 - t) +
+                np.take_along_axis(S, i0 + 1, -1) * t)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        edge = np.where(np.abs(X) > W, special.expit(-X / np.abs(kT)), edge)
+
+    FDG = const + (A0 + slope * x) * A * edge
+
+    return FDG
+
 
-    sig = p[3]/(2*np.sqrt(2*np.log(2)))
+def _FDG_edge_n(kT, sig, n=4096):
+    """returns W, L, S
 
-    FD = FDsl(xx, p[0], p[1], p[2], 0, 0)
-    G = gauss(xx, p[1], sig, 1/(np.sqrt(2*np.pi)*sig), 0, 0, 0)
+    **Fermi edge at EF=0 with kB * T = kT convoluted with a normalized
+    Gaussian of width sig, sampled on linspace(-L, L, n) for every channel.
+    Outside (-W, W) it equals the Fermi Dirac function.**
 
-    dx = abs(xx[1] - xx[0])
-    Ix = abs(xx[-1] - xx[0])
-    N = Ix / dx
+    Both functions are integrated exactly over every grid cell, so the
+    result stays accurate if one of them is much sharper than the other.
+    The smoothing of the cell averages (h^2 / 12 * S'') is corrected.
+    """
 
-    func = (p[4] + (p[5] + p[6] * xx) *
-            signal.convolve(G, FD, mode='same') / (2 * N))
-    FDG = np.zeros(len(x))
+    kT = np.atleast_1d(np.asarray(kT, dtype=float))[:, None]
+    sig = np.atleast_1d(np.asarray(sig, dtype=float))[:, None]
+    W = np.maximum(8 * sig + 20 * kT, 1e-9)
+    L = W + 8 * sig
+    h = 2 * L / (n - 1)
+    xx = np.linspace(-1, 1, n) * L
+    m = int(np.clip(np.ceil(np.max(8 * sig / h)), 0, n // 2))
+    k = np.arange(-m, m + 1) * h
 
-    for i in range(len(x)):
-        en_val, en_idx = find(xx, x[i])
-        FDG[i] = func[en_idx]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # cell averages of FD: kT * log(1 + exp(-x / kT)) is its antiderivative
+        a, b = xx - h / 2, xx + h / 2
+        FD = np.where(kT > 0, kT * (np.logaddexp(0, -a / kT) -
+                                    np.logaddexp(0, -b / kT)),
+                      np.maximum(-a, 0) - np.maximum(-b, 0)) / h
+        # cell masses of the Gaussian kernel
+        G = .5 * (special.erf((k + h / 2) / (np.sqrt(2) * sig)) -
+                  special.erf((k - h / 2) / (np.sqrt(2) * sig)))
+    G = np.where(sig > 0, G, k == 0)
 
-    return FDG
+    S = signal.fftconvolve(FD, G, mode='same', axes=-1)
+    S[:, 1:-1] -= np.diff(S, 2, axis=-1) / 12
+
+    return W, L, S
+
+
+@lru_cache(maxsize=256)
+def _FDG_edge(kT, sig, n=4096):
+    """returns W, L, S of _FDG_edge_n for a single (kT, sig), cached"""
+    return _FDG_edge_n(kT, sig, n)
 
 
 def poly_n(x, n, *p):
@@ -2017,15 +3093,34 @@ def poly_n(x, n, *p):
     :poly_n:  polynomial n-th order
     """
 
-    poly_n = 0
-
-    # Loop over orders
-    for i in range(n+1):
-        poly_n += p[i] * x ** i
+    poly_n = np.polynomial.polynomial.polyval(x, p[:n+1])
 
     return poly_n
 
 
+def poly_n_jac(x, n, *p):
+    """returns jac
+
+    **Analytic Jacobian of poly_n with respect to its coefficients**
+
+    Args
+    ----
+    :x:       x
+    :n:       order
+    :p[n]:    coefficients
+
+    Return
+    ------
+    :jac:     d poly_n / d p, shape (x.size, len(p)), zero for p[n+1:]
+    """
+
+    x = np.ravel(np.asarray(x, dtype=float))
+    jac = np.zeros((x.size, max(len(p), n + 1)))
+    jac[:, :n+1] = x[:, None] ** np.arange(n + 1)
+
+    return jac
+
+
 def power(x, *p):
     """returns power
 
@@ -2068,17 +3163,62 @@ def lor_n(x, n, *p):
     :lor_n:        n Lorentzians
     """
 
-    lor_n = 0
+    x = np.asarray(x, dtype=float)
+    p = np.asarray(p, dtype=float)
+    c, w, A = p[:n], p[n:2*n], p[2*n:3*n]
 
-    # Loop over Lorentzians
-    for i in range(n):
-        lor_n += (p[i+2*n] / (np.pi * p[i+n] *
-                  (1 + ((x - p[i]) / p[i+n]) ** 2)))
+    # all Lorentzians at once, last axis runs over the peaks
+    lor_n = np.sum(A / (np.pi * w * (1 + ((x[..., None] - c) / w) ** 2)),
+                   axis=-1)
     lor_n += p[-3] + p[-2] * x + p[-1] * x ** 2
 
     return lor_n
 
 
+def lor_n_jac(x, n, *p):
+    """returns jac
+
+    **Analytic Jacobian of lor_n with respect to its parameters**
+
+    Args
+    ----
+    :x:          momentum
+    :n:          number of Lorentzians
+    :p:          parameters of lor_n
+
+    Return
+    ------
+    :jac:        d lor_n / d p, shape (x.size, 3 * n + 3)
+    """
+
+    x = np.ravel(np.asarray(x, dtype=float))
+    p = np.asarray(p, dtype=float)
+    c, w, A = p[:n], p[n:2*n], p[2*n:3*n]
+
+    # A / pi * w / D with D = w^2 + (x - c)^2
+    dx = x[:, None] - c
+    D = w ** 2 + dx ** 2
+    jac = np.empty((x.size, 3 * n + 3))
+    jac[:, :n] = A / np.pi * 2 * w * dx / D ** 2  # center
+    jac[:, n:2*n] = A / np.pi * (dx ** 2 - w ** 2) / D ** 2  # HWHM
+    jac[:, 2*n:3*n] = w / (np.pi * D)  # amplitudes
+    jac[:, -3] = 1
+    jac[:, -2] = x
+    jac[:, -1] = x ** 2
+
+    return jac
+
+
+def _lor_n_p(x, *p):
+    """returns lor_n with n = (len(p) - 3) // 3"""
+    return lor_n(x, (len(p) - 3) // 3, *p)
+
+
+def _lor_n_p_jac(x, *p):
+    """returns lor_n_jac with n = (len(p) - 3) // 3"""
+    return lor_n_jac(x, (len(p) - 3) // 3, *p)
+
+
 def gauss_n(x, n, *p):
     """returns gauss_n
 
@@ -2101,17 +3241,51 @@ def gauss_n(x, n, *p):
     :gauss_n:      n Gaussians
     """
 
-    gauss_n = 0
-
-    # Loop over Gaussians
-    for i in range(n):
-        gauss_n += p[i+2*n] * np.exp(-(x - p[i]) ** 2 / (2 * p[i+n] ** 2))
+    x = np.asarray(x, dtype=float)
+    p = np.asarray(p, dtype=float)
+    c, w, A = p[:n], p[n:2*n], p[2*n:3*n]
 
+    # all Gaussians at once, last axis runs over the peaks
+    gauss_n = np.sum(A * np.exp(-(x[..., None] - c) ** 2 / (2 * w ** 2)),
+                     axis=-1)
     gauss_n += p[-3] + p[-2] * x + p[-1] * x ** 2
 
     return gauss_n
 
 
+def gauss_n_jac(x, n, *p):
+    """returns jac
+
+    **Analytic Jacobian of gauss_n with respect to its parameters**
+
+    Args
+    ----
+    :x:          momentum axis
+    :n:          number of Gaussians
+    :p:          parameters of gauss_n
+
+    Return
+    ------
+    :jac:        d gauss_n / d p, shape (x.size, 3 * n + 3)
+    """
+
+    x = np.ravel(np.asarray(x, dtype=float))
+    p = np.asarray(p, dtype=float)
+    c, w, A = p[:n], p[n:2*n], p[2*n:3*n]
+
+    dx = x[:, None] - c
+    E = np.exp(-dx ** 2 / (2 * w ** 2))
+    jac = np.empty((x.size, 3 * n + 3))
+    jac[:, :n] = A * E * dx / w ** 2  # center
+    jac[:, n:2*n] = A * E * dx ** 2 / w ** 3  # width
+    jac[:, 2*n:3*n] = E  # amplitudes
+    jac[:, -3] = 1
+    jac[:, -2] = x
+    jac[:, -1] = x ** 2
+
+    return jac
+
+
 def FL_spectral_func(x, *p):
     """returns FL_spectral_func
 
@@ -2142,6 +3316,42 @@ def FL_spectral_func(x, *p):
     return FL_spectral_func
 
 
+def FL_spectral_func_jac(x, *p):
+    """returns jac
+
+    **Analytic Jacobian of FL_spectral_func with respect to its parameters**
+
+    Args
+    ----
+    :x:         energy axis
+    :p:         parameters of FL_spectral_func
+
+    Return
+    ------
+    :jac:       d FL_spectral_func / d p, shape (x.size, 6)
+    """
+
+    x = np.ravel(np.asarray(x, dtype=float))
+    r = x - p[0] * x - p[3]
+    ImS = p[1] + p[2] * x ** 2
+    D = r ** 2 + ImS ** 2
+    L = ImS / (np.pi * D)
+    u = x / p[5]
+    F = special.expit(-u)
+
+    dL_dr = -2 * r * ImS / (np.pi * D ** 2)
+    dL_dImS = (r ** 2 - ImS ** 2) / (np.pi * D ** 2)
+    jac = np.empty((x.size, 6))
+    jac[:, 0] = -p[4] * F * dL_dr * x
+    jac[:, 1] = p[4] * F * dL_dImS
+    jac[:, 2] = p[4] * F * dL_dImS * x ** 2
+    jac[:, 3] = -p[4] * F * dL_dr
+    jac[:, 4] = L * F
+    jac[:, 5] = p[4] * L * F * special.expit(u) * u / p[5]
+
+    return jac
+
+
 def gauss_mod(x, *p):
     """returns gauss_mod
 
@@ -2168,6 +3378,41 @@ def gauss_mod(x, *p):
     return gauss_mod
 
 
+def gauss_mod_jac(x, *p):
+    """returns jac
+
+    **Analytic Jacobian of gauss_mod with respect to its parameters**
+
+    Args
+    ----
+    :x:         energy axis
+    :p:         parameters of gauss_mod
+
+    Return
+    ------
+    :jac:       d gauss_mod / d p, shape (x.size, 6)
+    """
+
+    x = np.ravel(np.asarray(x, dtype=float))
+    t = (p[1] - x) / p[2]
+    v = (p[4] - x) / p[5]
+    E = np.exp(-.5 * t ** 2)
+    erf = special.erf(v)
+    M = p[3] * erf + 1
+    G = p[0] * E
+    dM_dv = p[3] * 2 / np.sqrt(np.pi) * np.exp(-v ** 2)
+
+    jac = np.empty((x.size, 6))
+    jac[:, 0] = E * M
+    jac[:, 1] = -G * M * t / p[2]
+    jac[:, 2] = G * M * t ** 2 / p[2]
+    jac[:, 3] = G * erf
+    jac[:, 4] = G * dM_dv / p[5]
+    jac[:, 5] = -G * dM_dv * v / p[5]
+
+    return jac
+
+
 def Full_spectral_func(x, *p):
     """returns Full_spectral_func
 
@@ -2200,6 +3445,118 @@ def Full_spectral_func(x, *p):
     return Full_spectral_func
 
 
+def Full_spectral_func_jac(x, *p):
+    """returns jac
+
+    **Analytic Jacobian of Full_spectral_func with respect to its
+    parameters**
+
+    Args
+    ----
+    :x:         energy axis
+    :p:         parameters of Full_spectral_func
+
+    Return
+    ------
+    :jac:       d Full_spectral_func / d p, shape (x.size, 12)
+    """
+
+    jac = np.hstack((FL_spectral_func_jac(x, *p[:6]),
+                     gauss_mod_jac(x, *p[-6:])))
+
+    return jac
+
+
+class Model:
+    """
+    %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+          Composable fit model
+    %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+    **Fit model f(x, *p) with an analytic Jacobian. Models are combined
+    with + and *, e.g. peaks + background times a Fermi cutoff. The
+    parameters of a combined model are the parameters of its terms in
+    order. A Model can be passed directly to curve_fit or fit_chain:
+    curve_fit(M, x, y, p0, jac=M.jac)**
+
+    e.g. Model(lor_n, lor_n_jac, 9, n=2) * Model(FD, FD_jac, 2)
+    """
+    def __init__(self, f, jac, n_p, n=None):
+        """returns self.f, self.n_p, self.n
+
+        **Initializing model**
+
+        Args
+        ----
+        :f:     model f(x, *p), or f(x, n, *p) if n is given
+        :jac:   analytic Jacobian of f with the same signature
+        :n_p:   number of parameters
+        :n:     number of components of f (e.g. n of lor_n, optional)
+
+        Return
+        ------
+        :self.f:    model
+        :self.n_p:  number of parameters
+        :self.n:    number of components
+        """
+
+        self.f = f
+        self._jac = jac
+        self.n_p = n_p
+        self.n = n
+        self.terms = None
+        self.op = None
+
+    def _combine(self, other, op):
+        """returns model self op other"""
+        model = Model(None, None, self.n_p + other.n_p)
+        model.terms = (self, other)
+        model.op = op
+        return model
+
+    def __add__(self, other):
+        return self._combine(other, '+')
+
+    def __mul__(self, other):
+        return self._combine(other, '*')
+
+    def __call__(self, x, *p):
+        """returns f
+
+        **Evaluates model at parameters p**
+        """
+
+        if self.terms is None:
+            if self.n is None:
+                return self.f(x, *p)
+            return self.f(x, self.n, *p)
+        a, b = self.terms
+        f_a = a(x, *p[:a.n_p])
+        f_b = b(x, *p[a.n_p:])
+        if self.op == '+':
+            return f_a + f_b
+        return f_a * f_b
+
+    def jac(self, x, *p):
+        """returns jac
+
+        **Analytic Jacobian of the model, shape (x.size, n_p)**
+        """
+
+        if self.terms is None:
+            if self.n is None:
+                return self._jac(x, *p)
+            return self._jac(x, self.n, *p)
+        a, b = self.terms
+        jac_a = a.jac(x, *p[:a.n_p])
+        jac_b = b.jac(x, *p[a.n_p:])
+        if self.op == '+':
+            return np.hstack((jac_a, jac_b))
+        f_a = np.ravel(a(x, *p[:a.n_p]))
+        f_b = np.ravel(b(x, *p[a.n_p:]))
+        return np.hstack((jac_a * f_b[:, None], f_a[:, None] * jac_b))
+
+
 """
 %%%%%%%%%%%%%%%%%%%%%
   Wrapper functions
@@ -2459,6 +3816,206 @@ def gauss_2(x, *p):
     return gauss_2
 
 
+def poly_1_jac(x, *p):
+    """returns jac
+
+    **Analytic Jacobian of poly_1, wrapper function of poly_n_jac with n=1**
+
+    Args
+    ----
+    :x:          axis
+    :p:          parameters of poly_1
+
+    Return
+    ------
+    :jac:        d poly_1 / d p, shape (x.size, 2)
+    """
+
+    jac = poly_n_jac(x, 1, *p)
+
+    return jac
+
+
+def poly_2_jac(x, *p):
+    """returns jac
+
+    **Analytic Jacobian of poly_2, wrapper function of poly_n_jac with n=2**
+
+    Args
+    ----
+    :x:          axis
+    :p:          parameters of poly_2
+
+    Return
+    ------
+    :jac:        d poly_2 / d p, shape (x.size, 3)
+    """
+
+    jac = poly_n_jac(x, 2, *p)
+
+    return jac
+
+
+def lor_jac(x, *p):
+    """returns jac
+
+    **Analytic Jacobian of lor, wrapper function of lor_n_jac with n=1**
+
+    Args
+    ----
+    :x:          axis
+    :p:          parameters of lor
+
+    Return
+    ------
+    :jac:        d lor / d p, shape (x.size, 6)
+    """
+
+    jac = lor_n_jac(x, 1, *p)
+
+    return jac
+
+
+def lor_2_jac(x, *p):
+    """returns jac
+
+    **Analytic Jacobian of lor_2, wrapper function of lor_n_jac with n=2**
+
+    Args
+    ----
+    :x:          axis
+    :p:          parameters of lor_2
+
+    Return
+    ------
+    :jac:        d lor_2 / d p, shape (x.size, 9)
+    """
+
+    jac = lor_n_jac(x, 2, *p)
+
+    return jac
+
+
+def lor_4_jac(x, *p):
+    """returns jac
+
+    **Analytic Jacobian of lor_4, wrapper function of lor_n_jac with n=4**
+
+    Args
+    ----
+    :x:          axis
+    :p:          parameters of lor_4
+
+    Return
+    ------
+    :jac:        d lor_4 / d p, shape (x.size, 15)
+    """
+
+    jac = lor_n_jac(x, 4, *p)
+
+    return jac
+
+
+def lor_6_jac(x, *p):
+    """returns jac
+
+    **Analytic Jacobian of lor_6, wrapper function of lor_n_jac with n=6**
+
+    Args
+    ----
+    :x:          axis
+    :p:          parameters of lor_6
+
+    Return
+    ------
+    :jac:        d lor_6 / d p, shape (x.size, 21)
+    """
+
+    jac = lor_n_jac(x, 6, *p)
+
+    return jac
+
+
+def lor_7_jac(x, *p):
+    """returns jac
+
+    **Analytic Jacobian of lor_7, wrapper function of lor_n_jac with n=7**
+
+    Args
+    ----
+    :x:          axis
+    :p:          parameters of lor_7
+
+    Return
+    ------
+    :jac:        d lor_7 / d p, shape (x.size, 24)
+    """
+
+    jac = lor_n_jac(x, 7, *p)
+
+    return jac
+
+
+def lor_8_jac(x, *p):
+    """returns jac
+
+    **Analytic Jacobian of lor_8, wrapper function of lor_n_jac with n=8**
+
+    Args
+    ----
+    :x:          axis
+    :p:          parameters of lor_8
+
+    Return
+    ------
+    :jac:        d lor_8 / d p, shape (x.size, 27)
+    """
+
+    jac = lor_n_jac(x, 8, *p)
+
+    return jac
+
+
+def gauss_jac(x, *p):
+    """returns jac
+
+    **Analytic Jacobian of gauss, wrapper function of gauss_n_jac with n=1**
+
+    Args
+    ----
+    :x:          axis
+    :p:          parameters of gauss
+
+    Return
+    ------
+    :jac:        d gauss / d p, shape (x.size, 6)
+    """
+
+    jac = gauss_n_jac(x, 1, *p)
+
+    return jac
+
+
+def gauss_2_jac(x, *p):
+    """returns jac
+
+    **Analytic Jacobian of gauss_2, wrapper function of gauss_n_jac with n=2**
+
+    Args
+    ----
+    :x:          axis
+    :p:          parameters of gauss_2
+
+    Return
+    ------
+    :jac:        d gauss_2 / d p, shape (x.size, 9)
+    """
+
+    jac = gauss_n_jac(x, 2, *p)
+
+    return jac
+
+
 """
 %%%%%%%%%%%%%%%%%%%%%%%
   External functions
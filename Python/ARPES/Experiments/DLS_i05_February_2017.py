@@ -8,7 +8,6 @@ Created on Thu Jul 19 21:11:16 2018
 
 import os
 import ARPES
-import matplotlib.pyplot as plt
 
 os.chdir('/Users/denyssutter/Documents/library/Python/ARPES')
 path = ('/Users/denyssutter/Documents/PhD/data/Experiments/' +
@@ -43,14 +42,16 @@ gold_22 = 62455
 files = [62488, 62470, 62449, 62444]  # 72eV, the rest 22eV
 golds = [62492, gold_22, gold_22, gold_22]
 
-for i in range(len(files)):
-    D = ARPES.DLS(files[i], mat, year, sample)
-    D.norm(golds[i])
-    D.flatten()
-    D.bkg()
-    D.plt_spec(v_max=.7)
-    plt.savefig((path + str(D.file) + '_bkg_norm.png'),
-                dpi=300, bbox_inches="tight")
+specs = [dict(loader='DLS', args=(files[i], mat, year, sample),
+              gold=golds[i], steps=('flatten', 'bkg'),
+              plot=('plt_spec', {'v_max': .7}),
+              save=path + str(files[i]) + '_bkg_norm.png')
+         for i in range(len(files))]
+
+# thread pool: a process pool would re-run the cells of this script in
+# every worker on spawn platforms
+for i, spec, D in ARPES.batch(specs, pool='thread', keep=False):
+    pass
 
 # %%
 """
@@ -163,7 +163,8 @@ def fig1(print_fig=True):
 
     # fit MDC
     p_mdc, cov_mdc = curve_fit(
-            utils.lor_8, A1.k[1], mdc, p_mdc_i, bounds=p_mdc_bounds)
+            utils.lor_8, A1.k[1], mdc, p_mdc_i, bounds=p_mdc_bounds,
+            jac=utils.lor_8_jac)
 
     # plot fit and background
     b_mdc = utils.poly_2(A1.k[1], *p_mdc[-3:])
@@ -429,7 +430,8 @@ def fig2(print_fig=True):
 
     # fitting data
     p_mdc_d, cov_mdc = curve_fit(
-            utils.lor_6, D.kx[0, :], mdc_d, p_mdc_d_i, bounds=p_mdc_d_bounds)
+            utils.lor_6, D.kx[0, :], mdc_d, p_mdc_d_i, bounds=p_mdc_d_bounds,
+            jac=utils.lor_6_jac)
 
     # fit and background
     b_mdc_d = utils.poly_2(D.kx[0, :], *p_mdc_d[-3:])
@@ -461,7 +463,8 @@ def fig2(print_fig=True):
 
     # fit MDC
     p_mdc, cov_mdc = curve_fit(
-            utils.lor_4, D.ky[:, 0], mdc, p_mdc_i, bounds=p_mdc_bounds)
+            utils.lor_4, D.ky[:, 0], mdc, p_mdc_i, bounds=p_mdc_bounds,
+            jac=utils.lor_4_jac)
 
     # fit and background
     b_mdc = utils.poly_2(D.ky[:, 0], *p_mdc[-3:])
@@ -1395,7 +1398,8 @@ def fig4(print_fig=True):
                 p_fl, cov_fl = curve_fit(utils.FL_spectral_func,
                                          en[j][_EDC_e[j]][900:-1],
                                          EDCn_e[j][900:-1],
-                                         p_edc_i[:6], bounds=bounds_fl)
+                                         p_edc_i[:6], bounds=bounds_fl,
+                                         jac=utils.FL_spectral_func_jac)
 
                 f_fl = utils.FL_spectral_func(xx, *p_fl)
 
@@ -1410,7 +1414,8 @@ def fig4(print_fig=True):
                                          EDCn_e[j][bnd:-1],
                                          np.concatenate((p_fl, p_edc_i[-6:]),
                                                         axis=0),
-                                         bounds=bounds)
+                                         bounds=bounds,
+                                         jac=utils.Full_spectral_func_jac)
 
                 # plot spectral function
                 f_edc = utils.Full_spectral_func(xx, *p_edc)
@@ -1667,7 +1672,8 @@ def fig5(print_fig=False, load=True):
         p_fl, cov_fl = curve_fit(utils.FL_spectral_func,
                                  en[j][_EDC_e[j]][900:-1],
                                  EDCn_e[j][900:-1],
-                                 p_edc_i[:6], bounds=bounds_fl)
+                                 p_edc_i[:6], bounds=bounds_fl,
+                                 jac=utils.FL_spectral_func_jac)
 
         f_fl = utils.FL_spectral_func(xx, *p_fl)
 
@@ -1705,7 +1711,8 @@ def fig5(print_fig=False, load=True):
                                  en[j][_EDC_e[j]][bnd:-1],
                                  EDCn_e[j][bnd:-1],
                                  np.concatenate((p_fl, p_edc_i[-6:]), axis=0),
-                                 bounds=bounds)
+                                 bounds=bounds,
+                                 jac=utils.Full_spectral_func_jac)
 
         # plot spectral function
         f_edc = utils.Full_spectral_func(xx, *p_edc)
@@ -1842,10 +1849,46 @@ def fig6(print_fig=True, load=True):
         val, _mdc_t = utils.find(en[j][0, :], mdc_t_val)  # Get indices
         val, _mdc_b = utils.find(en[j][0, :], mdc_b_val)  # Get indices
         mdc_seq = np.arange(_mdc_t, _mdc_b, -1)  # range of indices
-        loc = np.zeros((_mdc_t - _mdc_b))  # placeholders maximum position
-        eloc = np.zeros((_mdc_t - _mdc_b))  # corresponding errors
-        width = np.zeros((_mdc_t - _mdc_b))  # placheholder HWHM
-        ewidth = np.zeros((_mdc_t - _mdc_b))  # corresponding error
+
+        # Fit all MDC's, starting at the Fermi level
+        _sl1 = 100  # Index used for background endpoint slope
+        _sl2 = 155  # other endpoint
+        d = 1e-2  # small boundary
+        eps = 1e-8  # essentially fixed boundary
+        Delta = 1e5  # essentially free boundary
+        n_free = 70  # MDC's fitted from their own initial values
+        mdc_k = k[j][:, mdc_seq].T  # MDC's k-axes
+        mdc_int = spec[j][:, mdc_seq].T  # MDC's
+        p_mdcs = np.zeros((len(mdc_seq), 6))
+        err_mdcs = np.zeros((len(mdc_seq), 6))
+
+        # first MDC's: free fits from fixed initial values
+        for n in range(n_free):
+            const_i = mdc_int[n, -1]  # constant background estimation
+            slope_i = ((mdc_int[n, _sl1] - mdc_int[n, _sl2]) /
+                       (mdc_k[n, _sl1] - mdc_k[n, _sl2]))  # slope estimation
+
+            # initial values
+            # p0: position, p1: width, p2: amplitude
+            # p3: constant bkg, p4: slope, p5: curvature
+            p_mdc_i = np.array([-.27, 5e-2, 1e-3, const_i, slope_i, .0])
+            bounds = (p_mdc_i - [Delta, Delta, Delta, Delta, Delta, eps],
+                      p_mdc_i + [Delta, Delta, Delta, Delta, Delta, eps])
+            p_mdcs[n], c_mdc = curve_fit(utils.lor, mdc_k[n], mdc_int[n],
+                                         p0=p_mdc_i, bounds=bounds,
+                                         jac=utils.lor_jac)
+            err_mdcs[n] = np.sqrt(np.diag(c_mdc))
+
+        # all other MDC's start from the fit of the previous one, position
+        # and width within d, slope and curvature fixed
+        dbounds = np.array([d, d, Delta, Delta, eps, eps])
+        p_fit, p_err = utils.mdc_fit(mdc_k[n_free - 1:],
+                                     mdc_int[n_free - 1:],
+                                     p_mdcs[n_free - 1], ch=0,
+                                     dbounds=dbounds, fit_seed=False)[4:]
+        p_mdcs[n_free:], err_mdcs[n_free:] = p_fit[1:], p_err[1:]
+        loc, eloc = p_mdcs[:, 0], err_mdcs[:, 0]  # position of fits
+        width, ewidth = p_mdcs[:, 1], err_mdcs[:, 1]  # HWHM of fits
 
         # first row
         ax = fig.add_subplot(4, 4, j+1)
@@ -1894,11 +1937,8 @@ def fig6(print_fig=True, load=True):
 
         n = 0  # counter
 
-        # Extract MDC's and fit
-        p_mdc = []
+        # Extract MDC's and plot fits
         for i in mdc_seq:
-            _sl1 = 100  # Index used for background endpoint slope
-            _sl2 = 155  # other endpoint
             n += 1
             mdc_k = k[j][:, i]  # current MDC k-axis
             mdc_int = spec[j][:, i]  # current MDC
@@ -1906,53 +1946,7 @@ def fig6(print_fig=True, load=True):
             if any(x == n for x in [1, 50, 100]):
                 plt.errorbar(mdc_k, mdc_int-scale * n**1.15, mdc_eint,
                              lw=.5, capsize=.1, color=cols[j], fmt='o', ms=.5)
-
-            # Fit MDC
-            d = 1e-2  # small boundary
-            eps = 1e-8  # essentially fixed boundary
-            Delta = 1e5  # essentially free boundary
-
-            const_i = mdc_int[-1]  # constant background estimation
-            slope_i = ((mdc_int[_sl1] - mdc_int[_sl2]) /
-                       (mdc_k[_sl1] - mdc_k[_sl2]))  # slope estimation
-
-            # initial values
-            p_mdc_i = np.array([-.27, 5e-2, 1e-3, const_i, slope_i, .0])
-
-            # take fixed initial values until it reaches THIS iteration,
-            # then take last outcome as inital values
-            if n > 70:
-                p_mdc_i = p_mdc
-
-                # p0: position, p1: width, p2: amplitude
-                # p3: constant bkg, p4: slope, p5: curvature
-                bounds_bot = np.array([p_mdc_i[0] - d, p_mdc_i[1] - d,
-                                       p_mdc_i[2] - Delta, p_mdc_i[3] - Delta,
-                                       p_mdc_i[4] - eps, p_mdc_i[5] - eps])
-                bounds_top = np.array([p_mdc_i[0] + d, p_mdc_i[1] + d,
-                                       p_mdc_i[2] + Delta, p_mdc_i[3] + Delta,
-                                       p_mdc_i[4] + eps, p_mdc_i[5] + eps])
-            else:
-                bounds_bot = np.array([p_mdc_i[0] - Delta, p_mdc_i[1] - Delta,
-                                       p_mdc_i[2] - Delta, p_mdc_i[3] - Delta,
-                                       p_mdc_i[4] - Delta, p_mdc_i[5] - eps])
-                bounds_top = np.array([p_mdc_i[0] + Delta, p_mdc_i[1] + Delta,
-                                       p_mdc_i[2] + Delta, p_mdc_i[3] + Delta,
-                                       p_mdc_i[4] + Delta, p_mdc_i[5] + eps])
-
-            # boundaries
-            bounds = (bounds_bot, bounds_top)
-
-            # fit MDC
-            p_mdc, c_mdc = curve_fit(utils.lor, mdc_k, mdc_int,
-                                     p0=p_mdc_i, bounds=bounds)
-
-            # errors estimation of parameters
-            err_mdc = np.sqrt(np.diag(c_mdc))
-            loc[n-1] = p_mdc[0]  # position of fit
-            eloc[n-1] = err_mdc[0]  # error
-            width[n-1] = p_mdc[1]  # HWHM of fit (2 times this value is FWHM)
-            ewidth[n-1] = err_mdc[1]  # error
+            p_mdc = p_mdcs[n-1]
 
             # Plot Background and fit
             b_mdc = utils.poly_2(mdc_k, *p_mdc[-3:])  # background
@@ -1993,7 +1987,7 @@ def fig6(print_fig=True, load=True):
 
         # fit data
         p_im, c_im = curve_fit(utils.poly_2, -loc_en, width, p0=p_im_i,
-                               bounds=im_bounds)
+                               bounds=im_bounds, jac=utils.poly_2_jac)
 
         ax.plot(-loc_en, utils.poly_2(-loc_en, *p_im), '--', color=cols_r[j])
         print(np.sqrt(np.diag(c_im)))
@@ -2048,7 +2042,8 @@ def fig6(print_fig=True, load=True):
 
         # fit Real part
         p_re, c_re = curve_fit(utils.poly_1, -loc_en[_bot:_top], re[_bot:_top],
-                               p0=p_re_i, bounds=re_bounds)
+                               p0=p_re_i, bounds=re_bounds,
+                               jac=utils.poly_1_jac)
         dre = -p_re[1]  # dReS / dw
         edre = np.sqrt(np.diag(c_re))[1]
         ax.plot(-loc_en, utils.poly_1(-loc_en, *p_re),
@@ -2272,7 +2267,8 @@ def fig8(print_fig=True):
     p_max_i = np.array([0, 0])
 
     # fit
-    p_max, c_max = curve_fit(utils.poly_1, max_k, max_en, p0=p_max_i)
+    p_max, c_max = curve_fit(utils.poly_1, max_k, max_en, p0=p_max_i,
+                             jac=utils.poly_1_jac)
 
     # extract Fermi velocity
     v_LDA = p_max[1]
@@ -3537,7 +3533,8 @@ def fig19(print_fig=True):
 
     # MDC fit
     p_mdc, cov_mdc = curve_fit(
-            utils.lor_7, D.k[1], mdc, p_mdc_i, bounds=p_mdc_bounds)
+            utils.lor_7, D.k[1], mdc, p_mdc_i, bounds=p_mdc_bounds,
+            jac=utils.lor_7_jac)
     b_mdc = utils.poly_2(D.k[1], *p_mdc[-3:])  # background
     f_mdc = utils.lor_7(D.k[1], *p_mdc) - b_mdc  # fit
     f_mdc[0] = -.05
@@ -5001,7 +4998,8 @@ def fig30(print_fig=True):
 
     # fit MDC
     p_mdc, cov_mdc = curve_fit(
-            utils.lor_8, A1.k[1], mdc, p_mdc_i, bounds=p_mdc_bounds)
+            utils.lor_8, A1.k[1], mdc, p_mdc_i, bounds=p_mdc_bounds,
+            jac=utils.lor_8_jac)
 
     # plot fit and background
     b_mdc = utils.poly_2(A1.k[1], *p_mdc[-3:])
@@ -5381,7 +5379,7 @@ def fig31(print_fig=True):
     p_im_i = np.array([0, 0, 20])
     im_bounds = (im_bot, im_top)  # boundaries
     p_im, cov_im = curve_fit(utils.poly_2, en, im[spec], p0=p_im_i,
-                             bounds=im_bounds)
+                             bounds=im_bounds, jac=utils.poly_2_jac)
     im_f = 23*(en-.005)**2
     ax1.plot(en, im_f, 'm--', lw=1.5, zorder=.2)
     chi2 = np.sum((im_f - im[spec])**2 / eim[spec])
@@ -6515,7 +6513,8 @@ def fig36(print_fig=True):
                 p_fl, cov_fl = curve_fit(utils.FL_spectral_func,
                                          en[j][_EDC_e[j]][900:-1],
                                          EDCn_e[j][900:-1],
-                                         p_edc_i[:6], bounds=bounds_fl)
+                                         p_edc_i[:6], bounds=bounds_fl,
+                                         jac=utils.FL_spectral_func_jac)
 
                 f_fl = utils.FL_spectral_func(xx, *p_fl)
 
@@ -6530,7 +6529,8 @@ def fig36(print_fig=True):
                                          EDCn_e[j][bnd:-1],
                                          np.concatenate((p_fl, p_edc_i[-6:]),
                                                         axis=0),
-                                         bounds=bounds)
+                                         bounds=bounds,
+                                         jac=utils.Full_spectral_func_jac)
 
                 # plot spectral function
 #                f_edc = utils.Full_spectral_func(xx, *p_edc)
@@ -6796,7 +6796,7 @@ def fig37(print_fig=True):
     eim_wd = eim[spec][:bnd]
 
     p_im, cov_im = curve_fit(utils.poly_2, en_wd, im_wd, p0=p_im_i,
-                             bounds=im_bounds)
+                             bounds=im_bounds, jac=utils.poly_2_jac)
 
     im_f = utils.poly_2(en_wd, *p_im)
     ax2.plot(en, utils.poly_2(en, *p_im)-const, 'b--', lw=1.5, zorder=.2)
@@ -6813,7 +6813,7 @@ def fig37(print_fig=True):
         im_wd = im[spec][:i]
         eim_wd = eim[spec][:i]
         p_im, cov_im = curve_fit(utils.poly_2, en_wd, im_wd, p0=p_im_i,
-                                 bounds=im_bounds)
+                                 bounds=im_bounds, jac=utils.poly_2_jac)
         im_f = utils.poly_2(en_wd, *p_im)
         Chi2_im[n] = np.sum((im_wd - im_f)**2/(eim_wd*1.5)**2) / len(en_wd-1)
         n += 1
@@ -6836,7 +6836,7 @@ def fig37(print_fig=True):
     im_power = np.log(im[spec][cut:])
     p_im, cov_im = curve_fit(utils.poly_1, en_power,
                              im_power, p0=p_im_i,
-                             bounds=im_bounds)
+                             bounds=im_bounds, jac=utils.poly_1_jac)
     exponent = p_im[1]
     err_exponent = (np.diag(cov_im)[1])**(1/4)
     print(exponent)
@@ -6860,7 +6860,7 @@ def fig37(print_fig=True):
         im_bounds = (im_bot, im_top)  # boundaries
         p_im, cov_im = curve_fit(utils.poly_1, en_power,
                                  im_power, p0=p_im_i,
-                                 bounds=im_bounds)
+                                 bounds=im_bounds, jac=utils.poly_1_jac)
         im_f = utils.power(np.abs(en), np.exp(p_im[0]), p_im[1])
         Chi2_alpha[i] = np.sum((im[spec] - im_f)**2/(eim[spec])**2) / len(en-1)
 
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+%%%%%%%%%%%%%%%%%%%%%%%%%%%
+      test_ARPES_utils
+%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+**Tests of the fitting engine (fit_chain) on synthetic spectra.**
+
+Run with: python -m pytest -q
+"""
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+import ARPES_utils as utils
+
+
+def _mdcs(n=160):
+    """returns k, MDCs, loc
+
+    **Dispersing Lorentzian on a quadratic background, with noise**
+    """
+
+    rng = np.random.default_rng(0)
+    k = np.linspace(-.5, -.1, 200)
+    loc = np.linspace(-.27, -.42, n)
+    MDCs = np.array([utils.lor(k, l, 3e-2 + 1e-4 * i, 1e-3, 2e-2, -1e-2, 0)
+                     for i, l in enumerate(loc)])
+    MDCs += 1e-3 * rng.standard_normal(MDCs.shape)
+
+    return k, MDCs, loc
+
+
+def _mdc_setup():
+    """returns p_ini, bounds, dbounds
+
+    **Settings of the MDC fits of PhD_chapter_CSRO.fig6**
+    """
+
+    d, eps, Delta = 1e-2, 1e-8, 1e5
+    p_ini = np.array([-.27, 5e-2, 1e-3, 2e-2, -1e-2, 0])
+    bounds = (p_ini - [Delta, Delta, Delta, Delta, Delta, eps],
+              p_ini + [Delta, Delta, Delta, Delta, Delta, eps])
+    dbounds = np.array([d, d, Delta, Delta, Delta, eps])
+
+    return p_ini, bounds, dbounds
+
+
+def test_mdc_fit_sequential():
+    k, MDCs, loc = _mdcs()
+    p_ini, bounds, dbounds = _mdc_setup()
+
+    # seed row from p_ini, then one plain chain over all other rows
+    p_seed = utils._fit_chain(utils._lor_n_p, k, MDCs[:1], p_ini,
+                              jac=utils._lor_n_p_jac, bounds=bounds)[0]
+    p_seq = utils._fit_chain(utils._lor_n_p, k, MDCs[1:], p_seed[0],
+                             jac=utils._lor_n_p_jac, bounds=bounds,
+                             dbounds=dbounds)[0]
+    p_seq = np.vstack((p_seed, p_seq))
+    p_fit = utils.mdc_fit(k, MDCs, p_ini, ch=0, bounds=bounds,
+                          dbounds=dbounds)[4]
+
+    np.testing.assert_allclose(p_fit, p_seq, rtol=0, atol=1e-10)
+    assert np.max(np.abs(p_fit[:, 0] - loc)) < 1e-2
+
+
+def test_fit_chain_chunked():
+    k, MDCs, loc = _mdcs()
+    p_ini, bounds, dbounds = _mdc_setup()
+    kwargs = dict(jac=utils._lor_n_p_jac, bounds=bounds, dbounds=dbounds)
+
+    p_seq = utils.fit_chain(utils._lor_n_p, k, MDCs, p_ini, ch=40,
+                            **kwargs)[0]
+    p_2 = utils.fit_chain(utils._lor_n_p, k, MDCs, p_ini, ch=40, n_jobs=2,
+                          n_chunks=6, **kwargs)[0]
+    p_3 = utils.fit_chain(utils._lor_n_p, k, MDCs, p_ini, ch=40, n_jobs=3,
+                          n_chunks=6, **kwargs)[0]
+
+    p_1 = utils.fit_chain(utils._lor_n_p, k, MDCs, p_ini, ch=40, n_jobs=1,
+                          n_chunks=6, **kwargs)[0]
+
+    # chunked chains find the same minima, independent of n_jobs > 1
+    np.testing.assert_allclose(p_2[:, :2], p_seq[:, :2], rtol=0, atol=1e-6)
+    np.testing.assert_array_equal(p_2, p_3)
+
+    # n_chunks is ignored by the sequential fit
+    np.testing.assert_array_equal(p_1, p_seq)
+
+
+def test_mdc_fit_given_seed():
+    k, MDCs, loc = _mdcs()
+    p_ini, bounds, dbounds = _mdc_setup()
+    dbounds[4] = 1e-8  # slope fixed as in PhD_chapter_CSRO.fig6
+
+    # rows after the seed are a plain chain starting from p_ini
+    p_seq = utils._fit_chain(utils._lor_n_p, k, MDCs[1:], p_ini,
+                             jac=utils._lor_n_p_jac, dbounds=dbounds)[0]
+    p_fit, p_err = utils.mdc_fit(k, MDCs, p_ini, ch=0, dbounds=dbounds,
+                                 fit_seed=False)[4:]
+
+    np.testing.assert_array_equal(p_fit[0], p_ini)
+    assert np.all(np.isinf(p_err[0]))
+    np.testing.assert_array_equal(p_fit[1:], p_seq)
+
+
+def test_gold_fit():
+    rng = np.random.default_rng(1)
+    kB = 8.6173303e-5
+    en = np.linspace(67.2, 67.5, 150)
+    ang = np.linspace(-15, 15, 101)
+    Ef = 67.38 + 2e-5 * ang ** 2  # curved Fermi level
+    p_true = [(30 * kB, e, 1e3, 20, -5) for e in Ef]
+    EDCs = np.array([utils.FDsl(en, *p) for p in p_true])
+    EDCs += np.sqrt(EDCs) * rng.standard_normal(EDCs.shape)
+    p_ini = [6 * kB, 67.38, np.max(EDCs[50]), 20, 0]
+
+    # every channel fitted from the initial guess
+    p_ind = np.array([curve_fit(utils.FDsl, en, EDC, p_ini)[0]
+                      for EDC in EDCs])
+    p_fit, p_err = utils.gold_fit(en, EDCs, p_ini, ch=50)[:2]
+    p_chunk = utils.gold_fit(en, EDCs, p_ini, ch=50, n_jobs=2,
+                             n_chunks=6)[0]
+
+    # same minima: Fermi level and temperature agree within their errors
+    for p in (p_fit, p_chunk):
+        assert np.all(np.abs(p[:, :2] - p_ind[:, :2]) < 1e-2 * p_err[:, :2])
+
+
+def test_gold_load_legacy(tmp_path):
+    folder = str(tmp_path)
+    np.savetxt(tmp_path / 'Ef_1.dat', np.full(5, 67.38))
+    np.savetxt(tmp_path / 'norm_1.dat', np.ones(5))
+    Ef, norm = utils.gold_load(folder, 1)
+    np.testing.assert_array_equal(norm, 1)
+
+    # regenerated norm file with unchanged Ef file is read again
+    np.savetxt(tmp_path / 'norm_1.dat', np.full(5, 12.5))
+    Ef, norm = utils.gold_load(folder, 1)
+    np.testing.assert_array_equal(norm, 12.5)
+
+
+def test_write_atomic(tmp_path):
+    path = str(tmp_path / 'a.npy')
+    utils.write_atomic(path, lambda f: np.save(f, np.arange(3)))
+    np.testing.assert_array_equal(np.load(path), np.arange(3))
+
+    # failed writes leave the old file and no temporary file behind
+    def fail(f):
+        f.write(b'partial')
+        raise OSError('disk full')
+    try:
+        utils.write_atomic(path, fail)
+    except OSError:
+        pass
+    np.testing.assert_array_equal(np.load(path), np.arange(3))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.npy']
+
+
+def test_gold_load_Ef_only(tmp_path):
+    np.savetxt(tmp_path / 'Ef_2.dat', np.full(5, 67.38))
+    Ef, norm = utils.gold_load(str(tmp_path), 2)
+    np.testing.assert_array_equal(Ef, 67.38)
+    assert norm is None
+
+
+def test_gold_store(tmp_path):
+    folder = str(tmp_path)
+    key = utils.gold_save(folder, 3, np.full(5, 67.38), np.arange(5.),
+                          Ef_ini=67.38)
+    Ef, norm = utils.gold_load(folder, 3)
+    np.testing.assert_array_equal(norm, np.arange(5.))
+    assert utils.gold_load(folder, 3, Ef_ini=67.38)[0][0] == 67.38
+    assert sorted(p.name for p in (tmp_path / 'gold_cache').iterdir()) == [
+            key + '.npy', 'index.json']
@@ -233,7 +233,8 @@ def Stabilization(print_fig=True):
     bounds_top = np.concatenate((p_i[0:-3] + np.inf, p_i[-3:] + eps))
     p_bounds = (bounds_bot, bounds_top)
 
-    popt, pcov = curve_fit(utils.gauss, T_bin, n, p0=p_i, bounds=p_bounds)
+    popt, pcov = curve_fit(utils.gauss, T_bin, n, p0=p_i, bounds=p_bounds,
+                           jac=utils.gauss_jac)
     fit = utils.gauss(temp, *popt)
 
     ax3.plot(T_bin, n, 'r.')
@@ -33,8 +33,8 @@ def find(array, val):
 
     Args
     ----
-    :array:     entry value in array
-    :_val:      index of entry
+    :array:     1D array or Axis
+    :val:       value, or array of values searched at once
 
     Return
     ------
@@ -42,12 +42,147 @@ def find(array, val):
     :_val:          index of entry
     """
 
-    array = np.asarray(array)
-    _val = (np.abs(array - val)).argmin()
+    if isinstance(array, Axis):
+        _val = array.index(val)
+        array = array.array
+    elif np.ndim(val) == 0 or np.ndim(array) != 1:  # as argmin over array
+        array = np.asarray(array)
+        _val = (np.abs(array - val)).argmin()
+    else:
+        array = Axis(array)
+        _val = array.index(val)
+        array = array.array
 
     return array[_val], _val
 
 
+class Axis:
+    """
+    %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+              Sorted axis index
+    %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+    **Nearest-index lookup along the last axis of an array (e.g. one energy
+    axis per angle). Monotonic axes are searched by bisection in O(log n),
+    any other array falls back to argmin. Ties resolve to the first index,
+    same as argmin.**
+    """
+    def __init__(self, array):
+        """returns self.array, self.sorted
+
+        **Initializing axis**
+
+        Args
+        ----
+        :array:     axis values, (n) or (..., n)
+
+        Return
+        ------
+        :self.array:    axis values
+        :self.sorted:   'True' if all rows are monotonic in the same direction
+        """
+
+        self.array = np.asarray(array)
+        self.sorted = False
+        self._desc = False
+        if self.array.ndim >= 1 and self.array.shape[-1] > 1:
+            d = np.diff(self.array, axis=-1)
+            if np.all(d >= 0):
+                self.sorted = True
+            elif np.all(d <= 0):
+                self.sorted = True
+                self._desc = True
+
+    def index(self, val):
+        """returns _val
+
+        **Index of the entry closest to val along the last axis, vectorized
+        over val. For (..., n) arrays val broadcasts against (...)**
+
+        Args
+        ----
+        :val:       value or array of values
+
+        Return
+        ------
+        :_val:      index (shape of val, broadcast against (...))
+        """
+
+        a = self.array
+        if not self.sorted:
+            if a.ndim == 1 and np.ndim(val) == 0:
+                return (np.abs(a - val)).argmin()
+            if a.ndim == 1:
+                _val = [(np.abs(a - v)).argmin() for v in np.ravel(val)]
+                return np.reshape(_val, np.shape(val))
+            return (np.abs(a - np.asarray(val)[..., None])).argmin(axis=-1)
+
+        if self._desc:
+            a = a[..., ::-1]
+        n = a.shape[-1]
+        if a.ndim == 1 and isinstance(val, (int, float, np.generic)):
+            if val != val:  # argmin of nan
+                return 0
+            i = min(max(int(a.searchsorted(val)), 1), n - 1)
+            lo = val - a[i - 1]
+            hi = a[i] - val
+            if self._desc:
+                j = i - 1 if lo < hi else i
+                if j < n - 1 and a[j + 1] == a[j]:
+                    j = int(a.searchsorted(a[j], 'right')) - 1
+                return n - 1 - j
+            j = i - 1 if lo <= hi else i
+            if j > 0 and a[j - 1] == a[j]:
+                j = int(a.searchsorted(a[j], 'left'))
+            return j
+
+        val = np.asarray(val)
+        if a.ndim > 1:
+            shape = np.broadcast_shapes(val.shape, a.shape[:-1])
+            a = np.broadcast_to(a, shape + (n,))
+            val = np.broadcast_to(val, shape)
+        i = np.clip(_search(a, val, 'left'), 1, n - 1)
+        lo = val - _take(a, i - 1)
+        hi = _take(a, i) - val
+        if self._desc:  # ties go to the higher index in reversed order
+            j = np.where(lo < hi, i - 1, i)
+            _val = n - _search(a, _take(a, j), 'right')
+        else:
+            j = np.where(lo <= hi, i - 1, i)
+            _val = _search(a, _take(a, j), 'left')
+        _val = np.where(np.isnan(val), 0, _val)  # argmin of nan
+
+        return _val
+
+
+def _search(a, val, side):
+    """returns searchsorted(a, val, side) along the last axis of a,
+    a and val broadcast to a.shape[:-1] == val.shape if a is not 1D"""
+    if a.ndim == 1:
+        return a.searchsorted(val, side)
+
+    # bisection on all rows at once
+    n = a.shape[-1]
+    lo = np.zeros(val.shape, dtype=int)
+    hi = np.full(val.shape, n)
+    for _ in range(n.bit_length()):
+        mid = (lo + hi) // 2
+        a_mid = _take(a, np.minimum(mid, n - 1))
+        go = (a_mid < val) if side == 'left' else (a_mid <= val)
+        run = lo < hi
+        lo = np.where(run & go, mid + 1, lo)
+        hi = np.where(run & ~go, mid, hi)
+
+    return lo
+
+
+def _take(a, idx):
+    """returns a[..., idx] row by row (a[idx] if a is 1D)"""
+    if a.ndim == 1:
+        return a[idx]
+    return np.take_along_axis(a, idx[..., None], -1)[..., 0]
+
+
 def I_1(n):
     """returns integral I_1
 